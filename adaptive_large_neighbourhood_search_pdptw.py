@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: adaptive_large_neighbourhood_search_pdptw.py
+@time: 2020/10/31 10:05
+@description:求解PDPTW问题的自适应大邻域搜索（ALNS，Ropke & Pisinger 2006），用于pdptw600~pdptw1000的大规模算例
+==每次迭代用一个移除算子从当前解中移除q个请求，再用一个插入算子把它们（以及其他未安排的请求）插回去
+==移除算子（REMOVAL_OPERATORS）：random随机移除；worst移除节省成本最多的请求（按Vehicle.evaluate_splice增量评价）；
+==  shaw移除彼此相关的请求（相关度见request_compatibility.relatedness_matrix，距离、左时间窗、需求量归一化后加权），
+==  候选只取算例共享的请求k近邻（Instance.neighbourhood，按取货点和送货点的中点），相关度只对候选计算，
+==  不建立m*m的相关度矩阵，每次移除O(q*k)
+==插入算子（INSERTION_OPERATORS）：greedy贪婪插入、regret2/regret3后悔值插入（insertion_heuristic），
+==  插入位置由RouteBatch在前缀数组上向量化评价，只有真正插入的车辆才更新路径信息（并且可以命中路径评价缓存）
+==算子权重：每segment_size次迭代更新一次，w = (1 - reaction) * w + reaction * 得分 / 使用次数，
+==  得分：得到新的最好解SCORE_BEST，比当前解好SCORE_BETTER，被接受的、没有访问过的较差解SCORE_ACCEPTED
+==接受准则：模拟退火，初始温度使比初始解差start_worse（相对总距离）的解以0.5的概率被接受，
+==  温度按已用时间（或迭代次数）的比例从T0指数下降到T0*final_ratio，所以总是在墙钟时间预算内完成整个降温过程
+==任何车辆都不能单独服务的请求（request_compatibility的'vehicle'语义）不参与移除和插入，一直留在unassigned中
+"""
+import math
+import random
+import time
+
+import numpy as np
+
+import profiler
+from insertion_heuristic import greedy_insertion, regret_insertion
+from node import PICKUP
+from read_data import read_data
+from request_compatibility import single_request_feasible
+from solution import SOFT_PENALTY, UNASSIGNED_PENALTY, Solution
+from vehicle import move_window
+
+SCORE_BEST, SCORE_BETTER, SCORE_ACCEPTED = 33, 9, 13  # Ropke & Pisinger (2006)的σ1、σ2、σ3
+MIN_WEIGHT = 0.1  # 算子权重的下限，避免某个算子再也不会被选中
+CHECK_TIME_EVERY = 10  # 每隔多少次迭代检查一次运行时间
+SHAW_NEIGHBOURS = 40  # Shaw移除的候选请求数（请求的k近邻）
+
+
+class SearchContext(object):
+    '''
+    ALNS各算子共用的数据：
+    partner:List,取货点对应的送货点（送货点对应的取货点）
+    node_type:List,点的类型
+    row_of:Dict,键为取货点编号，值为请求行号（instance.requests的行号）
+    neighbours:ndarray,形状(m, k)，每个请求最近的k个请求的行号（按取货点和送货点的中点，见spatial_index.py）
+    servable:List,可以被某辆车单独服务的请求（取货点编号）
+    soft_penalty:float,单位软时间窗违背量的惩罚
+    '''
+
+    def __init__(self, instance, soft_penalty, shaw_weights):
+        nodes = instance.nodes
+        self.partner = nodes.partner
+        self.node_type = nodes.node_type
+        pickups, deliveries = instance.requests[:, 0], instance.requests[:, 1]
+        self.row_of = {p: r for r, p in enumerate(pickups.tolist())}
+        self.pickups, self.deliveries = pickups, deliveries
+        self.neighbours = instance.neighbourhood.requests(max(0, min(SHAW_NEIGHBOURS, len(pickups) - 1)))
+        self.distance = instance.matrix.distance
+        self.ready = np.asarray(instance.ready_time, dtype=np.float64)
+        self.load = np.asarray(instance.demand, dtype=np.float64)[pickups]
+        # 距离、时间、需求量分别归一化到[0, 1]后加权（Ropke & Pisinger 2006的φ=9、χ=3、ψ=2）
+        phi, chi, psi = shaw_weights
+        self.shaw_weights = (phi / max(instance.matrix.longest_distance, 1e-9), chi / max(instance.latest_time, 1.0),
+                             psi / max(instance.capacity, 1))
+        self.servable = pickups[single_request_feasible(instance, 'vehicle')].tolist()
+        self.soft_penalty = soft_penalty
+
+    def relatedness(self, ref, rows):
+        """请求ref与请求rows（行号数组）的Shaw相关度，越小越相关（与request_compatibility.relatedness_matrix相同）"""
+        phi, chi, psi = self.shaw_weights
+        p, d, ready = self.pickups, self.deliveries, self.ready
+        return (phi * (self.distance[p[ref], p[rows]] + self.distance[d[ref], d[rows]])
+                + chi * (np.abs(ready[p[rows]] - ready[p[ref]]) + np.abs(ready[d[rows]] - ready[d[ref]]))
+                + psi * np.abs(self.load[rows] - self.load[ref]))
+
+    def assigned(self, solution):
+        """已经安排、可以移除的请求（取货点编号，不含取货点已经冻结的请求，见Vehicle.frozen），按车辆和路径顺序"""
+        node_type = self.node_type
+        return [n for veh in solution.vehicles for n in veh.route[veh.frozen:] if node_type[n] == PICKUP]
+
+
+def _pick(pool_size, rng, randomness):
+    """从按优先程度排好序的候选中随机选一个下标，randomness越大越偏向排在前面的候选（y^p，y为[0, 1)的随机数）"""
+    return int(rng.random() ** randomness * pool_size)
+
+
+def random_removal(ctx, solution, q, rng):
+    """随机移除q个请求"""
+    assigned = ctx.assigned(solution)
+    return rng.sample(assigned, min(q, len(assigned)))
+
+
+def worst_removal(ctx, solution, q, rng, randomness=3):
+    """移除q个从路径中删除后节省成本（距离+软时间窗惩罚）最多的请求，按节省量排序后随机偏向前面的请求"""
+    saving = []
+    for veh in solution.vehicles:
+        route = veh.route
+        for ip in range(veh.frozen, len(route) - 1):
+            p = route[ip]
+            if ctx.node_type[p] != PICKUP:
+                continue
+            id_ = route.index(ctx.partner[p], ip)
+            delta_distance, delta_soft, _ = veh.evaluate_splice(*move_window(route, ip, id_))
+            saving.append((delta_distance + ctx.soft_penalty * delta_soft, p))
+    saving.sort()  # 成本变化最小（节省最多）的在前
+    pool = [p for _, p in saving]
+    return [pool.pop(_pick(len(pool), rng, randomness)) for _ in range(min(q, len(pool)))]
+
+
+def shaw_removal(ctx, solution, q, rng, randomness=6):
+    """移除q个彼此相关的请求：随机选一个请求，之后每次从已移除的请求中随机选一个，在它还没有被移除的近邻请求中
+    移除与它最相关的请求（随机偏向）；近邻请求都已经移除或没有安排时，在所有剩余的请求中选择
+    """
+    pool = {ctx.row_of[p]: p for p in ctx.assigned(solution)}  # 键为请求行号
+    if not pool:
+        return []
+    rows = list(pool)
+    removed_rows = [rows[rng.randrange(len(rows))]]
+    removed = [pool.pop(removed_rows[0])]
+    while len(removed) < q and pool:
+        ref = rng.choice(removed_rows)
+        rows = [r for r in ctx.neighbours[ref].tolist() if r in pool] or list(pool)
+        order = np.argsort(ctx.relatedness(ref, np.array(rows, dtype=np.int64)), kind='stable')
+        r = rows[int(order[_pick(len(rows), rng, randomness)])]
+        removed_rows.append(r)
+        removed.append(pool.pop(r))
+    return removed
+
+
+def _greedy(solution, requests, soft_penalty, rng):
+    return greedy_insertion(solution, requests, soft_penalty=soft_penalty, rng=rng)
+
+
+def _regret2(solution, requests, soft_penalty, rng):
+    return regret_insertion(solution, requests, k=2, soft_penalty=soft_penalty, rng=rng)
+
+
+def _regret3(solution, requests, soft_penalty, rng):
+    return regret_insertion(solution, requests, k=3, soft_penalty=soft_penalty, rng=rng)
+
+
+# 可选的移除算子，键为算子名称，值为函数(上下文, 解, 移除数量, 随机数生成器)，返回要移除的请求（取货点编号）列表
+REMOVAL_OPERATORS = {
+    'random': random_removal,
+    'worst': worst_removal,
+    'shaw': shaw_removal,
+}
+
+# 可选的插入算子，键为算子名称，值为函数(解, 待插入的请求, 软时间窗惩罚, 随机数生成器)，原地修改解
+INSERTION_OPERATORS = {
+    'greedy': _greedy,
+    'regret2': _regret2,
+    'regret3': _regret3,
+}
+
+
+class AdaptiveWeights(object):
+    '''
+    轮盘赌选择的自适应算子权重：
+    names:List,算子名称
+    weights:List,当前权重
+    scores,uses:List,当前segment中每个算子的累计得分和使用次数
+    total_uses:List,整个搜索中每个算子的使用次数
+    '''
+
+    def __init__(self, names, reaction):
+        self.names = list(names)
+        self.reaction = reaction
+        self.weights = [1.0] * len(self.names)
+        self.scores = [0.0] * len(self.names)
+        self.uses = [0] * len(self.names)
+        self.total_uses = [0] * len(self.names)
+
+    def choose(self, rng):
+        k = rng.choices(range(len(self.names)), self.weights)[0]
+        self.uses[k] += 1
+        self.total_uses[k] += 1
+        return k
+
+    def reward(self, k, score):
+        self.scores[k] += score
+
+    def update(self):
+        """segment结束时更新权重并清零得分"""
+        for k in range(len(self.names)):
+            if self.uses[k]:
+                self.weights[k] = max(MIN_WEIGHT, (1 - self.reaction) * self.weights[k] +
+                                      self.reaction * self.scores[k] / self.uses[k])
+        self.scores = [0.0] * len(self.names)
+        self.uses = [0] * len(self.names)
+
+    def as_dict(self):
+        return {name: {'weight': w, 'uses': u} for name, w, u in zip(self.names, self.weights, self.total_uses)}
+
+
+def solution_signature(solution):
+    """解的签名（所有非空路径的集合），用于判断解是否已经访问过"""
+    return hash(frozenset(veh.route.tobytes() for veh in solution.vehicles if len(veh.route) > 2))
+
+
+def adaptive_large_neighbourhood_search(instance, time_limit=60, max_iterations=None, initial_solution=None,
+                                        removal_range=(4, 60), removal_fraction=0.4, segment_size=100,
+                                        reaction=0.1, start_worse=0.05, final_ratio=0.002,
+                                        shaw_weights=(9.0, 3.0, 2.0), removal_operators=None,
+                                        insertion_operators=None, soft_penalty=SOFT_PENALTY,
+                                        unassigned_penalty=UNASSIGNED_PENALTY, migration=None, seed=0, verbose=True):
+    """ALNS主程序，返回(最好的解, 统计信息)。
+    time_limit为运行时间上限（秒），max_iterations为迭代次数上限，两者至少给出一个；
+    每次移除的请求数q在[removal_range[0], min(removal_range[1], removal_fraction*请求数)]中均匀随机选取；
+    migration为迁移钩子（见metaheuristics.py），迁入更好的解时从它继续搜索，温度和算子权重不变
+    """
+    if time_limit is None and max_iterations is None:
+        raise ValueError('time_limit和max_iterations至少要给出一个')
+    rng = random.Random(seed)
+    start = time.time()
+    ctx = SearchContext(instance, soft_penalty, shaw_weights)
+    removals = AdaptiveWeights(removal_operators or REMOVAL_OPERATORS, reaction)
+    insertions = AdaptiveWeights(insertion_operators or INSERTION_OPERATORS, reaction)
+    servable = set(ctx.servable)
+
+    def cost_of(sol):
+        return sol.objective(soft_penalty=soft_penalty, unassigned_penalty=unassigned_penalty)
+
+    if initial_solution is None:
+        initial_solution = regret_insertion(Solution.empty(instance), sorted(servable), k=2, soft_penalty=soft_penalty)
+    current = initial_solution.copy()
+    current_cost = cost_of(current)
+    best, best_cost = current.copy(), current_cost
+    visited = {solution_signature(current)}
+
+    q_min = min(removal_range[0], len(servable))
+    q_max = max(q_min, min(removal_range[1], int(removal_fraction * len(servable))))
+    t0 = -start_worse * max(current.total_distance, 1.0) / math.log(0.5)
+    temperature = t0
+    stats = {'iterations': 0, 'accepted': 0, 'improvements': 0, 'migrants': 0, 'initial_temperature': t0,
+             'best_history': [(0, best_cost)]}
+    progress = 0.0
+    iteration = 0
+    with profiler.timer('alns.main_loop'):
+        while True:
+            if iteration % CHECK_TIME_EVERY == 0:
+                elapsed = time.time() - start
+                if time_limit is not None:
+                    if elapsed >= time_limit:
+                        break
+                    progress = elapsed / time_limit
+                if max_iterations is not None:
+                    progress = max(progress, iteration / max_iterations)
+                temperature = t0 * final_ratio ** progress
+                immigrant = migration(best_cost, best.routes) if migration is not None else None
+                if immigrant is not None:
+                    immigrant = Solution.from_routes(instance, immigrant)
+                    immigrant_cost = cost_of(immigrant)
+                    if immigrant_cost < best_cost - 1e-9:
+                        current, current_cost = immigrant, immigrant_cost
+                        best, best_cost = current.copy(), current_cost
+                        visited.add(solution_signature(current))
+                        stats['migrants'] += 1
+            if max_iterations is not None and iteration >= max_iterations:
+                break
+            iteration += 1
+
+            r = removals.choose(rng)
+            s = insertions.choose(rng)
+            candidate = current.copy()
+            q = rng.randint(q_min, q_max)
+            with profiler.timer('alns.removal.' + removals.names[r]):
+                removed = REMOVAL_OPERATORS[removals.names[r]](ctx, candidate, q, rng)
+            candidate.remove_requests(removed)
+            with profiler.timer('alns.insertion.' + insertions.names[s]):
+                INSERTION_OPERATORS[insertions.names[s]](candidate, sorted(candidate.unassigned & servable),
+                                                         soft_penalty, rng)
+            candidate_cost = cost_of(candidate)
+
+            signature = solution_signature(candidate)
+            new = signature not in visited
+            score = 0
+            if candidate_cost < best_cost - 1e-9:
+                score = SCORE_BEST
+            elif candidate_cost < current_cost - 1e-9 and new:
+                score = SCORE_BETTER
+            if candidate_cost <= current_cost or (
+                    temperature > 0 and rng.random() < math.exp(-(candidate_cost - current_cost) / temperature)):
+                if not score and new:
+                    score = SCORE_ACCEPTED
+                current, current_cost = candidate, candidate_cost
+                stats['accepted'] += 1
+            visited.add(signature)
+            removals.reward(r, score)
+            insertions.reward(s, score)
+
+            if candidate_cost < best_cost - 1e-9:
+                best, best_cost = candidate.copy(), candidate_cost
+                stats['improvements'] += 1
+                stats['best_history'].append((iteration, best_cost))
+                if verbose:
+                    print('第%s次迭代，最好的目标函数值：%.2f，使用%s辆车' % (iteration, best_cost, best.used_vehicle_num))
+            if iteration % segment_size == 0:
+                removals.update()
+                insertions.update()
+
+    elapsed = time.time() - start
+    stats['iterations'] = iteration
+    stats['time'] = elapsed
+    stats['iterations_per_second'] = iteration / elapsed if elapsed > 0 else 0
+    stats['final_temperature'] = temperature
+    stats['removal_operators'] = removals.as_dict()
+    stats['insertion_operators'] = insertions.as_dict()
+    stats['unservable'] = instance.request_num - len(servable)
+    profiler.count('alns.iterations', iteration)
+    return best, stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw1000_revised/LR1_10_1.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, alns_stats = adaptive_large_neighbourhood_search(pdptw_instance, time_limit=300)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车，未安排的请求数：{}'.format(best_solution.used_vehicle_num, len(best_solution.unassigned)))
+    print('迭代次数：', alns_stats['iterations'])
+    print('移除算子：', alns_stats['removal_operators'])
+    print('插入算子：', alns_stats['insertion_operators'])
@@ -4,5 +4,241 @@
 @contact: yuanxin9997@qq.com
 @file: ant_colony_optimization_pdptw.py
 @time: 2020/10/20 11:01
-@description:
+@description:求解PDPTW问题的并行蚁群算法（MAX-MIN Ant System + ACS的伪随机比例规则）
+==信息素tau和启发式信息（能见度）eta都保存为(n, n)的numpy矩阵，蒸发和信息素增加都是整个矩阵的向量化运算
+==候选列表：每个点只保留距离最近的k个时间窗上可以紧接着访问的取货点（只计算一次；送货点由车上待送的列表给出，不占候选列表），
+==蚂蚁每一步只在候选列表（以及车上待送的送货点）中选择下一个点，每步的代价为O(k)而不是O(n)；
+==候选列表中没有可行的点时，才扫描所有未服务的取货点，仍然没有则结束当前车辆的路径
+==并行：同一代的蚂蚁交给ProcessPoolExecutor的工作进程构造路径，算例数据和信息素矩阵放在共享内存中，
+==主进程只在两代之间更新信息素矩阵，工作进程只读
 """
+import itertools
+import os
+import random
+import time
+
+import numpy as np
+
+import profiler
+from insertion_heuristic import regret_insertion
+from node import DELIVERY, PICKUP
+from read_data import read_data
+from shared_instance import SharedArray, attach_array, attach_instance, make_executor, share_instance
+from solution import Solution
+
+EPS = 1e-6  # 距离为0时计算能见度用的下限
+
+_worker = {}  # 工作进程中的数据：算例、信息素矩阵（共享内存）、能见度矩阵、候选列表、参数
+
+
+def build_candidate_lists(instance, candidate_num=15):
+    """候选列表：形状为(n, k)的整数数组，第i行为点i之后最近的k个可以紧接着访问的取货点（按距离升序），
+    不足k个时用i自己补齐。构造路径时送货点只从车上待送的列表中选择，所以候选列表中只有取货点。
+    j可以紧接在i之后访问的条件：j是取货点、不是送货点i对应的取货点，
+    并且从i的左时间窗开始服务后出发，能在j不违背硬时间窗的最晚到达时间之前到达
+    """
+    n = instance.node_num
+    nodes = instance.nodes
+    dist = instance.matrix.distance
+    time_mat = instance.matrix.time_matrix(instance.speed)
+    node_type = np.asarray(nodes.node_type)
+    partner = np.asarray(nodes.partner)
+    latest = np.asarray(nodes.latest_arrival)
+    k = max(1, min(candidate_num, n - 1))
+
+    earliest_departure = instance.ready_time + instance.service_time
+    allowed = earliest_departure[:, None] + time_mat <= latest[None, :]
+    allowed[:, node_type != PICKUP] = False
+    allowed[np.arange(n), np.arange(n)] = False
+    deliveries = np.nonzero(node_type == DELIVERY)[0]
+    allowed[deliveries, partner[deliveries]] = False
+
+    masked = np.where(allowed, dist, np.inf)
+    nearest = np.argpartition(masked, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(masked, nearest, axis=1), axis=1)
+    nearest = np.take_along_axis(nearest, order, axis=1)
+    valid = np.isfinite(np.take_along_axis(masked, nearest, axis=1))
+    return np.where(valid, nearest, np.arange(n)[:, None])
+
+
+def heuristic_visibility(instance, beta=2.0):
+    """能见度矩阵eta**beta，eta[i, j] = 1 / d[i, j]"""
+    return np.maximum(instance.matrix.distance, EPS) ** -beta
+
+
+def _init_worker(handle, pheromone_block, candidates, params):
+    """进程池的initializer：映射共享内存中的算例和信息素矩阵，计算能见度矩阵"""
+    instance = attach_instance(handle)
+    nodes = instance.nodes
+    _worker.update(params)
+    _worker['instance'] = instance
+    _worker['pheromone'] = attach_array(pheromone_block)
+    _worker['visibility'] = heuristic_visibility(instance, params['beta'])
+    _worker['candidates'] = candidates
+    _worker['columns'] = (np.asarray(nodes.ready_time), np.asarray(nodes.service_time), np.asarray(nodes.demand),
+                          np.asarray(nodes.latest_arrival), np.asarray(nodes.node_type) == PICKUP,
+                          np.asarray(nodes.partner))
+
+
+def _choose(weights, rng, q0):
+    """ACS的伪随机比例规则：以概率q0选择tau**alpha*eta**beta最大的点，否则按其比例随机选择"""
+    if weights.shape[0] == 1 or rng.random() < q0:
+        return int(np.argmax(weights))
+    total = weights.sum()
+    if not total > 0:
+        return int(rng.integers(weights.shape[0]))
+    return int(np.searchsorted(np.cumsum(weights), rng.random() * total, side='right').clip(0, weights.shape[0] - 1))
+
+
+def _construct_ant(seed):
+    """在工作进程中构造一只蚂蚁的解：逐辆车从开始depot出发，每步在候选列表中按信息素和能见度选择下一个点，
+    无法继续时回到结束depot；车辆用完后剩余的请求用后悔值插入修复。返回(路径, 适应度, 是否可行)
+    """
+    instance = _worker['instance']
+    tau = _worker['pheromone']
+    visibility = _worker['visibility']
+    candidates = _worker['candidates']
+    alpha, q0 = _worker['alpha'], _worker['q0']
+    ready, serv, demand, latest, is_pickup, partner = _worker['columns']
+    time_mat = instance.matrix.time_matrix(instance.speed)
+    cap = instance.capacity
+    rng = np.random.default_rng(seed)
+
+    open_mask = np.zeros(instance.node_num, dtype=bool)  # 还没有服务的取货点
+    open_mask[instance.requests[:, 0]] = True
+    routes = []
+    while len(routes) < instance.vehicle_num and open_mask.any():
+        cur = instance.start_depot
+        route = [cur]
+        departure = ready[cur] + serv[cur]
+        load = 0
+        onboard = []  # 已经取货、还没有送货的送货点
+        while True:
+            row = candidates[cur]
+            arrival = departure + time_mat[cur, row]
+            ok = open_mask[row] & (arrival <= latest[row]) & (load + demand[row] <= cap)
+            cands = row[ok]
+            if onboard:
+                cands = np.concatenate([cands, np.array(onboard, dtype=cands.dtype)])
+            if cands.shape[0] == 0:
+                # 候选列表中没有可行的取货点，扫描所有未服务的取货点
+                pending = np.nonzero(open_mask)[0]
+                arrival = departure + time_mat[cur, pending]
+                cands = pending[(arrival <= latest[pending]) & (load + demand[pending] <= cap)]
+                if cands.shape[0] == 0:
+                    break
+            weights = tau[cur, cands] ** alpha * visibility[cur, cands]
+            nxt = int(cands[_choose(weights, rng, q0)])
+
+            arrival = departure + time_mat[cur, nxt]
+            departure = max(arrival, ready[nxt]) + serv[nxt]
+            load += demand[nxt]
+            route.append(nxt)
+            if is_pickup[nxt]:
+                open_mask[nxt] = False
+                onboard.append(int(partner[nxt]))
+            else:
+                onboard.remove(nxt)
+            cur = nxt
+        if len(route) == 1:
+            break
+        route.append(instance.end_depot)
+        routes.append(route)
+
+    sol = Solution.from_routes(instance, routes)
+    if sol.unassigned:
+        regret_insertion(sol, k=2)
+    return [route for route in sol.routes() if len(route) > 2], sol.objective(), sol.is_feasible()
+
+
+def _route_arcs(routes):
+    """路径经过的所有弧(i, j)，返回两个整数数组"""
+    tails = [route[k] for route in routes for k in range(len(route) - 1)]
+    heads = [route[k + 1] for route in routes for k in range(len(route) - 1)]
+    return np.array(tails, dtype=np.int64), np.array(heads, dtype=np.int64)
+
+
+def ant_colony_optimization(instance, ant_num=20, iterations=100, time_limit=None, workers=None, alpha=1.0, beta=2.0,
+                            rho=0.1, q0=0.9, candidate_num=15, initial_solution=None, migration=None, seed=0,
+                            verbose=True):
+    """并行蚁群算法主程序，返回(最好的解, 统计信息)。
+    信息素更新采用MAX-MIN Ant System：整个矩阵蒸发，再由本代最好的蚂蚁和历史最好的蚂蚁交替在其经过的弧上增加信息素，
+    最后把信息素限制在[tau_min, tau_max]之间。workers为工作进程数，默认为CPU核数；workers=1时在主进程中串行运行；
+    initial_solution为初始的历史最好解，默认为后悔值插入的解；iterations为None时只受time_limit限制；
+    migration为迁移钩子（见metaheuristics.py），每代调用一次，迁入更好的解时作为历史最好解，之后由它增加信息素
+    """
+    if iterations is None and time_limit is None:
+        raise ValueError('iterations和time_limit至少要给出一个')
+    rng = random.Random(seed)
+    start = time.time()
+    workers = workers or os.cpu_count() or 1
+    n = instance.node_num
+    stats = {'iterations': 0, 'ants': 0, 'migrants': 0, 'best_history': []}
+
+    # 用初始解（默认为后悔值插入的解）初始化信息素
+    initial = initial_solution if initial_solution is not None else regret_insertion(Solution.empty(instance), k=2)
+    best = ([route for route in initial.routes() if len(route) > 2], initial.objective(), initial.is_feasible())
+    tau_max = 1.0 / (rho * best[1])
+    tau_min = tau_max / (2.0 * n)
+    candidates = build_candidate_lists(instance, candidate_num)
+    params = {'alpha': alpha, 'beta': beta, 'q0': q0}
+
+    with share_instance(instance) as shared, SharedArray(np.full((n, n), tau_max)) as pheromone:
+        executor = make_executor(workers, _init_worker, (shared.handle, pheromone.block, candidates, params))
+        try:
+            chunksize = max(1, ant_num // (4 * workers))
+            with profiler.timer('aco.main_loop'):
+                for it in itertools.count() if iterations is None else range(iterations):
+                    if time_limit is not None and time.time() - start >= time_limit:
+                        break
+                    immigrant = migration(best[1], lambda: best[0]) if migration is not None else None
+                    if immigrant is not None:
+                        immigrant = Solution.from_routes(instance, immigrant)
+                        if immigrant.objective() < best[1]:
+                            best = ([route for route in immigrant.routes() if len(route) > 2], immigrant.objective(),
+                                    immigrant.is_feasible())
+                            tau_max = 1.0 / (rho * best[1])
+                            tau_min = tau_max / (2.0 * n)
+                            stats['migrants'] += 1
+                    seeds = [rng.randrange(1 << 30) for _ in range(ant_num)]
+                    ants = list(executor.map(_construct_ant, seeds, chunksize=chunksize))
+                    stats['ants'] += len(ants)
+                    iteration_best = min(ants, key=lambda ant: ant[1])
+                    if iteration_best[1] < best[1]:
+                        best = iteration_best
+                        tau_max = 1.0 / (rho * best[1])
+                        tau_min = tau_max / (2.0 * n)
+
+                    # 信息素更新：工作进程此时都在等待下一代的任务，主进程原地修改共享内存中的矩阵
+                    tau = pheromone.array
+                    tau *= 1.0 - rho
+                    depositor = best if it % 2 else iteration_best
+                    tails, heads = _route_arcs(depositor[0])
+                    np.add.at(tau, (tails, heads), 1.0 / depositor[1])
+                    np.clip(tau, tau_min, tau_max, out=tau)
+                    del tau
+
+                    stats['iterations'] = it + 1
+                    stats['best_history'].append(best[1])
+                    if verbose and it % 10 == 0:
+                        print('第%s代，最好的目标函数值：%.2f' % (it, best[1]))
+        finally:
+            executor.shutdown(wait=True)
+
+    elapsed = time.time() - start
+    stats['time'] = elapsed
+    stats['ants_per_second'] = stats['ants'] / elapsed if elapsed > 0 else 0
+    profiler.count('aco.iterations', stats['iterations'])
+    return Solution.from_routes(instance, best[0]), stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw100_revised/lr104.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, aco_stats = ant_colony_optimization(pdptw_instance, time_limit=60)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车'.format(best_solution.used_vehicle_num))
+    print('每秒构造蚂蚁数：', aco_stats['ants_per_second'])
+    print('程序总的运行时间：', aco_stats['time'], '秒')
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: arc_elimination.py
+@time: 2020/10/26 10:20
+@description:PDPTW数学模型（Parragh 2008）的弧消除预处理，与求解器无关（只依赖numpy），在创建模型变量之前删除不可能被使用的弧
+==消除规则（按顺序，每条弧只记在第一条使其被删除的规则下）：
+==1.开始depot到送货点、取货点到结束depot的弧
+==2.送货点到其对应取货点的弧
+==3.时间窗不可行的弧：e_i + s_i + t_ij > l_j
+==4.载量不可行的弧：经过弧(i, j)时车上同时有请求i和请求j的货物，而两者需求量之和超过车辆载量
+==5.PD点对先后顺序不可行的弧（Dumas et al. 1991; Ropke et al. 2007）：
+==  (p_i, p_j)：路径p_i→p_j→d_i→d_j和p_i→p_j→d_j→d_i都不可行
+==  (p_i, d_j)：路径p_j→p_i→d_j→d_i不可行
+==  (d_i, p_j)：路径p_i→d_i→p_j→d_j不可行
+==  (d_i, d_j)：路径p_i→p_j→d_i→d_j和p_j→p_i→d_i→d_j都不可行
+==  路径的可行性由request_compatibility按MIP的时间窗语义计算（包括从开始depot出发、回到结束depot和载量），
+==  单独一个请求都不可行时，与它相关的弧都被删除
+==同时按时间窗为每条弧计算更紧的大M：时间约束M_ij = max(0, l_i + s_i + t_ij - e_j)，
+==载货量约束M_ij = min(Q, Q + q_i) + q_j - max(0, q_j)，代替全局的2*(LatestTime+LongestDistance)和100*Q
+"""
+import numpy as np
+
+import profiler
+from read_data import read_data
+from request_compatibility import compute_compatibility
+
+ELIMINATION_RULES = ('depot', 'delivery_to_own_pickup', 'time_window', 'capacity', 'pair_precedence')
+RULE_NAMES = {
+    'depot': '开始depot到送货点、取货点到结束depot',
+    'delivery_to_own_pickup': '送货点到其对应取货点',
+    'time_window': '时间窗不可行',
+    'capacity': '载量不可行',
+    'pair_precedence': 'PD点对先后顺序不可行',
+}
+
+
+class ArcSet(object):
+    '''
+    弧消除的结果：
+    tails,heads:ndarray,保留下来的弧(i, j)的起点和终点
+    time_big_m:ndarray,每条弧时间约束的大M
+    load_big_m:ndarray,每条弧载货量约束的大M
+    total:Number,消除前的弧数
+    removed:Dict,键为消除规则，值为该规则删除的弧数
+    '''
+
+    def __init__(self, tails, heads, time_big_m, load_big_m, total, removed):
+        self.tails = tails
+        self.heads = heads
+        self.time_big_m = time_big_m
+        self.load_big_m = load_big_m
+        self.total = total
+        self.removed = removed
+
+    def __len__(self):
+        return self.tails.shape[0]
+
+    def arcs(self):
+        """保留下来的弧的列表[(i, j), ...]"""
+        return list(zip(self.tails.tolist(), self.heads.tolist()))
+
+    def big_m(self):
+        """{(i, j): (时间约束的大M, 载货量约束的大M)}"""
+        return dict(zip(self.arcs(), zip(self.time_big_m.tolist(), self.load_big_m.tolist())))
+
+    def summary(self):
+        """消除结果的文字说明"""
+        lines = ['弧总数：%s，保留：%s（%.1f%%）' % (self.total, len(self), 100.0 * len(self) / max(1, self.total))]
+        for rule in ELIMINATION_RULES:
+            lines.append('  %s：删除%s条' % (RULE_NAMES[rule], self.removed[rule]))
+        return '\n'.join(lines)
+
+
+@profiler.timed('arc_elimination')
+def eliminate_arcs(ready, due, serv, demand, requests, time_mat, capacity, start_depot=0, end_depot=None):
+    """弧消除预处理：ready、due、serv、demand为按点编号排列的数组，requests为形状(m, 2)的[取货点，送货点]数组，
+    time_mat为车辆的时间矩阵，capacity为车辆载量。返回ArcSet
+    """
+    ready = np.asarray(ready, dtype=np.float64)
+    due = np.asarray(due, dtype=np.float64)
+    serv = np.asarray(serv, dtype=np.float64)
+    demand = np.asarray(demand, dtype=np.float64)
+    requests = np.asarray(requests, dtype=np.int64).reshape(-1, 2)
+    time_mat = np.asarray(time_mat, dtype=np.float64)
+    n = ready.shape[0]
+    if end_depot is None:
+        end_depot = n - 1
+    pickups, deliveries = requests[:, 0], requests[:, 1]
+
+    # 与build_pdptw_model相同的完整弧集合：不进入开始depot，不离开结束depot，没有自环
+    allowed = np.ones((n, n), dtype=bool)
+    allowed[:, start_depot] = False
+    allowed[end_depot, :] = False
+    np.fill_diagonal(allowed, False)
+    total = int(allowed.sum())
+
+    rules = {}
+    depot = np.zeros((n, n), dtype=bool)
+    depot[start_depot, deliveries] = True
+    depot[pickups, end_depot] = True
+    rules['depot'] = depot
+
+    own = np.zeros((n, n), dtype=bool)
+    own[deliveries, pickups] = True
+    rules['delivery_to_own_pickup'] = own
+
+    rules['time_window'] = ready[:, None] + serv[:, None] + time_mat > due[None, :]
+
+    # 载量：(p_i, p_j)、(p_i, d_j)、(d_i, d_j)经过时车上同时有请求i和j的货物
+    load = demand[pickups]
+    over = load[:, None] + load[None, :] > capacity
+    np.fill_diagonal(over, False)
+    capacity_rule = np.zeros((n, n), dtype=bool)
+    capacity_rule[np.ix_(pickups, pickups)] = over
+    capacity_rule[np.ix_(pickups, deliveries)] = over
+    capacity_rule[np.ix_(deliveries, deliveries)] = over
+    rules['capacity'] = capacity_rule
+
+    # orders[i, j]的第k位为request_compatibility.INTERLEAVINGS[k]（a=i, b=j）是否可行
+    orders = compute_compatibility(ready, due, serv, demand, requests, time_mat, capacity, start_depot, end_depot,
+                                   semantics='mip').orders
+    pp = orders & 0b000110 == 0  # p_i→p_j→d_i→d_j、p_i→p_j→d_j→d_i
+    pd = orders & 0b010000 == 0  # p_j→p_i→d_j→d_i
+    dp = orders & 0b000001 == 0  # p_i→d_i→p_j→d_j
+    dd = orders & 0b100010 == 0  # p_i→p_j→d_i→d_j、p_j→p_i→d_i→d_j
+    for matrix in (pp, pd, dp, dd):
+        np.fill_diagonal(matrix, False)  # i=j时为请求自身的弧，由其他规则处理
+    precedence = np.zeros((n, n), dtype=bool)
+    precedence[np.ix_(pickups, pickups)] = pp
+    precedence[np.ix_(pickups, deliveries)] = pd
+    precedence[np.ix_(deliveries, pickups)] = dp
+    precedence[np.ix_(deliveries, deliveries)] = dd
+    rules['pair_precedence'] = precedence
+
+    removed = {}
+    for rule in ELIMINATION_RULES:
+        hit = allowed & rules[rule]
+        removed[rule] = int(hit.sum())
+        allowed &= ~hit
+
+    tails, heads = np.nonzero(allowed)
+    time_big_m = np.maximum(0.0, due[tails] + serv[tails] + time_mat[tails, heads] - ready[heads])
+    load_big_m = np.minimum(capacity, capacity + demand[tails]) + demand[heads] - np.maximum(0.0, demand[heads])
+    return ArcSet(tails, heads, time_big_m, load_big_m, total, removed)
+
+
+def eliminate_instance_arcs(instance, speed=None, capacity=None):
+    """对read_data读取的Instance做弧消除，speed和capacity默认为算例的车辆速度和载量"""
+    speed = instance.speed if speed is None else speed
+    capacity = instance.capacity if capacity is None else capacity
+    return eliminate_arcs(instance.ready_time, instance.due_time, instance.service_time, instance.demand,
+                          instance.requests, instance.matrix.time_matrix(speed), capacity, instance.start_depot,
+                          instance.end_depot)
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw100_revised/lr104.txt'
+    arc_set = eliminate_instance_arcs(read_data(data_path))
+    print(arc_set.summary())
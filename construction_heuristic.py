@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: construction_heuristic.py
+@time: 2020/10/28 10:15
+@description:顺序插入构造启发式（Solomon 1987 I1的PD点对版本），可以单独作为基准算法，也可以为MIP模型提供初始解
+==一次只构造一条路径：先按种子规则选一个请求放入空车，再反复把插入成本（增加的距离）最小的请求插入该车辆
+==（与Vehicle.insert_pd_node_at相同的插入规则），没有请求可以插入时换下一辆车
+==插入评价用RouteBatch对所有剩余请求一次向量化完成
+==时间窗的语义time_windows与request_compatibility.TIME_WINDOW_SEMANTICS相同：
+==  'strict'只接受不违背任何时间窗（包括送货点的软时间窗和结束depot的时间窗）的插入，得到的路径对Vehicle和MIP都可行；
+==  'mip'与MIP模型相同，只要求每个点的开始服务时间不晚于右时间窗（按route_schedule计算），
+==  在紧时间窗的算例（lc1、lr1）上比'strict'安排更多的请求，作为MIP的初始解（见PdptwMip.start_values）时是完整的解，
+==  但Vehicle会把在右时间窗之后才完成服务的取货点算作违背硬时间窗；
+==  'vehicle'只检查Vehicle的硬约束（送货点的右时间窗为软时间窗，按soft_penalty计入插入成本）
+"""
+import time
+
+import numpy as np
+
+import profiler
+from insertion_heuristic import RouteBatch
+from read_data import read_data
+from request_compatibility import TIME_WINDOW_SEMANTICS
+from solution import SOFT_PENALTY, Solution
+
+TOLERANCE = 1e-9
+
+
+def _earliest_due_seed(veh, p_ids, d_ids):
+    """种子请求：送货点右时间窗最早的请求"""
+    return int(np.argmin(np.asarray(veh.nodes.due_time)[d_ids]))
+
+
+def _farthest_seed(veh, p_ids, d_ids):
+    """种子请求：取货点离depot最远的请求"""
+    return int(np.argmax(veh.distance_matrix[veh.route[0], p_ids]))
+
+
+# 可选的种子规则，键为规则名称
+SEED_RULES = {
+    'earliest_due': _earliest_due_seed,
+    'farthest': _farthest_seed,
+}
+
+
+def _mip_schedule(veh):
+    """MIP语义下车辆veh的路径的开始服务时间和离开时的载货量（见route_schedule），返回(b数组, q数组)"""
+    nodes = veh.nodes
+    b, q = route_schedule(veh.route, nodes.ready_time, nodes.service_time, nodes.demand, veh.time_matrix)
+    return np.array(b), np.array(q)
+
+
+def _accept(veh, end_due, time_windows):
+    """插入后的路径是否可以接受：'mip'时每个点的开始服务时间不晚于右时间窗、载货量不超过车辆容量；
+    否则不违背Vehicle的硬约束，'strict'时还要求没有软时间窗违背、到达结束depot不晚于其右时间窗
+    """
+    if time_windows == 'mip':
+        b, q = _mip_schedule(veh)
+        return bool((b <= np.asarray(veh.nodes.due_time)[veh.route] + TOLERANCE).all() and q.max() <= veh.cap)
+    if not veh.check_vehicle_route_feasible():
+        return False
+    if time_windows == 'strict':
+        return veh.total_soft_violate_time <= TOLERANCE and veh.arrival[-1] <= end_due
+    return True
+
+
+def _cheapest_mip_insertion(veh, p_ids, d_ids):
+    """MIP语义下所有剩余请求插入到车辆veh的最小成本（增加的距离）及插入位置，返回(成本数组, i数组, j数组)，
+    不能插入的请求成本为inf；取货点插入到route[i]之前，送货点插入到route[j]之前（i == j时紧接在取货点之后）。
+    取货点使route[i]的开始服务时间推迟PF_i后，推迟量被沿途的等待时间吸收：PF_k = max(0, PF_i - (W_k - W_i))，
+    W为等待时间的前缀和；送货点之后的部分用最晚开始服务时间检查。所有(请求, i, j)一次向量化评价
+    """
+    nodes = veh.nodes
+    ready, due = np.asarray(nodes.ready_time), np.asarray(nodes.due_time)
+    serv, demand = np.asarray(nodes.service_time), np.asarray(nodes.demand)
+    dist, time_mat = veh.distance_matrix, veh.time_matrix
+    route = np.asarray(veh.route, dtype=np.int64)
+    size = route.shape[0]
+    b, q = _mip_schedule(veh)
+    leave = b + serv[route]
+    wait_prefix = np.cumsum(np.r_[0.0, b[1:] - leave[:-1] - time_mat[route[:-1], route[1:]]])
+    latest = due[route].astype(float)  # 不使后面的点违背时间窗的最晚开始服务时间
+    for k in range(size - 2, -1, -1):
+        latest[k] = min(latest[k], latest[k + 1] - serv[route[k]] - time_mat[route[k], route[k + 1]])
+    key = due[route] - b + wait_prefix
+    seg_min = np.full((size, size), np.inf)  # seg_min[i, j] = min(key[i:j])
+    seg_load = np.full((size, size), np.inf)  # seg_load[i, j] = max(q[i - 1:j])
+    for i in range(1, size):
+        seg_min[i, i + 1:] = np.minimum.accumulate(key[i:size - 1])
+        seg_load[i, i:] = np.maximum.accumulate(q[i - 1:size - 1])
+
+    pos = np.arange(1, size)
+    prev, nxt = route[pos - 1][None, :], route[pos][None, :]
+    p, d = p_ids[:, None], d_ids[:, None]
+    b_p = np.maximum(ready[p], leave[pos - 1][None, :] + time_mat[prev, p])
+    leave_p = b_p + serv[p]
+    ok_p = (b_p <= due[p] + TOLERANCE) & (seg_load[pos, pos][None, :] + demand[p] <= veh.cap)
+    delta_p = dist[prev, p] + dist[p, nxt] - dist[prev, nxt]
+    delta_d = dist[prev, d] + dist[d, nxt] - dist[prev, nxt]
+
+    # 送货点紧接在取货点之后（j == i）
+    b_d = np.maximum(ready[d], leave_p + time_mat[p, d])
+    ok = ok_p & (b_d <= due[d] + TOLERANCE) & (b_d + serv[d] + time_mat[d, nxt] <= latest[pos][None, :] + TOLERANCE)
+    adjacent = np.where(ok, dist[prev, p] + dist[p, d] + dist[d, nxt] - dist[prev, nxt], np.inf)
+
+    # 送货点插入到route[j]之前（j > i），形状(请求, i, j)
+    push = np.maximum(0.0, leave_p + time_mat[p, nxt] - b[pos][None, :])[:, :, None]
+    w_i, w_j = wait_prefix[pos][None, :, None], wait_prefix[pos - 1][None, None, :]
+    later = pos[None, :] > pos[:, None]
+    ok = (ok_p[:, :, None] & later[None, :, :] & (push <= seg_min[pos][:, pos][None, :, :] - w_i)
+          & (seg_load[pos][:, pos][None, :, :] + demand[p][:, :, None] <= veh.cap))
+    b_prev = b[pos - 1][None, None, :] + np.maximum(0.0, push - (w_j - w_i))  # route[j - 1]推迟后的开始服务时间
+    b_d = np.maximum(ready[d][:, :, None], b_prev + serv[route[pos - 1]][None, None, :]
+                     + time_mat[route[pos - 1][None, :], d][:, None, :])
+    ok &= (b_d <= due[d][:, :, None] + TOLERANCE) & \
+        (b_d + serv[d][:, :, None] + time_mat[d, nxt][:, None, :] <= latest[pos][None, None, :] + TOLERANCE)
+    apart = np.where(ok, delta_p[:, :, None] + delta_d[:, None, :], np.inf)
+
+    total = np.concatenate([adjacent, apart.reshape(p_ids.shape[0], -1)], axis=1)
+    best = np.argmin(total, axis=1)
+    cost = total[np.arange(p_ids.shape[0]), best]
+    on_adjacent = best < pos.shape[0]
+    flat = best - pos.shape[0]
+    best_i = np.where(on_adjacent, pos[best % pos.shape[0]], pos[flat // pos.shape[0]])
+    best_j = np.where(on_adjacent, best_i, pos[flat % pos.shape[0]])
+    return cost, best_i, best_j
+
+
+def _cheapest_insertion(veh, p_ids, d_ids, soft_penalty, time_windows):
+    """所有剩余请求插入到车辆veh的最小成本及插入位置，返回(成本数组, i数组, j数组)，不能插入的请求成本为inf"""
+    if time_windows == 'mip':
+        return _cheapest_mip_insertion(veh, p_ids, d_ids)
+    strict = time_windows == 'strict'
+    cost = np.full(p_ids.shape[0], np.inf)
+    best_i = np.zeros(p_ids.shape[0], dtype=np.int64)
+    best_j = np.zeros(p_ids.shape[0], dtype=np.int64)
+    batch = RouteBatch([veh])
+    rows, cols, delta, soft = batch.evaluate_feasible(p_ids, d_ids, exact_soft=not strict)
+    if strict:
+        keep = soft <= TOLERANCE
+        rows, cols, total = rows[keep], cols[keep], delta[keep]
+    else:
+        total = delta + soft_penalty * soft
+    if rows.shape[0]:
+        order = np.lexsort((total, rows))
+        first = order[np.r_[True, rows[order][1:] != rows[order][:-1]]]  # 每个请求成本最小的插入位置
+        cost[rows[first]] = total[first]
+        best_i[rows[first]] = batch.local_i[cols[first]]
+        best_j[rows[first]] = batch.local_j[cols[first]]
+    return cost, best_i, best_j
+
+
+@profiler.timed('sequential_insertion')
+def sequential_insertion(solution, requests=None, seed_rule='earliest_due', time_windows='strict',
+                         soft_penalty=SOFT_PENALTY):
+    """把requests（取货点编号，默认为solution.unassigned）依次插入到solution的空车中，一次构造一条路径；
+    无法插入的请求留在solution.unassigned中；time_windows为时间窗的语义（'strict'、'mip'或'vehicle'）
+    """
+    if time_windows not in TIME_WINDOW_SEMANTICS:
+        raise ValueError('未知的时间窗语义：%s，可选：%s' % (time_windows, ', '.join(TIME_WINDOW_SEMANTICS)))
+    nodes = solution.vehicles[0].nodes
+    seed_of = SEED_RULES[seed_rule]
+    if requests is None:
+        requests = sorted(solution.unassigned)
+    solution.unassigned.update(requests)
+    p_ids = np.array(requests, dtype=np.int64)
+    d_ids = np.array([nodes.partner[p] for p in requests], dtype=np.int64)
+
+    for veh in solution.vehicles:
+        if p_ids.shape[0] == 0:
+            break
+        if len(veh.route) > 2:
+            continue
+        empty_route = veh.route[:]
+        end_due = nodes.due_time[empty_route[-1]]
+        # 依次尝试种子请求，直到找到能单独放入空车的请求
+        candidates = np.ones(p_ids.shape[0], dtype=bool)
+        while candidates.any():
+            index = np.nonzero(candidates)[0]
+            r = index[seed_of(veh, p_ids[index], d_ids[index])]
+            veh.insert_pd_node_at(int(p_ids[r]), int(d_ids[r]), 1, 1)
+            if _accept(veh, end_due, time_windows):
+                break
+            veh.set_route(empty_route)
+            candidates[r] = False
+        else:
+            break  # 没有请求能单独放入空车，其他空车也一样
+        solution.unassigned.discard(int(p_ids[r]))
+        p_ids, d_ids = np.delete(p_ids, r), np.delete(d_ids, r)
+
+        # 反复插入成本最小的请求，直到没有请求可以插入该车辆
+        while p_ids.shape[0]:
+            cost, best_i, best_j = _cheapest_insertion(veh, p_ids, d_ids, soft_penalty, time_windows)
+            inserted = False
+            for r in np.argsort(cost, kind='stable').tolist():
+                if not np.isfinite(cost[r]):
+                    break
+                route = veh.route[:]
+                veh.insert_pd_node_at(int(p_ids[r]), int(d_ids[r]), int(best_i[r]), int(best_j[r]))
+                if _accept(veh, end_due, time_windows):
+                    inserted = True
+                    break
+                veh.set_route(route)  # 结束depot的时间窗被违背时撤销，尝试下一个请求
+            if not inserted:
+                break
+            solution.unassigned.discard(int(p_ids[r]))
+            p_ids, d_ids = np.delete(p_ids, r), np.delete(d_ids, r)
+    return solution
+
+
+def construction_heuristic(instance, seed_rule='earliest_due', time_windows='strict', soft_penalty=SOFT_PENALTY,
+                           verbose=True):
+    """顺序插入构造启发式主程序，返回(解, 统计信息)；作为MIP的初始解时time_windows用'mip'"""
+    start = time.time()
+    solution = sequential_insertion(Solution.empty(instance), instance.requests[:, 0].tolist(), seed_rule,
+                                    time_windows, soft_penalty)
+    stats = {'time': time.time() - start, 'unassigned': len(solution.unassigned)}
+    if verbose:
+        print('构造时间：%.4f秒，未安排的请求数：%s' % (stats['time'], stats['unassigned']))
+    return solution, stats
+
+
+def route_schedule(route, ready, serv, demand, time_mat):
+    """按MIP模型的定义计算路径上每个点的开始服务时间b（不早于左时间窗，不提前开始）和离开时的载货量q，返回(b列表, q列表)"""
+    b = [float(ready[route[0]])]
+    q = [float(demand[route[0]])]
+    for prev, node in zip(route[:-1], route[1:]):
+        b.append(max(float(ready[node]), b[-1] + float(serv[prev]) + float(time_mat[prev, node])))
+        q.append(q[-1] + float(demand[node]))
+    return b, q
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw100_revised/lc101.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, construction_stats = construction_heuristic(pdptw_instance)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车'.format(best_solution.used_vehicle_num))
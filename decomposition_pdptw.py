@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: decomposition_pdptw.py
+@time: 2020/11/03 14:30
+@description:大规模PDPTW的先聚类后求解（cluster-first）分解：聚类 -> 并行求解子问题 -> 合并 -> 跨类改进
+==聚类：把每个运输请求表示为(取货点坐标, 送货点坐标, 取货点左时间窗, 送货点左时间窗)，各维按标准差归一化
+==  （时间维再乘以time_weight）后做k-means（k-means++初始化），每类约cluster_size个请求
+==子问题：每一类请求加上首尾depot构成一个独立的子算例（点重新编号，距离矩阵取原矩阵的子矩阵），
+==  由进程池的工作进程求解（算例数据放在共享内存中，见shared_instance.py）：先用ALNS求解，
+==  点数不超过exact_max_nodes、ALNS安排了全部请求并且有可用的求解器后端时，再用三下标Parragh模型
+==  （pdptw_mip_model.build_three_index_mip，车辆数为ALNS使用的车辆数，以ALNS的路径为初始解）求解，取目标函数值较好的解
+==合并：各子问题的路径换回原来的点编号后合并成一个解，路径数超过车辆数时丢弃最短的路径，其请求由后悔值插入重新安排
+==跨类改进：剩余时间内以合并的解为初始解运行ALNS，Shaw移除等算子会同时移除相邻类中的请求，改进类边界两侧的路径
+"""
+import math
+import os
+import random
+import time
+
+import numpy as np
+
+import profiler
+from adaptive_large_neighbourhood_search_pdptw import adaptive_large_neighbourhood_search
+from insertion_heuristic import regret_insertion
+from instance_matrix import InstanceMatrix
+from mip_model import available_backends
+from pdptw_mip_model import build_three_index_mip
+from read_data import Instance, read_data
+from shared_instance import attach_instance, make_executor, share_instance
+from solution import Solution
+
+_worker_instance = None  # 工作进程中的算例（距离矩阵引用共享内存）
+
+
+def _init_worker(handle):
+    """进程池的initializer：映射共享内存中的算例数据"""
+    global _worker_instance
+    _worker_instance = attach_instance(handle)
+
+
+def request_features(instance, time_weight=1.0):
+    """聚类用的请求特征，形状(m, 6)：取货点和送货点的坐标、左时间窗，各维按标准差归一化，时间维乘以time_weight"""
+    pickups, deliveries = instance.requests[:, 0], instance.requests[:, 1]
+    coords = np.stack([instance.x[pickups], instance.y[pickups], instance.x[deliveries], instance.y[deliveries]],
+                      axis=1)
+    times = np.stack([instance.ready_time[pickups], instance.ready_time[deliveries]], axis=1)
+    coords = coords / max(float(np.std(np.concatenate([instance.x, instance.y]))), 1e-9)
+    times = time_weight * times / max(float(np.std(instance.ready_time)), 1e-9)
+    return np.concatenate([coords, times], axis=1)
+
+
+def kmeans(features, cluster_num, iterations=50, seed=0):
+    """k-means（k-means++初始化），返回每行的类编号（0..类数-1，空类被去掉后重新编号）"""
+    rng = np.random.RandomState(seed)
+    m = features.shape[0]
+    cluster_num = max(1, min(cluster_num, m))
+    centers = [features[rng.randint(m)]]
+    closest = ((features - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, cluster_num):
+        total = closest.sum()
+        k = rng.choice(m, p=closest / total) if total > 0 else rng.randint(m)
+        centers.append(features[k])
+        closest = np.minimum(closest, ((features - features[k]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+    labels = np.full(m, -1)
+    for _ in range(iterations):
+        distance = ((features[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = distance.argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for c in range(cluster_num):
+            members = labels == c
+            if members.any():
+                centers[c] = features[members].mean(axis=0)
+    return np.unique(labels, return_inverse=True)[1]
+
+
+def cluster_requests(instance, cluster_size=25, time_weight=1.0, seed=0):
+    """把请求按时空特征聚类，每类约cluster_size个请求，返回每类的请求行号数组的列表（按请求数从多到少）"""
+    cluster_num = int(math.ceil(instance.request_num / float(cluster_size)))
+    labels = kmeans(request_features(instance, time_weight), cluster_num, seed=seed)
+    clusters = [np.nonzero(labels == c)[0] for c in range(labels.max() + 1)]
+    return sorted(clusters, key=len, reverse=True)
+
+
+def sub_instance(instance, rows, name=None):
+    """由请求行号rows和首尾depot构成子算例，返回(子算例, 子算例点编号对应的原点编号数组)"""
+    requests = instance.requests[rows]
+    ids = np.concatenate([[instance.start_depot], requests.ravel(), [instance.end_depot]]).astype(np.int64)
+    new_id = np.zeros(instance.node_num, dtype=np.int64)
+    new_id[ids] = np.arange(ids.shape[0])
+    table = instance.to_table()[ids]
+    table[:, 0] = np.arange(ids.shape[0])
+    pickup_index, delivery_index = instance.pickup_index[ids], instance.delivery_index[ids]
+    table[:, 7] = np.where(pickup_index != 0, new_id[pickup_index], 0)
+    table[:, 8] = np.where(delivery_index != 0, new_id[delivery_index], 0)
+    sub = Instance(name or instance.name, instance.vehicle_num, instance.capacity, instance.speed, table)
+    sub._matrix = InstanceMatrix(instance.matrix.distance[np.ix_(ids, ids)])
+    return sub, ids
+
+
+def _solve_exact(sub, heuristic, time_limit, backend):
+    """用三下标模型求解子算例，ALNS的路径作为初始解（在模型中可行时），返回(解或None, 求解状态)"""
+    routes = [route for route in heuristic.routes() if len(route) > 2]
+    mip = build_three_index_mip(sub, vehicle_num=len(routes))
+    try:
+        start = mip.start_values(routes)
+    except ValueError:  # ALNS的路径违背了送货点的右时间窗（在模型中为硬时间窗），用到了被消除的弧
+        start = None
+    result = mip.model.solve(backend, time_limit=time_limit, start=start)
+    if not result.has_solution:
+        return None, result.status
+    return Solution.from_routes(sub, mip.routes(result.values)), result.status
+
+
+def _solve_cluster(task):
+    """工作进程：求解一类请求构成的子问题，返回(原点编号的路径列表, 统计信息)"""
+    rows, time_limit, seed, exact_max_nodes, backend = task
+    start = time.time()
+    sub, ids = sub_instance(_worker_instance, rows)
+    use_exact = backend is not None and sub.node_num <= exact_max_nodes
+    # 用MIP求解时ALNS和MIP各用一半的时间
+    solution, _ = adaptive_large_neighbourhood_search(sub, time_limit=time_limit / 2 if use_exact else time_limit,
+                                                      seed=seed, verbose=False)
+    info = {'requests': len(rows), 'nodes': sub.node_num, 'method': 'alns', 'heuristic': solution.objective()}
+    if use_exact and not solution.unassigned:
+        exact, info['exact_status'] = _solve_exact(sub, solution, max(1.0, time_limit - (time.time() - start)),
+                                                   backend)
+        if exact is not None and exact.objective() < solution.objective():
+            solution, info['method'] = exact, 'mip'
+    info['objective'] = solution.objective()
+    info['time'] = time.time() - start
+    return [ids[route].tolist() for route in solution.routes() if len(route) > 2], info
+
+
+def merge_routes(instance, routes):
+    """合并各子问题的路径：路径数超过车辆数时丢弃最短的路径，被丢弃的请求用后悔值插入重新安排"""
+    routes = sorted(routes, key=len, reverse=True)
+    merged = Solution.from_routes(instance, routes[:instance.vehicle_num])
+    if len(routes) > instance.vehicle_num:
+        dropped = [n for route in routes[instance.vehicle_num:] for n in route
+                   if instance.pickup_index[n] == 0 and instance.delivery_index[n] != 0]
+        regret_insertion(merged, dropped, k=2)
+    return merged
+
+
+def decomposition(instance, time_limit=300, cluster_size=25, time_weight=1.0, decomposition_fraction=0.6,
+                  exact_max_nodes=40, backend=None, workers=None, seed=0, verbose=True):
+    """先聚类后求解的分解算法主程序，返回(最好的解, 统计信息)。
+    time_limit的decomposition_fraction用于并行求解子问题（每个子问题的时间按类数和进程数平均分配），其余用于跨类改进；
+    backend为MIP求解器后端，None时使用第一个可用的后端，没有可用的后端时只用ALNS；workers默认为CPU核数
+    """
+    rng = random.Random(seed)
+    start = time.time()
+    workers = workers or os.cpu_count() or 1
+    if backend is None:
+        backends = available_backends()
+        backend = backends[0] if backends else None
+
+    clusters = cluster_requests(instance, cluster_size, time_weight, seed)
+    waves = int(math.ceil(len(clusters) / float(workers)))
+    sub_time = max(1.0, decomposition_fraction * time_limit / waves)
+    tasks = [(rows, sub_time, rng.randrange(1 << 30), exact_max_nodes, backend) for rows in clusters]
+    if verbose:
+        print('共%s类请求（%s个进程），每个子问题的时间：%.1f秒' % (len(clusters), workers, sub_time))
+    routes, infos = [], []
+    with profiler.timer('decomposition.subproblems'):
+        with share_instance(instance) as shared:
+            executor = make_executor(min(workers, len(tasks)), _init_worker, (shared.handle,))
+            try:
+                for cluster_routes, info in executor.map(_solve_cluster, tasks):
+                    routes.extend(cluster_routes)
+                    infos.append(info)
+            finally:
+                executor.shutdown(wait=True)
+    decomposition_time = time.time() - start
+
+    with profiler.timer('decomposition.merge'):
+        merged = merge_routes(instance, routes)
+    merged_objective = merged.objective()
+    if verbose:
+        print('合并后的目标函数值：%.2f，使用%s辆车，用时%.1f秒' % (merged_objective, merged.used_vehicle_num,
+                                                    decomposition_time))
+    remaining = time_limit - (time.time() - start)
+    best, improve_stats = merged, {'iterations': 0}
+    if remaining > 0:
+        best, improve_stats = adaptive_large_neighbourhood_search(instance, time_limit=remaining,
+                                                                  initial_solution=merged,
+                                                                  seed=rng.randrange(1 << 30), verbose=verbose)
+
+    stats = {'clusters': len(clusters), 'workers': workers, 'cluster_time': sub_time,
+             'exact_clusters': sum(info['method'] == 'mip' for info in infos),
+             'exact_attempts': sum('exact_status' in info for info in infos),
+             'decomposition_time': decomposition_time, 'merged_objective': merged_objective,
+             'merged_unassigned': len(merged.unassigned),
+             'iterations': improve_stats['iterations'], 'time': time.time() - start, 'cluster_info': infos}
+    profiler.count('decomposition.clusters', len(clusters))
+    return best, stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw1000_revised/LR1_10_1.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, decomposition_stats = decomposition(pdptw_instance, time_limit=300)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车，未安排的请求数：{}'.format(best_solution.used_vehicle_num, len(best_solution.unassigned)))
+    print('子问题数：{}，其中MIP求解{}个；合并后的目标函数值：{:.2f}'.format(
+        decomposition_stats['clusters'], decomposition_stats['exact_clusters'], decomposition_stats['merged_objective']))
+    print('程序总的运行时间：', decomposition_stats['time'], '秒')
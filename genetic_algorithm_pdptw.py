@@ -4,5 +4,185 @@
 @contact: yuanxin9997@qq.com
 @file: genetic_algorithm_pdptw.py
 @time: 2020/10/19 17:02
-@description:
+@description:求解PDPTW问题的并行遗传算法
+==个体：一组车辆路径，每条路径为[开始depot, p, ..., d, 结束depot]
+==交叉：基于路径的交叉（Route Based Crossover, Potvin & Bengio 1996），子代继承父代A的部分路径，
+==父代B的路径删除已被继承的运输请求后（保持原有的先后顺序，所以先取后送的顺序不变）作为其余路径，
+==遗漏的运输请求通过后悔值插入修复
+==变异：随机删除若干运输请求，由修复步骤重新插入
+==并行：子代的生成（交叉、变异、修复）和适应度评价交给ProcessPoolExecutor的工作进程，
+==算例的任务表和距离矩阵只放入共享内存一次，工作进程直接映射，不会为每个个体重新pickle
 """
+import itertools
+import os
+import random
+import time
+
+import profiler
+from insertion_heuristic import greedy_insertion, regret_insertion
+from node import PICKUP
+from read_data import read_data
+from shared_instance import attach_instance, make_executor, share_instance
+from solution import Solution
+
+_worker_instance = None  # 工作进程中的算例（距离矩阵引用共享内存）
+
+
+def _init_worker(handle):
+    """进程池的initializer：映射共享内存中的算例数据"""
+    global _worker_instance
+    _worker_instance = attach_instance(handle)
+
+
+def _used_routes(sol):
+    """解中非空的车辆路径"""
+    return [route for route in sol.routes() if len(route) > 2]
+
+
+def _result(sol):
+    """返回给主进程的结果：(路径, 适应度, 是否可行)"""
+    return _used_routes(sol), sol.objective(), sol.is_feasible()
+
+
+def _construct(seed):
+    """随机化的构造：先以随机顺序贪婪插入一部分请求，再用随机的k做后悔值插入，得到多样的初始个体"""
+    rng = random.Random(seed)
+    sol = Solution.empty(_worker_instance)
+    requests = sorted(sol.unassigned)
+    rng.shuffle(requests)
+    head = requests[:rng.randint(0, len(requests) // 3)]
+    for p in head:
+        greedy_insertion(sol, [p])
+    regret_insertion(sol, k=rng.randint(1, 3))
+    return _result(sol)
+
+
+def _build_child(instance, routes):
+    """由路径列表生成解，路径数超过车辆数时丢弃最短的路径，其请求留待修复"""
+    routes = sorted(routes, key=len, reverse=True)
+    return Solution.from_routes(instance, routes[:instance.vehicle_num])
+
+
+def _mutate(sol, rng, rate):
+    """变异：随机删除一部分运输请求，由后续的修复重新插入"""
+    node_type = sol.vehicles[0].nodes.node_type
+    served = [n for veh in sol.vehicles for n in veh.route if node_type[n] == PICKUP]
+    if served:
+        sol.remove_requests(rng.sample(served, max(1, min(len(served), int(len(served) * rate)))))
+
+
+def _breed(routes_a, routes_b, seed, mutation_rate):
+    """在工作进程中生成一个子代：路径交叉 + 变异 + 后悔值插入修复 + 适应度评价"""
+    rng = random.Random(seed)
+    partner = _worker_instance.nodes.partner
+    # 从父代A继承随机一部分路径
+    inherited = [route for route in routes_a if rng.random() < 0.5]
+    if not inherited and routes_a:
+        inherited = [rng.choice(routes_a)]
+    covered = set(n for route in inherited for n in route[1:-1])
+    # 父代B的路径删除已继承的请求，保持剩余点的先后顺序
+    rest = []
+    for route in routes_b:
+        kept = [n for n in route[1:-1] if n not in covered and partner[n] not in covered]
+        if kept:
+            rest.append([route[0]] + kept + [route[-1]])
+    sol = _build_child(_worker_instance, inherited + rest)
+    if rng.random() < 0.5:
+        _mutate(sol, rng, mutation_rate)
+    regret_insertion(sol, k=rng.randint(1, 3))
+    return _result(sol)
+
+
+def _initial_population(instance, executor, workers, population_size, initial_solution, migration, start,
+                        time_limit, rng, stats):
+    """构造初始种群，按适应度升序返回。每批构造workers个个体，两批之间检查时间并调用迁移钩子（迁入解加入种群），
+    时间用完时停止构造，保留已经构造的个体（不少于2个）；initial_solution不为None时作为种群中的第一个个体
+    """
+    population = [_result(initial_solution)] if initial_solution is not None else []
+    while len(population) < population_size:
+        if len(population) >= 2 and time_limit is not None and time.time() - start >= time_limit:
+            break
+        if population and migration is not None:
+            best = min(population, key=lambda ind: ind[1])
+            immigrant = migration(best[1], lambda: best[0])
+            if immigrant is not None:
+                population.append(_result(Solution.from_routes(instance, immigrant)))
+                stats['migrants'] += 1
+                continue
+        seeds = [rng.randrange(1 << 30) for _ in range(min(workers, population_size - len(population)))]
+        batch = list(executor.map(_construct, seeds))
+        stats['evaluations'] += len(batch)
+        population.extend(batch)
+    return sorted(population, key=lambda ind: ind[1])
+
+
+def genetic_algorithm(instance, population_size=40, generations=200, time_limit=None, workers=None,
+                      mutation_rate=0.1, elite_num=2, initial_solution=None, migration=None, seed=0, verbose=True):
+    """并行遗传算法主程序，返回(最好的解, 统计信息)。
+    generations为None时只受time_limit限制；workers为工作进程数，默认为CPU核数；workers=1时在主进程中串行运行；
+    initial_solution不为None时放入初始种群；构造初始种群时也检查time_limit，时间用完时只保留已经构造的个体；
+    migration为迁移钩子（见metaheuristics.py），构造初始种群时迁入的解直接加入种群，之后每代调用一次，
+    迁入的解比最差的个体好时替换它
+    """
+    if generations is None and time_limit is None:
+        raise ValueError('generations和time_limit至少要给出一个')
+    rng = random.Random(seed)
+    start = time.time()
+    workers = workers or os.cpu_count() or 1
+    stats = {'generations': 0, 'evaluations': 0, 'migrants': 0, 'best_history': []}
+    with share_instance(instance) as shared:
+        executor = make_executor(workers, _init_worker, (shared.handle,))
+        try:
+            chunksize = max(1, population_size // (4 * workers))
+            with profiler.timer('ga.construct'):
+                population = _initial_population(instance, executor, workers, population_size, initial_solution,
+                                                 migration, start, time_limit, rng, stats)
+
+            with profiler.timer('ga.main_loop'):
+                for gen in itertools.count() if generations is None else range(generations):
+                    if time_limit is not None and time.time() - start >= time_limit:
+                        break
+                    immigrant = migration(population[0][1], lambda: population[0][0]) if migration is not None else None
+                    if immigrant is not None:
+                        immigrant = _result(Solution.from_routes(instance, immigrant))
+                        if immigrant[1] < population[-1][1]:
+                            population[-1] = immigrant
+                            population.sort(key=lambda ind: ind[1])
+                            stats['migrants'] += 1
+                    # 二元锦标赛选择父代
+                    parents_a, parents_b = [], []
+                    for _ in range(population_size - elite_num):
+                        a, b = rng.sample(range(len(population)), 2), rng.sample(range(len(population)), 2)
+                        parents_a.append(population[min(a)][0])
+                        parents_b.append(population[min(b)][0])
+                    seeds = [rng.randrange(1 << 30) for _ in parents_a]
+                    children = list(executor.map(_breed, parents_a, parents_b, seeds,
+                                                 [mutation_rate] * len(seeds), chunksize=chunksize))
+                    stats['evaluations'] += len(children)
+                    # 精英保留，其余由子代替换；population按适应度升序排列，下标越小越好
+                    population = sorted(population[:elite_num] + children, key=lambda ind: ind[1])
+                    stats['generations'] = gen + 1
+                    stats['best_history'].append(population[0][1])
+                    if verbose and gen % 10 == 0:
+                        print('第%s代，最好的目标函数值：%.2f' % (gen, population[0][1]))
+        finally:
+            executor.shutdown(wait=True)
+
+    elapsed = time.time() - start
+    stats['time'] = elapsed
+    stats['evaluations_per_second'] = stats['evaluations'] / elapsed if elapsed > 0 else 0
+    profiler.count('ga.generations', stats['generations'])
+    best = Solution.from_routes(instance, population[0][0])
+    return best, stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw100_revised/lr104.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, ga_stats = genetic_algorithm(pdptw_instance, time_limit=60)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车'.format(best_solution.used_vehicle_num))
+    print('每秒评价个体数：', ga_stats['evaluations_per_second'])
+    print('程序总的运行时间：', ga_stats['time'], '秒')
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: insertion_heuristic.py
+@time: 2020/10/23 09:30
+@description:PD点对的批量插入评价，以及基于插入的贪婪（greedy）和后悔值（regret-k）修复算子
+==把一组车辆路径的前缀信息（Vehicle.update_info计算）拼接成扁平的numpy数组，
+==一次numpy运算评价一个（或一批）运输请求在所有路径上所有(取货位置i, 送货位置j)组合的插入成本和可行性，
+==结果与逐个调用Vehicle.evaluate_insertion相同
+"""
+import time
+
+import numpy as np
+
+import profiler
+from node import DELIVERY
+from solution import SOFT_PENALTY
+
+INF = float('inf')
+MAX_BATCH_SIZE = 2000000  # 一次批量评价的(请求, 插入位置)组合数上限，超过时按请求分块，控制内存
+
+INSERTION_DTYPE = np.dtype([('vehicle', np.int64), ('i', np.int64), ('j', np.int64), ('delta_distance', np.float64),
+                            ('delta_soft_violation', np.float64), ('feasible', np.bool_)])
+
+_pair_cache = {}  # 键为可插入位置数E，值为所有1<=i<=j<=E的组合
+
+
+def _position_pairs(end):
+    """所有1<=i<=j<=end的(i, j)组合"""
+    if end not in _pair_cache:
+        i, j = np.triu_indices(end)
+        _pair_cache[end] = (i + 1, j + 1)
+    return _pair_cache[end]
+
+
+def _sparse_table(values, func):
+    """numpy版本的区间最值稀疏表，返回形状为(层数, n)的二维数组，不足的部分用values[-1]补齐"""
+    levels = [values]
+    width = 1
+    while 2 * width <= values.shape[0]:
+        prev = levels[-1]
+        level = np.empty_like(prev)
+        level[:-width] = func(prev[:-width], prev[width:])
+        level[-width:] = prev[-width:]
+        levels.append(level)
+        width *= 2
+    return np.stack(levels)
+
+
+def _range_query(table, lo, hi, func):
+    """查询values[lo:hi+1]的最值（lo, hi为数组，要求hi>=lo）"""
+    p = np.floor(np.log2(hi - lo + 1)).astype(np.int64)
+    return func(table[p, lo], table[p, hi - (1 << p) + 1])
+
+
+def _soft_violation(arrival_time, ready_time, due_time, service_time):
+    """向量化的送货点软时间窗违背量，与vehicle._soft_violation相同"""
+    return np.where(arrival_time <= ready_time, 0.0, np.maximum(arrival_time + service_time - due_time, 0.0))
+
+
+class RouteBatch(object):
+    '''
+    把一组车辆的路径拼接成扁平数组，并列出每辆车所有可行的插入位置组合（候选）：
+    vehicles:List,Vehicle类对象列表（路径必须以结束depot结尾）
+    vehicle_index:List,参与评价的车辆在vehicles中的下标，默认为全部车辆
+    '''
+
+    def __init__(self, vehicles, vehicle_index=None):
+        if vehicle_index is None:
+            vehicle_index = range(len(vehicles))
+        self.vehicles = vehicles
+        self.vehicle_index = list(vehicle_index)
+
+        offsets = []
+        offset = 0
+        parts = {name: [] for name in ('node', 'arrival', 'departure', 'wait_prefix', 'slack', 'cum_load',
+                                       'hard_key', 'soft_key', 'soft_suffix')}
+        cand_v, cand_i, cand_j, cand_start, cand_route_ok, cand_cap, cand_speed = [], [], [], [], [], [], []
+        cand_starts = []
+        cand_num = 0
+        for v in self.vehicle_index:
+            veh = vehicles[v]
+            size = len(veh.route)
+            if not veh._has_end_depot():
+                raise ValueError('车辆%s的路径没有以结束depot结尾，无法批量评价插入' % veh.v_id)
+            parts['node'].append(np.frombuffer(veh.route, dtype=np.int32))
+            for name in ('arrival', 'departure', 'slack', 'cum_load', 'hard_key', 'soft_key'):
+                parts[name].append(np.frombuffer(getattr(veh, name), dtype=np.float64))
+            parts['wait_prefix'].append(np.frombuffer(veh.wait_prefix, dtype=np.float64)[:size])
+            parts['soft_suffix'].append(np.frombuffer(veh.soft_suffix, dtype=np.float64)[:size])
+
+            i, j = _position_pairs(size - veh.frozen)  # 只插入到冻结的位置之后
+            if veh.frozen > 1:
+                i, j = i + (veh.frozen - 1), j + (veh.frozen - 1)
+            cand_v.append(np.full(i.shape[0], v, dtype=np.int64))
+            cand_i.append(i + offset)
+            cand_j.append(j + offset)
+            cand_start.append(np.full(i.shape[0], offset, dtype=np.int64))
+            cand_starts.append(cand_num)
+            cand_num += i.shape[0]
+            route_ok = veh.total_hard_violate_time == 0 and veh.load <= veh.cap
+            cand_route_ok.append(np.full(i.shape[0], route_ok))
+            cand_cap.append(np.full(i.shape[0], veh.cap, dtype=np.float64))
+            cand_speed.append(np.full(i.shape[0], veh.speed if veh.speed != 0 else 1, dtype=np.float64))
+            offsets.append(offset)
+            offset += size
+        self.offsets = offsets  # 每辆车的路径在扁平数组中的起始位置
+        self.cand_starts = np.array(cand_starts, dtype=np.int64)  # 每辆车的候选在候选数组中的起始位置
+
+        if not offsets:
+            self.size = 0
+            return
+        flat = {name: np.concatenate(values) for name, values in parts.items()}
+        self.node = flat['node'].astype(np.int64)
+        self.arrival = flat['arrival']
+        self.departure = flat['departure']
+        self.wait_prefix = flat['wait_prefix']
+        self.pos_speed = np.repeat([vehicles[v].speed if vehicles[v].speed != 0 else 1 for v in self.vehicle_index],
+                                   [len(vehicles[v].route) for v in self.vehicle_index]).astype(np.float64)
+        self.route_end = np.repeat(np.array(offsets) + [len(vehicles[v].route) for v in self.vehicle_index],
+                                   [len(vehicles[v].route) for v in self.vehicle_index])  # 每个位置所在路径的结束位置
+        self.cand_v = np.concatenate(cand_v)
+        self.cand_i = np.concatenate(cand_i)
+        self.cand_j = np.concatenate(cand_j)
+        self.size = self.cand_v.shape[0]
+        local_start = np.concatenate(cand_start)
+        self.local_i = self.cand_i - local_start  # 候选在各自路径中的插入位置
+        self.local_j = self.cand_j - local_start
+        self.route_ok = np.concatenate(cand_route_ok)
+        self.cap = np.concatenate(cand_cap)
+        self.speed = np.concatenate(cand_speed)
+
+        i, j = self.cand_i, self.cand_j
+        self.same = i == j
+        # 与请求无关的部分，每个候选只计算一次：p插入在位置i-1和i之间，d插入在位置j-1和j之间
+        self.arr_b = flat['arrival'][i]
+        self.dep_c_prev = flat['departure'][j - 1]
+        self.arr_c = flat['arrival'][j]
+        self.wait_between = flat['wait_prefix'][j] - flat['wait_prefix'][i]  # 位置[i, j)上的等待时间之和
+        self.slack = flat['slack']
+        self.slack_c = self.slack[j]
+        self.soft_slack_c = flat['soft_suffix'][j] - flat['wait_prefix'][j]
+
+        seg_hi = np.maximum(j - 1, i)  # i==j时区间[i, j-1]为空，用[i, i]代替，结果不会被使用
+        hard_table = _sparse_table(flat['hard_key'], np.minimum)
+        soft_table = _sparse_table(flat['soft_key'], np.minimum)
+        load_table = _sparse_table(flat['cum_load'], np.maximum)
+        self.hard_slack_seg = _range_query(hard_table, i, seg_hi, np.minimum) - flat['wait_prefix'][i]
+        self.soft_slack_seg = _range_query(soft_table, i, seg_hi, np.minimum) - flat['wait_prefix'][i]
+        self.max_load = _range_query(load_table, i - 1, j - 1, np.maximum)
+
+        dm = vehicles[self.vehicle_index[0]].distance_matrix
+        self.distance_matrix = dm
+        self.dist_ab = dm[self.node[i - 1], self.node[i]]
+        self.dist_c = dm[self.node[j - 1], self.node[j]]
+
+    def evaluate(self, p_ids, d_ids):
+        """批量评价请求(p_ids[r], d_ids[r])插入到每个候选位置的结果，返回形状均为(请求数, 候选数)的
+        (增加的行驶距离, 增加的软时间窗违背量, 是否可行)，不可行的候选对应的前两项为inf
+        """
+        rows, cols, delta, soft = self.evaluate_feasible(p_ids, d_ids)
+        shape = (len(p_ids), self.size)
+        feasible = np.zeros(shape, dtype=bool)
+        delta_distance = np.full(shape, INF)
+        delta_soft = np.full(shape, INF)
+        feasible[rows, cols] = True
+        delta_distance[rows, cols] = delta
+        delta_soft[rows, cols] = soft
+        return delta_distance, delta_soft, feasible
+
+    def evaluate_feasible(self, p_ids, d_ids, exact_soft=True):
+        """与evaluate相同，但只返回可行的(请求下标, 候选下标, 增加的行驶距离, 增加的软时间窗违背量)；
+        exact_soft为False时不沿路径传播计算，会增加后续送货点软时间窗违背量的候选记为inf（只需要判断违背量是否增加时使用）
+        """
+        p = np.asarray(p_ids, dtype=np.int64)[:, None]
+        d = np.asarray(d_ids, dtype=np.int64)[:, None]
+        table = self.vehicles[self.vehicle_index[0]].nodes
+        columns = _node_columns(table)
+        ready, due, serv, demand, latest = columns[:5]
+        dm = self.distance_matrix
+        same = self.same
+        spd = self.pos_speed
+        pred = self.cand_i - 1  # p的前一个位置
+
+        # 先按路径位置计算只与一个点有关的量（位置数远少于候选数）
+        din_p = dm[self.node, p]  # 路径上每个位置到p的距离
+        arr_p_pos = self.departure + din_p / spd  # p插入到每个位置之后的到达时间
+        dep_p_pos = np.maximum(arr_p_pos, ready[p]) + serv[p]
+        dout_p = dm[p, self.node]  # p到路径上每个位置的距离
+        din_d = dm[self.node, d]
+        dout_d = dm[d, self.node]
+        # d插入到位置j之前时，即使前面没有任何推迟，到达j的时间也不能超过其forward time slack，
+        # 据此和p点的硬时间窗先在位置层面排除不可行的插入位置
+        dep_d_min = np.maximum(self.departure + din_d / spd, ready[d]) + serv[d]
+        mask_d = np.zeros_like(dep_d_min, dtype=bool)
+        mask_d[:, 1:] = dep_d_min[:, :-1] + dout_d[:, 1:] / spd[1:] - self.arrival[1:] <= self.slack[1:]
+        mask_p = arr_p_pos <= latest[p]
+
+        # 只对通过了位置层面检查的(请求, 候选)组合做完整计算
+        valid = mask_p[:, pred] & mask_d[:, self.cand_j] & self.route_ok & (self.max_load + demand[p] <= self.cap)
+        rows, cols = np.nonzero(valid)
+        pr, pc = p[rows, 0], d[rows, 0]
+        f = pred[cols]
+        ci, cj = self.cand_i[cols], self.cand_j[cols]
+        c_same = same[cols]
+        c_speed = self.speed[cols]
+
+        # 取货点p
+        dist_ap = din_p[rows, f]
+        dep_p = dep_p_pos[rows, f]
+
+        # p之后的点被推迟的时间（p和d相邻插入时不存在）
+        dist_pb = dout_p[rows, ci]
+        push1 = np.where(c_same, 0.0, dep_p + dist_pb / c_speed - self.arr_b[cols])
+        ok = (push1 <= 0) | (push1 <= self.hard_slack_seg[cols])
+        delay = np.maximum(push1 - self.wait_between[cols], 0.0)
+
+        # 送货点d
+        dist_prev_d = np.where(c_same, dm[pr, pc], din_d[rows, cj - 1])
+        dep_prev_d = np.where(c_same, dep_p, self.dep_c_prev[cols] + delay)
+        arr_d = dep_prev_d + dist_prev_d / c_speed
+        soft = _soft_violation(arr_d, ready[pc], due[pc], serv[pc])
+        dep_d = np.maximum(arr_d, ready[pc]) + serv[pc]
+
+        # d之后的点被推迟的时间
+        dist_dc = dout_d[rows, cj]
+        push2 = dep_d + dist_dc / c_speed - self.arr_c[cols]
+        ok &= push2 <= self.slack_c[cols]
+
+        delta = dist_ap + dist_prev_d + dist_dc - self.dist_c[cols] + \
+            np.where(c_same, 0.0, dist_pb - self.dist_ab[cols])
+
+        # 推迟量没有超过后续送货点的剩余软时间窗时，软时间窗违背量不变；否则沿路径传播计算
+        walk = ok & ~(c_same | (push1 <= 0) | (push1 <= self.soft_slack_seg[cols]))
+        if walk.any():
+            soft[walk] += self._soft_walk(ci[walk], cj[walk], push1[walk], columns) if exact_soft else INF
+        walk = ok & (push2 > 0) & (push2 > self.soft_slack_c[cols])
+        if walk.any():
+            soft[walk] += self._soft_walk(cj[walk], self.route_end[cj[walk]], push2[walk], columns) \
+                if exact_soft else INF
+
+        return rows[ok], cols[ok], delta[ok], soft[ok]
+
+    def _soft_walk(self, lo, hi, push, columns):
+        """向量化的Vehicle.soft_delay_delta：到达扁平位置lo的时间推迟push后，位置[lo, hi)上送货点软时间窗违背量的增加值。
+        每一步同时处理所有候选的下一个位置，推迟量被等待时间吸收或到达hi后该候选停止
+        """
+        ready, due, serv, is_delivery = columns[0], columns[1], columns[2], columns[5]
+        delta = np.zeros(lo.shape[0])
+        active = np.arange(lo.shape[0])
+        pos = lo.copy()
+        while active.shape[0]:
+            active = active[pos[active] < hi[active]]
+            k = pos[active]
+            delay = push[active] - (self.wait_prefix[k] - self.wait_prefix[lo[active]])
+            active, k, delay = active[delay > 0], k[delay > 0], delay[delay > 0]
+            n = self.node[k]
+            arr = self.arrival[k]
+            # 只有送货点计入软时间窗（可行候选的取货点不会违背硬时间窗，depot没有时间窗惩罚）
+            delta[active] += np.where(is_delivery[n], _soft_violation(arr + delay, ready[n], due[n], serv[n]) -
+                                      _soft_violation(arr, ready[n], due[n], serv[n]), 0.0)
+            pos[active] += 1
+        return delta
+
+
+def _node_columns(table):
+    """NodeTable的numpy列，按NodeTable缓存"""
+    columns = getattr(table, 'numpy_columns', None)
+    if columns is None:
+        columns = tuple(np.asarray(values, dtype=np.float64) for values in
+                        (table.ready_time, table.due_time, table.service_time, table.demand, table.latest_arrival))
+        columns += (np.asarray(table.node_type) == DELIVERY,)
+        table.numpy_columns = columns
+    return columns
+
+
+def _active_vehicles(vehicles):
+    """需要评价的车辆：所有非空车辆，以及每种(容量, 速度)的第一辆空车（空车之间插入结果相同）"""
+    active = []
+    seen_empty = set()
+    for v, veh in enumerate(vehicles):
+        if len(veh.route) > 2:
+            active.append(v)
+        elif (veh.cap, veh.speed) not in seen_empty:
+            seen_empty.add((veh.cap, veh.speed))
+            active.append(v)
+    return active
+
+
+def evaluate_request_insertions(vehicles, p_id, d_id, soft_penalty=SOFT_PENALTY, batch=None):
+    """一次评价运输请求(p_id, d_id)在所有车辆所有插入位置上的结果，
+    返回按（可行优先，插入成本=增加距离+soft_penalty*增加软时间窗违背量）排序的结构化数组，
+    字段为(vehicle, i, j, delta_distance, delta_soft_violation, feasible)，vehicle为车辆在vehicles中的下标
+    """
+    if batch is None:
+        batch = RouteBatch(vehicles)
+    result = np.empty(batch.size, dtype=INSERTION_DTYPE)
+    if batch.size == 0:
+        return result
+    delta_distance, soft, feasible = batch.evaluate([p_id], [d_id])
+    result['vehicle'] = batch.cand_v
+    result['i'] = batch.local_i
+    result['j'] = batch.local_j
+    result['delta_distance'] = delta_distance[0]
+    result['delta_soft_violation'] = soft[0]
+    result['feasible'] = feasible[0]
+    cost = delta_distance[0] + soft_penalty * soft[0]
+    order = np.lexsort((cost, ~feasible[0]))
+    return result[order]
+
+
+def _best_by_vehicle(batch, p_ids, d_ids, soft_penalty):
+    """每个请求插入到batch中每辆车的最小成本及对应的候选下标，返回形状为(请求数, 车辆数)的数组"""
+    vehicle_num = len(batch.vehicle_index)
+    cost = np.full((len(p_ids), vehicle_num), INF)
+    best = np.zeros((len(p_ids), vehicle_num), dtype=np.int64)
+    if batch.size == 0 or len(p_ids) == 0:
+        return cost, best
+    col_of = np.repeat(np.arange(vehicle_num), np.diff(np.r_[batch.cand_starts, batch.size]))  # 候选所属车辆的列号
+    chunk = max(1, MAX_BATCH_SIZE // batch.size)
+    for lo in range(0, len(p_ids), chunk):
+        rows, cols, delta, soft = batch.evaluate_feasible(p_ids[lo:lo + chunk], d_ids[lo:lo + chunk])
+        if rows.shape[0] == 0:
+            continue
+        total = delta + soft_penalty * soft
+        key = (rows + lo) * vehicle_num + col_of[cols]
+        order = np.lexsort((total, key))
+        first = order[np.r_[True, key[order][1:] != key[order][:-1]]]  # 每个(请求, 车辆)成本最小的候选
+        cost.flat[key[first]] = total[first]
+        best.flat[key[first]] = cols[first]
+    return cost, best
+
+
+@profiler.timed('insertion.regret')
+def regret_insertion(solution, requests=None, k=2, soft_penalty=SOFT_PENALTY, rng=None, deadline=None):
+    """后悔值插入（Ropke & Pisinger 2006）：每次选择后悔值（第1到第k好的车辆的插入成本之差的和）最大的请求，
+    插入到其成本最小的位置；k=1时为贪婪插入，每次插入全局成本最小的请求。
+    requests为待插入请求的取货点编号，默认为solution.unassigned；无法可行插入的请求留在solution.unassigned中。
+    每次插入后只重新评价发生变化的那辆车。deadline不为None时（time.time()的时刻），到时停止插入，
+    还没有插入的请求留在solution.unassigned中
+    """
+    vehicles = solution.vehicles
+    nodes = vehicles[0].nodes
+    if requests is None:
+        requests = sorted(solution.unassigned)
+    requests = list(requests)
+    if rng is not None:
+        rng.shuffle(requests)
+    solution.unassigned.update(requests)
+    if not requests:
+        return solution
+
+    p_ids = np.array(requests, dtype=np.int64)
+    d_ids = np.array([nodes.partner[p] for p in requests], dtype=np.int64)
+    active = _active_vehicles(vehicles)
+    batch = RouteBatch(vehicles, active)
+    cost, best = _best_by_vehicle(batch, p_ids, d_ids, soft_penalty)
+    batches = [batch] * len(active)  # 每辆车的best对应的RouteBatch，用于把候选下标还原成插入位置
+    remaining = np.ones(len(requests), dtype=bool)
+
+    while remaining.any():
+        if deadline is not None and time.time() >= deadline:
+            break
+        rows = np.nonzero(remaining)[0]
+        part = np.sort(cost[rows], axis=1)[:, :max(1, min(k, cost.shape[1]))]
+        best_cost = part[:, 0]
+        if not np.isfinite(best_cost).any():
+            break
+        # 后悔值：第2到第k好的插入成本与最好的插入成本之差的和，只有少于k辆车可以插入的请求后悔值为inf，优先插入；
+        # 后悔值相同时（k=1时均为0）插入成本小的优先
+        with np.errstate(invalid='ignore'):
+            regret = (part[:, 1:] - best_cost[:, None]).sum(axis=1)
+        regret = np.where(np.isfinite(best_cost), np.nan_to_num(regret, nan=INF), -INF)
+        row = rows[np.lexsort((best_cost, -regret))[0]]
+        col = int(np.argmin(cost[row]))
+        cand = best[row, col]
+        i, j = int(batches[col].local_i[cand]), int(batches[col].local_j[cand])
+        v = active[col]
+        vehicles[v].insert_pd_node_at(int(p_ids[row]), int(d_ids[row]), i, j)
+        solution.unassigned.discard(int(p_ids[row]))
+        remaining[row] = False
+
+        # 原来是空车的话，需要补充下一辆同类型的空车
+        added = [u for u in _active_vehicles(vehicles) if u not in active]
+        if added:
+            cost = np.concatenate([cost, np.full((len(requests), len(added)), INF)], axis=1)
+            best = np.concatenate([best, np.zeros((len(requests), len(added)), dtype=np.int64)], axis=1)
+            batches = batches + [None] * len(added)
+            active = active + added
+        rows = np.nonzero(remaining)[0]
+        for u in [v] + added:
+            col_u = active.index(u)
+            batches[col_u] = RouteBatch(vehicles, [u])
+            c_u, b_u = _best_by_vehicle(batches[col_u], p_ids[rows], d_ids[rows], soft_penalty)
+            cost[:, col_u] = INF
+            cost[rows, col_u] = c_u[:, 0]
+            best[rows, col_u] = b_u[:, 0]
+    return solution
+
+
+def greedy_insertion(solution, requests=None, soft_penalty=SOFT_PENALTY, rng=None):
+    """贪婪插入：每次插入全局插入成本最小的请求"""
+    return regret_insertion(solution, requests, k=1, soft_penalty=soft_penalty, rng=rng)
+
+
+profiler.instrument(RouteBatch, '__init__', 'route_batch.build')
+profiler.instrument(RouteBatch, 'evaluate_feasible', 'route_batch.evaluate_feasible')
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: instance_matrix.py
+@time: 2020/10/21 10:12
+@description:算例级别的距离矩阵和时间矩阵，一个算例只计算一次，由Gurobi模型和Vehicle类共享
+==距离矩阵为连续存储的二维float数组，按节点编号（TaskNo）作为行列下标直接索引
+==时间矩阵按车辆速度缓存，同一速度的所有车辆共用同一个数组，而不是每辆车复制一份
+"""
+
+import numpy as np
+
+import profiler
+
+
+@profiler.timed('matrix.distance')
+def construct_distance_array(x, y):
+    """向量化计算所有点对之间的Euclid距离，返回n*n的连续float数组"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    dx = x[:, None] - x[None, :]
+    dy = y[:, None] - y[None, :]
+    distance = np.ascontiguousarray(np.hypot(dx, dy))
+    return distance
+
+
+class InstanceMatrix(object):
+    '''
+    算例矩阵类：
+    distance:ndarray,距离矩阵，distance[i, j]为点i到点j的距离（对角线为0）
+    longest_distance:Number,距离矩阵中最大的值
+    time_matrix(speed):按速度取得的通行时间矩阵，tij=dij/speed，速度为0时按1处理（与原来的约定一致）
+    '''
+
+    def __init__(self, distance):
+        self.distance = np.ascontiguousarray(distance, dtype=np.float64)
+        self.distance.flags.writeable = False  # 共享的矩阵不允许被某个调用者修改
+        self.node_num = self.distance.shape[0]
+        self.longest_distance = float(self.distance.max()) if self.node_num > 0 else 0.0
+        self._time_matrices = {}  # 键为速度，值为该速度下的时间矩阵
+
+    @classmethod
+    def from_coordinates(cls, x, y):
+        """由坐标数组创建"""
+        return cls(construct_distance_array(x, y))
+
+    @classmethod
+    def from_locations(cls, loc):
+        """由{节点编号: [x, y]}形式的字典创建，节点编号必须为0..n-1"""
+        node_ids = sorted(loc.keys())
+        if node_ids != list(range(len(node_ids))):
+            raise ValueError('节点编号必须从0开始连续编号，才能直接作为矩阵下标')
+        coords = np.array([loc[i] for i in node_ids], dtype=np.float64).reshape(-1, 2)
+        return cls.from_coordinates(coords[:, 0], coords[:, 1])
+
+    def time_matrix(self, speed):
+        """取得速度为speed的车辆的时间矩阵，同一速度只计算一次"""
+        if speed == 0:
+            speed = 1
+        speed = float(speed)
+        if speed not in self._time_matrices:
+            if speed == 1:
+                time_mat = self.distance  # 速度为1时时间矩阵就是距离矩阵，不再复制
+            else:
+                time_mat = self.distance / speed
+                time_mat.flags.writeable = False
+            self._time_matrices[speed] = time_mat
+        return self._time_matrices[speed]
+
+
+profiler.instrument(InstanceMatrix, 'time_matrix', 'matrix.time_matrix')
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: island_model_pdptw.py
+@time: 2020/11/04 15:40
+@description:岛模型并行搜索，以及随时可以取得当前最好解的（anytime）求解接口IslandSolver
+==岛：每个岛是一个子进程，按metaheuristics.py的统一接口运行一种元启发式算法（SA、禁忌搜索、ALNS、GA、ACO、PSO，
+==  可以每个岛不同），算例数据放在共享内存中（见shared_instance.py），主进程和岛之间用Pipe传递路径
+==搜索状态：每个岛在整个时间预算内只运行一次算法，温度、禁忌表、算子权重、种群、信息素等搜索状态一直保留；
+==  算法提前结束（例如禁忌搜索连续多次没有改进）时，才以岛的最好解为初始解、换一个随机数种子重新开始
+==迁移：通过算法的迁移钩子（见metaheuristics.py）异步进行，不需要停下算法。岛的最好解变好时向主进程报告
+==  （两次报告至少间隔REPORT_INTERVAL秒），主进程每隔migration_interval秒按环形拓扑把岛i-1最新报告的解转发给岛i，
+==  比岛i报告的解好时才转发；岛在下一次调用钩子时取出迁入解，比自己的最好解好时作为当前解继续搜索
+==anytime：solve()阻塞到时间用完，start()在后台线程中运行、立即返回；运行期间可以用best()轮询当前最好的路径和
+==  目标函数值，或者用callback(路径, 目标函数值, 已用时间)在找到更好的解时得到通知；cancel()随时结束搜索，
+==  主进程通知各岛结束，岛在下一次调用钩子时报告最好解后退出，返回到目前为止最好的解
+==  各岛的算法以截止时间为时间限制，超过截止时间（或取消的时间）grace秒仍未结束的岛收到SIGTERM，
+==  再过grace秒仍未退出则被强制结束，所以总能在时间预算内返回；
+==  开始搜索之前先用后悔值插入得到一个解，任何时候都有可以返回的解；最好的解按可行优先、再按目标函数值比较
+==  岛的算法出错（或子进程意外退出）时只结束这个岛，错误记录在stats['errors']中，其他岛继续搜索
+==岛的数量默认为CPU核数，核数越多，同样的墙钟时间内搜索的解越多
+"""
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+from multiprocessing.connection import wait
+
+import profiler
+from insertion_heuristic import regret_insertion
+from metaheuristics import METAHEURISTICS, run_metaheuristic
+from read_data import read_data
+from shared_instance import attach_instance, share_instance
+from solution import Solution
+
+MIGRATION_INTERVAL = 5.0  # 两次迁移之间的时间（秒）
+REPORT_INTERVAL = 1.0  # 岛向主进程报告最好解的最小间隔（秒）
+MIN_RUN = 0.5  # 算法提前结束时，剩余时间少于它则不再重新开始
+GRACE = 2.0  # 超过截止时间多少秒后强制结束仍在运行的岛
+POLL_INTERVAL = 0.1  # 等待岛的消息时检查取消标志的间隔（秒）
+
+
+def _terminate(signum, frame):
+    raise SystemExit(1)
+
+
+class _Stop(Exception):
+    """主进程通知岛结束搜索"""
+
+
+class _MigrationLink(object):
+    '''
+    岛的子进程中传给算法的迁移钩子（见metaheuristics.py）：
+    算法的最好解变好时向主进程发送('best', 路径, 目标函数值, 是否可行)，两次报告至少间隔REPORT_INTERVAL秒；
+    取出主进程转发的('migrant', 路径, 目标函数值)，返回其中比算法的最好解好的；收到('stop',)时抛出_Stop
+    routes,objective,feasible:岛到目前为止最好的解（路径列表）及其目标函数值、是否可行
+    '''
+
+    def __init__(self, instance, conn):
+        self.instance = instance
+        self.conn = conn
+        self.routes, self.objective, self.feasible = None, float('inf'), False
+        self._cost = float('inf')  # 最近一次取得路径时算法的最好目标函数值
+        self._reported = float('-inf')  # 最近一次报告的时间
+
+    def record(self, routes):
+        """记录岛的一个解，比岛的最好解好时返回True"""
+        sol = Solution.from_routes(self.instance, routes)
+        if sol.objective() >= self.objective - 1e-9:
+            return False
+        self.routes = [route for route in sol.routes() if len(route) > 2]
+        self.objective, self.feasible = sol.objective(), sol.is_feasible()
+        return True
+
+    def __call__(self, best_cost, best_routes):
+        if best_cost < self._cost - 1e-9 and time.time() - self._reported >= REPORT_INTERVAL:
+            self._cost = best_cost
+            self._reported = time.time()
+            if self.record(best_routes()):
+                self.conn.send(('best', self.routes, self.objective, self.feasible))
+        immigrant = None
+        while self.conn.poll():
+            message = self.conn.recv()
+            if message[0] == 'stop':
+                if best_cost < self._cost - 1e-9:
+                    self.record(best_routes())
+                raise _Stop()
+            _, routes, objective = message
+            if objective < best_cost - 1e-9:
+                immigrant, best_cost = routes, objective
+        if immigrant is not None:
+            self._cost = best_cost  # 迁入解是主进程已知的解，不需要报告
+        return immigrant
+
+
+def _island_main(handle, algorithm, seed, conn, routes, deadline):
+    """岛的子进程入口：以routes为初始解运行算法直到deadline，最后发送('done', 路径, 目标函数值, 是否可行, 统计信息)"""
+    signal.signal(signal.SIGTERM, _terminate)
+    rng = random.Random(seed)
+    instance = attach_instance(handle)
+    link = _MigrationLink(instance, conn)
+    link.record(routes)
+    info = {'iterations': 0, 'restarts': -1}
+    try:
+        try:
+            while deadline - time.time() >= MIN_RUN:
+                initial = Solution.from_routes(instance, link.routes)
+                solution, stats = run_metaheuristic(algorithm, instance, initial, deadline - time.time(),
+                                                    rng.randrange(1 << 30), link)
+                link.record(solution.routes())
+                info['iterations'] += stats.get('iterations', stats.get('generations', 0))
+                info['restarts'] += 1
+        except _Stop:
+            pass
+        except Exception as e:  # 算法出错时岛结束，到目前为止最好的解仍然交给主进程
+            info['error'] = repr(e)
+        conn.send(('done', link.routes, link.objective, link.feasible, info))
+    except (EOFError, BrokenPipeError, KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        conn.close()
+
+
+class _Island(object):
+    '''
+    主进程中一个岛的状态：
+    algorithm:String,岛运行的算法
+    process:Process,子进程
+    conn:Connection,与子进程通信的Pipe
+    routes,objective:岛最近报告的最好解（路径列表）及其目标函数值
+    received:Number,转发给岛的最好迁入解的目标函数值
+    done:bool,岛是否已经结束
+    '''
+
+    def __init__(self, algorithm, process, conn, routes, objective):
+        self.algorithm = algorithm
+        self.process = process
+        self.conn = conn
+        self.routes = routes
+        self.objective = objective
+        self.received = objective
+        self.done = False
+        self.iterations = 0
+        self.restarts = 0
+
+
+class IslandSolver(object):
+    '''
+    岛模型的anytime求解器：
+    algorithms:List,每个岛运行的算法（岛i运行algorithms[i % len(algorithms)]），可选的算法见metaheuristics.METAHEURISTICS
+    island_num:int,岛（子进程）的数量，默认为CPU核数
+    migration_interval:Number,两次迁移之间的时间（秒），迁移不会中断各岛的算法
+    callback:函数(路径列表, 目标函数值, 已用时间)，找到更好的解时在后台线程中调用
+    '''
+
+    def __init__(self, instance, algorithms=('alns',), island_num=None, migration_interval=MIGRATION_INTERVAL,
+                 grace=GRACE, callback=None, seed=0, verbose=False):
+        if isinstance(algorithms, str):
+            algorithms = (algorithms,)
+        for name in algorithms:
+            if name not in METAHEURISTICS:
+                raise ValueError('未知的算法：%s，可选：%s' % (name, ', '.join(METAHEURISTICS)))
+        self.instance = instance
+        self.algorithms = list(algorithms)
+        self.island_num = island_num or os.cpu_count() or 1
+        self.migration_interval = migration_interval
+        self.grace = grace
+        self.callback = callback
+        self.seed = seed
+        self.verbose = verbose
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = None
+        self._start = None
+        self._best = None  # (路径列表, 目标函数值, 是否可行, 找到的时间)
+        self._result = None
+        self._error = None
+        self.stats = {'migrations': 0, 'improvements': 0, 'errors': [], 'islands': self.island_num,
+                      'algorithms': ','.join(self.algorithms), 'best_history': []}
+
+    # ===================anytime接口===================
+    def start(self, time_limit):
+        """在后台线程中开始搜索并立即返回，time_limit为墙钟时间预算（秒）"""
+        if self._thread is not None:
+            raise RuntimeError('IslandSolver只能运行一次')
+        self._start = time.time()
+        self._thread = threading.Thread(target=self._run_safely, args=(time_limit,), daemon=True)
+        self._thread.start()
+        return self
+
+    def solve(self, time_limit):
+        """阻塞直到时间用完（或被取消），返回(最好的解, 统计信息)"""
+        return self.start(time_limit).wait()
+
+    def wait(self, timeout=None):
+        """等待搜索结束，返回(最好的解, 统计信息)；timeout秒后仍未结束时返回None"""
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return None
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def cancel(self):
+        """结束搜索（不阻塞），之后wait()返回到目前为止最好的解"""
+        self._cancel.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def best(self):
+        """当前最好的(路径列表, 目标函数值)，还没有任何解时返回None"""
+        with self._lock:
+            return None if self._best is None else (self._best[0], self._best[1])
+
+    def best_solution(self):
+        """当前最好的解（Solution），还没有任何解时返回None"""
+        best = self.best()
+        return None if best is None else Solution.from_routes(self.instance, best[0])
+
+    # ===================搜索===================
+    def _elapsed(self):
+        return time.time() - self._start
+
+    def _offer(self, routes, objective, feasible):
+        """提交一个解，比当前最好的解好时更新并调用callback；可行解优先，都可行（或都不可行）时比较目标函数值"""
+        with self._lock:
+            if self._best is not None and (not feasible, objective) >= (not self._best[2], self._best[1] - 1e-9):
+                return
+            self._best = (routes, objective, feasible, self._elapsed())
+            self.stats['improvements'] += 1
+            self.stats['best_history'].append((self._elapsed(), float(objective)))
+        if self.verbose:
+            print('%.1f秒，最好的目标函数值：%.2f' % (self._elapsed(), objective))
+        if self.callback is not None:
+            self.callback(routes, objective, self._elapsed())
+
+    def _run_safely(self, time_limit):
+        try:
+            self._run(time_limit)
+        except Exception as e:
+            self._error = e
+
+    def _run(self, time_limit):
+        deadline = self._start + time_limit
+        initial = regret_insertion(Solution.empty(self.instance), k=2)
+        initial_routes = [route for route in initial.routes() if len(route) > 2]
+        self._offer(initial_routes, initial.objective(), initial.is_feasible())
+        rng = random.Random(self.seed)
+        context = multiprocessing.get_context()
+        with share_instance(self.instance) as shared:
+            islands = []
+            try:
+                for k in range(self.island_num):
+                    parent, child = context.Pipe()
+                    algorithm = self.algorithms[k % len(self.algorithms)]
+                    process = context.Process(target=_island_main, args=(shared.handle, algorithm,
+                                                                         rng.randrange(1 << 30), child,
+                                                                         initial_routes, deadline))
+                    process.start()
+                    child.close()
+                    islands.append(_Island(algorithm, process, parent, initial_routes, initial.objective()))
+                with profiler.timer('island.main_loop'):
+                    self._loop(islands, deadline)
+            finally:
+                self._shutdown(islands)
+        best_routes, objective, feasible, found = self._best
+        self.stats.update({'time': self._elapsed(), 'objective': float(objective), 'feasible': feasible,
+                           'best_time': found, 'cancelled': self._cancel.is_set(),
+                           'iterations': sum(island.iterations for island in islands),
+                           'restarts': sum(island.restarts for island in islands)})
+        profiler.count('island.migrations', self.stats['migrations'])
+        self._result = (Solution.from_routes(self.instance, best_routes), self.stats)
+
+    def _loop(self, islands, deadline):
+        """接收各岛的报告，每隔migration_interval秒迁移一次，直到所有岛结束；
+        被取消时通知各岛结束，超过截止时间（或取消的时间）grace秒仍未结束时返回，由_shutdown强制结束
+        """
+        hard_deadline = deadline + self.grace
+        next_migration = time.time() + self.migration_interval
+        stopping = False
+        while not all(island.done for island in islands) and time.time() < hard_deadline:
+            if self._cancel.is_set() and not stopping:
+                stopping = True
+                hard_deadline = min(hard_deadline, time.time() + self.grace)
+                for island in islands:
+                    if not island.done:
+                        self._send(island, ('stop',))
+            ready = wait([island.conn for island in islands if not island.done], timeout=POLL_INTERVAL)
+            for island in islands:
+                if not island.done and island.conn in ready:
+                    self._receive(island)
+            if not stopping and time.time() >= next_migration:
+                self._migrate(islands)
+                next_migration = time.time() + self.migration_interval
+
+    def _receive(self, island):
+        """接收岛的一条消息：('best', 路径, 目标函数值, 是否可行)或('done', 路径, 目标函数值, 是否可行, 统计信息)"""
+        try:
+            message = island.conn.recv()
+        except EOFError:  # 子进程意外退出，其他岛继续搜索
+            island.done = True
+            self.stats['errors'].append('%s: 子进程意外退出' % island.algorithm)
+            return
+        kind, routes, objective, feasible = message[:4]
+        if kind == 'done':
+            island.done = True
+            island.iterations = message[4]['iterations']
+            island.restarts = message[4]['restarts']
+            if 'error' in message[4]:
+                self.stats['errors'].append('%s: %s' % (island.algorithm, message[4]['error']))
+        if objective < island.objective:
+            island.routes, island.objective = routes, objective
+        self._offer(routes, objective, feasible)
+
+    def _send(self, island, message):
+        try:
+            island.conn.send(message)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def _migrate(self, islands):
+        """环形迁移：岛i-1最近报告的解比岛i报告的解以及已经转发给岛i的解都好时，转发给岛i"""
+        for k, island in enumerate(islands):
+            source = islands[k - 1]
+            if island.done or source.objective >= min(island.objective, island.received) - 1e-9:
+                continue
+            self._send(island, ('migrant', source.routes, source.objective))
+            island.received = source.objective
+            self.stats['migrations'] += 1
+
+    def _shutdown(self, islands):
+        """等待已结束的岛退出，仍在运行的岛发送SIGTERM，grace秒后仍未退出则强制结束"""
+        for island in islands:
+            if not island.done:
+                island.process.terminate()
+        for island in islands:
+            island.process.join(self.grace)
+            if island.process.is_alive():
+                island.process.kill()
+                island.process.join()
+            island.conn.close()
+
+
+def island_search(instance, time_limit=60, algorithms=('alns',), island_num=None,
+                  migration_interval=MIGRATION_INTERVAL, callback=None, seed=0, verbose=True):
+    """岛模型并行搜索，阻塞直到时间用完，返回(最好的解, 统计信息)"""
+    solver = IslandSolver(instance, algorithms, island_num, migration_interval, callback=callback, seed=seed,
+                          verbose=verbose)
+    return solver.solve(time_limit)
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw1000_revised/LR1_10_1.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, island_stats = island_search(pdptw_instance, time_limit=300, algorithms=('alns', 'sa', 'tabu'))
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车，未安排的请求数：{}'.format(best_solution.used_vehicle_num, len(best_solution.unassigned)))
+    print('岛数：{}，迁移次数：{}'.format(island_stats['islands'], island_stats['migrations']))
+    print('程序总的运行时间：', island_stats['time'], '秒')
@@ -4,10 +4,330 @@
 @contact: yuanxin9997@qq.com
 @file: main.py
 @time: 2020/10/19 16:44
-@description:求解PDPTW问题的主函数
+@description:求解PDPTW问题的主函数：在整个LiLimPDPTWbenchmark上批量运行指定的算法
+==自动发现LiLimPDPTWbenchmark/pdptw*_revised下的所有算例，按点数从大到小排序（最大的算例最先开始，缩短总完成时间）
+==每个算例在单独的子进程中求解，同时运行workers个子进程；算法的时间限制为time_limit，
+==超过time_limit + grace仍未结束的子进程先发送SIGTERM（子进程中转换为SystemExit，共享内存等资源正常释放），再强制结束
+==每个算例的结果在完成后立即追加到JSON Lines文件（断点），中断后重新运行会跳过已经有结果的算例；
+==记录中包含各阶段用时、峰值内存和与最好已知解的差距，用output_results.py汇总和比较（见output_results）
+==--profile时每个算例在子进程中开启profiler，热点函数的计时、计数（和采样分析）保存在记录的profile字段，
+==  用python profiler.py results/<算法>.jsonl输出报告
+==用法：python main.py --algorithm tabu --time-limit 60 --workers 8
 """
+import argparse
+import glob
+import json
+import multiprocessing
 import os
+import signal
+import time
+import traceback
+from multiprocessing.connection import wait
 
-data_path = './LiLimPDPTWbenchmark/pdp100'
-filelist = os.listdir(data_path)
-print(filelist)
\ No newline at end of file
+import profiler
+from construction_heuristic import construction_heuristic
+from decomposition_pdptw import decomposition
+from insertion_heuristic import regret_insertion
+from island_model_pdptw import island_search
+from metaheuristics import METAHEURISTICS
+from output_results import PhaseTimer, gap_to_best_known, load_best_known, peak_rss_mb, run_metadata
+from pdptw_mip_model import build_three_index_mip
+from read_data import read_data
+from rolling_horizon_pdptw import LATENCY_BUDGET, replay, replay_events
+from solution import Solution
+
+BENCHMARK_ROOT = './LiLimPDPTWbenchmark'
+BENCHMARK_PATTERN = 'pdptw*_revised'
+FINISHED, TIMEOUT, ERROR = 'ok', 'timeout', 'error'
+ISLAND_ALGORITHMS = ('alns', 'sa', 'tabu')  # 岛模型中各岛轮流使用的算法
+
+
+# ===================算法===================
+# 每个算法分为两步：prepare(算例)构造初始解或建立模型（计入construction阶段），
+# solve(算例, prepare的结果, 时间限制, 随机数种子)求解（计入solve阶段），返回(解Solution, 统计信息)；
+# 算法内部只用一个进程，由批量运行器负责并行
+def _prepare_nothing(instance):
+    return None
+
+
+def _prepare_construction(instance):
+    return construction_heuristic(instance, verbose=False)[0]
+
+
+def _prepare_regret(instance):
+    return regret_insertion(Solution.empty(instance), k=2)
+
+
+def _return_initial(instance, initial, time_limit, seed):
+    return initial, {}
+
+
+def _run_decomposition(instance, initial, time_limit, seed):
+    return decomposition(instance, time_limit=time_limit, workers=1, seed=seed, verbose=False)
+
+
+def _run_island(instance, initial, time_limit, seed):
+    """岛模型会再启动CPU核数个子进程，和批量运行器的并行叠加，一般配合--workers 1使用"""
+    return island_search(instance, time_limit=time_limit, algorithms=ISLAND_ALGORITHMS, seed=seed, verbose=False)
+
+
+def _run_online_replay(instance, initial, time_limit, seed):
+    """按发布时间回放请求（在线调度），用时约为事件数*每个事件的时延预算，时延预算不超过time_limit/事件数"""
+    budget = min(LATENCY_BUDGET, 0.9 * time_limit / max(1, len(replay_events(instance))))
+    return replay(instance, latency_budget=budget, seed=seed, verbose=False)
+
+
+def _prepare_mip(instance):
+    """建立模型，并用构造启发式（MIP的时间窗语义）的路径生成初始解"""
+    mip = build_three_index_mip(instance)
+    initial = construction_heuristic(instance, time_windows='mip', verbose=False)[0]
+    return mip, mip.start_values([veh.route for veh in initial.vehicles])
+
+
+def _run_mip(instance, prepared, time_limit, seed):
+    mip, start_values = prepared
+    result = mip.model.solve(time_limit=time_limit, start=start_values)
+    solution = Solution.from_routes(instance, mip.routes(result.values)) if result.has_solution else \
+        Solution.empty(instance)
+    return solution, {'status': result.status, 'bound': result.bound, 'backend': result.backend}
+
+
+# 可选的算法，键为算法名称，值为(prepare, solve)
+ALGORITHMS = {
+    'construction': (_prepare_construction, _return_initial),
+    'regret': (_prepare_regret, _return_initial),
+    'sa': (_prepare_regret, METAHEURISTICS['sa']),
+    'tabu': (_prepare_regret, METAHEURISTICS['tabu']),
+    'alns': (_prepare_regret, METAHEURISTICS['alns']),
+    'ga': (_prepare_nothing, METAHEURISTICS['ga']),
+    'aco': (_prepare_nothing, METAHEURISTICS['aco']),
+    'pso': (_prepare_nothing, METAHEURISTICS['pso']),
+    'decomposition': (_prepare_nothing, _run_decomposition),
+    'island': (_prepare_nothing, _run_island),
+    'online': (_prepare_nothing, _run_online_replay),
+    'mip': (_prepare_mip, _run_mip),
+}
+
+
+# ===================算例与断点===================
+def instance_size(path):
+    """算例的点数（数据文件的行数减去第一行车辆信息），用于排序，不需要读取整个算例"""
+    with open(path) as f:
+        return sum(1 for line in f if line.strip()) - 1
+
+
+def _failure_record(path, algorithm, status, **fields):
+    """出错或超时的结果记录：没有读取到算例时，算例名称和点数由文件名和文件行数得到"""
+    try:
+        node_num = instance_size(path)
+    except OSError:
+        node_num = None
+    record = {'path': path, 'instance': os.path.splitext(os.path.basename(path))[0], 'node_num': node_num,
+              'algorithm': algorithm, 'status': status}
+    record.update(fields)
+    return record
+
+
+def discover_instances(root=BENCHMARK_ROOT, pattern=BENCHMARK_PATTERN):
+    """root下所有符合pattern的目录中的算例文件（规范化的路径，作为断点中算例的键），按点数从大到小排序（点数相同时按路径排序）"""
+    paths = sorted(os.path.normpath(path) for path in glob.glob(os.path.join(root, pattern, '*.txt')))
+    return sorted(paths, key=lambda path: -instance_size(path))
+
+
+def load_checkpoint(output, algorithm, retry_failed=False):
+    """读取已有的结果文件，返回algorithm已完成的算例路径集合；retry_failed为True时超时和出错的算例不算完成。
+    中断时可能写了一半的最后一行会被忽略
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record['algorithm'] != algorithm:
+                continue
+            if record['status'] == FINISHED or not retry_failed:
+                done.add(record['path'])
+            else:
+                done.discard(record['path'])
+    return done
+
+
+def append_record(output, record):
+    """把一个算例的结果追加到结果文件并立即写入磁盘"""
+    with open(output, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ===================子进程===================
+def _terminate(signum, frame):
+    raise SystemExit(1)
+
+
+def _scalar_stats(stats):
+    """只保留统计信息中的数值和字符串（去掉收敛曲线等列表）"""
+    return {key: value for key, value in stats.items()
+            if isinstance(value, (int, float, str, bool)) or value is None}
+
+
+def solve_instance(path, algorithm, time_limit, seed, profile=None):
+    """读取并求解一个算例，返回结果记录（各阶段用时见output_results.PHASES）；
+    profile为'timers'或'sample'时开启profiler，报告保存在记录的profile字段
+    """
+    if profile:
+        profiler.reset()
+        profiler.enable(sampling=profile == 'sample')
+    timer = PhaseTimer()
+    prepare, solve = ALGORITHMS[algorithm]
+    with timer.phase('load'):
+        instance = read_data(path)
+        instance.nodes  # 节点表在第一次使用时生成，计入读取数据的用时
+    with timer.phase('matrix'):
+        instance.matrix.time_matrix(instance.speed)
+    with timer.phase('construction'):
+        prepared = prepare(instance)
+    with timer.phase('solve'):
+        solution, stats = solve(instance, prepared, time_limit, seed)
+    record = {
+        'path': path, 'instance': instance.name, 'node_num': instance.node_num, 'algorithm': algorithm,
+        'status': FINISHED, 'time_limit': time_limit, 'seed': seed, 'time': timer.total, 'phases': timer.times,
+        'peak_rss_mb': peak_rss_mb(), 'objective': solution.objective(), 'distance': solution.total_distance,
+        'vehicles': solution.used_vehicle_num, 'unassigned': len(solution.unassigned),
+        'feasible': solution.is_feasible(), 'routes': [list(veh.route) for veh in solution.vehicles
+                                                       if len(veh.route) > 2],
+        'stats': _scalar_stats(stats), 'route_cache': instance.nodes.route_cache.stats(),
+    }
+    if profile:
+        record['profile'] = profiler.report()
+    return record
+
+
+def _worker_main(path, algorithm, time_limit, seed, profile, conn):
+    """子进程入口：求解一个算例，把结果记录发送给主进程。收到SIGTERM时抛出SystemExit，使with/finally中的清理代码执行"""
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        record = solve_instance(path, algorithm, time_limit, seed, profile)
+    except Exception:
+        record = _failure_record(path, algorithm, ERROR, error=traceback.format_exc())
+    conn.send(record)
+    conn.close()
+
+
+def _stop(process, grace):
+    """结束子进程：先SIGTERM，grace秒后仍未结束则SIGKILL"""
+    if process.is_alive():
+        process.terminate()
+        process.join(grace)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+
+# ===================批量运行===================
+def run_batch(paths, algorithm, output, time_limit=60, workers=1, grace=30.0, seed=0, retry_failed=False,
+              best_known=None, profile=None, verbose=True):
+    """在paths中的算例上批量运行algorithm，同时运行workers个子进程，结果追加到output，返回本次运行的结果记录列表；
+    best_known为load_best_known读取的最好已知解，用于计算每个结果的gap；profile见solve_instance
+    """
+    if algorithm not in ALGORITHMS:
+        raise ValueError('未知的算法：%s，可选：%s' % (algorithm, ', '.join(ALGORITHMS)))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    done = load_checkpoint(output, algorithm, retry_failed)
+    pending = [path for path in paths if path not in done]
+    if verbose:
+        print('共%s个算例，已完成%s个，本次运行%s个' % (len(paths), len(paths) - len(pending), len(pending)))
+    metadata = run_metadata()
+    ctx = multiprocessing.get_context()
+    running = {}  # 子进程的sentinel -> (子进程, 算例路径, 结果管道, 开始时间)
+    records = []
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                path = pending.pop(0)
+                receiver, sender = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=_worker_main,
+                                      args=(path, algorithm, time_limit, seed, profile, sender))
+                process.start()
+                sender.close()
+                running[process.sentinel] = (process, path, receiver, time.time())
+
+            # 等待任意子进程结束或发送结果，最多等到最早的一个超时
+            now = time.time()
+            deadline = min(started + time_limit + grace for _, _, _, started in running.values())
+            wait(list(running) + [item[2] for item in running.values()], timeout=max(0.0, deadline - now))
+
+            for sentinel, (process, path, receiver, started) in list(running.items()):
+                record = None
+                if receiver.poll():
+                    try:
+                        record = receiver.recv()
+                    except EOFError:
+                        pass
+                elapsed = time.time() - started
+                if record is None:
+                    if process.is_alive() and elapsed < time_limit + grace:
+                        continue
+                    if process.is_alive():
+                        record = _failure_record(path, algorithm, TIMEOUT, time=elapsed)
+                    else:
+                        record = _failure_record(path, algorithm, ERROR, time=elapsed,
+                                                 error='子进程异常退出，exitcode=%s' % process.exitcode)
+                if record['status'] != TIMEOUT:
+                    process.join(grace)  # 已经发送结果的子进程正在退出
+                _stop(process, grace)
+                receiver.close()
+                del running[sentinel]
+                record['gap'] = gap_to_best_known(record, best_known or {})
+                record['run'] = metadata
+                append_record(output, record)
+                records.append(record)
+                if verbose:
+                    print('[%s/%s] %s %s %s' % (len(records), len(records) + len(pending) + len(running), path,
+                                                record['status'], '%.2f' % record['objective']
+                                                if record['status'] == FINISHED else ''))
+    finally:
+        # 主进程被中断时结束所有子进程，未完成的算例下次重新运行
+        for process, _, receiver, _ in running.values():
+            _stop(process, grace)
+            receiver.close()
+    return records
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='在Li & Lim PDPTW benchmark上批量运行算法')
+    parser.add_argument('--algorithm', default='tabu', choices=sorted(ALGORITHMS), help='算法名称')
+    parser.add_argument('--time-limit', type=float, default=60, help='每个算例的时间限制（秒）')
+    parser.add_argument('--grace', type=float, default=30, help='超过时间限制多少秒后强制结束子进程')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='同时运行的子进程数')
+    parser.add_argument('--root', default=BENCHMARK_ROOT, help='benchmark根目录')
+    parser.add_argument('--pattern', default=BENCHMARK_PATTERN, help='算例目录的通配符，如pdptw100_revised')
+    parser.add_argument('--instances', nargs='*', help='只运行这些算例（算例名称，如lc101 LR1_2_1）')
+    parser.add_argument('--output', help='结果文件（JSON Lines），默认为./results/<算法>.jsonl')
+    parser.add_argument('--seed', type=int, default=0, help='随机数种子')
+    parser.add_argument('--retry-failed', action='store_true', help='重新运行超时或出错的算例')
+    parser.add_argument('--bks', help='最好已知解文件（每行为“算例名称 车辆数 总距离”），用于计算gap')
+    parser.add_argument('--profile', nargs='?', const='timers', choices=['timers', 'sample'],
+                        default=profiler.mode_from_environment(),
+                        help='开启profiler（sample为同时开启采样分析），默认由环境变量PDPTW_PROFILE决定')
+    parser.add_argument('--list', action='store_true', help='只列出算例，不运行')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    instance_paths = discover_instances(args.root, args.pattern)
+    if args.instances:
+        wanted = set(args.instances)
+        instance_paths = [p for p in instance_paths if os.path.splitext(os.path.basename(p))[0] in wanted]
+    if args.list:
+        for instance_path in instance_paths:
+            print(instance_path)
+    else:
+        run_batch(instance_paths, args.algorithm, args.output or './results/%s.jsonl' % args.algorithm,
+                  args.time_limit, args.workers, args.grace, args.seed, args.retry_failed, load_best_known(args.bks),
+                  args.profile)
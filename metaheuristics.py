@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: metaheuristics.py
+@time: 2020/11/04 10:10
+@description:各元启发式算法的统一调用接口：函数(算例, 初始解, 时间限制, 随机数种子)，返回(最好的解, 统计信息)
+==初始解为None时各算法使用自己的默认初始解；所有算法都在调用它的进程中串行运行（workers=1），不输出进度，
+==由main.py（每个算例一个子进程）和island_model_pdptw.py（每个岛一个子进程）负责并行
+==迁移钩子migration：各算法在主循环中检查运行时间的地方调用migration(最好解的目标函数值, 返回最好解路径列表的函数)，
+==  返回None或迁入解的路径列表；迁入解比算法自己的最好解好时，算法把它作为当前解（和最好解）继续搜索，
+==  温度、禁忌表、算子权重、种群、信息素等搜索状态都保留（见island_model_pdptw.py）
+"""
+from adaptive_large_neighbourhood_search_pdptw import adaptive_large_neighbourhood_search
+from ant_colony_optimization_pdptw import ant_colony_optimization
+from genetic_algorithm_pdptw import genetic_algorithm
+from particle_swarm_optimization_pdptw import particle_swarm_optimization
+from simulated_annealing_pdptw import simulated_annealing
+from tabu_search_pdptw import tabu_search
+
+
+def run_simulated_annealing(instance, initial, time_limit, seed, migration=None):
+    return simulated_annealing(instance, time_limit=time_limit, initial_solution=initial, migration=migration,
+                               seed=seed, verbose=False)
+
+
+def run_tabu_search(instance, initial, time_limit, seed, migration=None):
+    return tabu_search(instance, time_limit=time_limit, initial_solution=initial, migration=migration, seed=seed,
+                       verbose=False)
+
+
+def run_alns(instance, initial, time_limit, seed, migration=None):
+    return adaptive_large_neighbourhood_search(instance, time_limit=time_limit, initial_solution=initial,
+                                               migration=migration, seed=seed, verbose=False)
+
+
+def run_genetic_algorithm(instance, initial, time_limit, seed, migration=None):
+    return genetic_algorithm(instance, generations=None, time_limit=time_limit, workers=1, initial_solution=initial,
+                             migration=migration, seed=seed, verbose=False)
+
+
+def run_ant_colony_optimization(instance, initial, time_limit, seed, migration=None):
+    return ant_colony_optimization(instance, iterations=None, time_limit=time_limit, workers=1,
+                                   initial_solution=initial, migration=migration, seed=seed, verbose=False)
+
+
+def run_particle_swarm_optimization(instance, initial, time_limit, seed, migration=None):
+    return particle_swarm_optimization(instance, iterations=None, time_limit=time_limit, initial_solution=initial,
+                                       migration=migration, seed=seed, verbose=False)
+
+
+# 可选的元启发式算法，键为算法名称，值为函数(算例, 初始解, 时间限制, 随机数种子, migration=None)，返回(最好的解, 统计信息)
+METAHEURISTICS = {
+    'sa': run_simulated_annealing,
+    'tabu': run_tabu_search,
+    'alns': run_alns,
+    'ga': run_genetic_algorithm,
+    'aco': run_ant_colony_optimization,
+    'pso': run_particle_swarm_optimization,
+}
+
+
+def run_metaheuristic(name, instance, initial, time_limit, seed=0, migration=None):
+    """按名称调用元启发式算法，返回(最好的解, 统计信息)"""
+    if name not in METAHEURISTICS:
+        raise ValueError('未知的算法：%s，可选：%s' % (name, ', '.join(METAHEURISTICS)))
+    return METAHEURISTICS[name](instance, initial, time_limit, seed, migration)
@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: mip_model.py
+@time: 2020/10/27 09:40
+@description:与求解器无关的线性整数规划建模层
+==变量和约束都按块（numpy数组）批量添加：约束以COO形式（行号、列号、系数）保存，不为每个约束生成Python表达式对象
+==可以导出LP/MPS文件（不需要任何求解器），从而把建模时间和求解时间分开测试
+==求解器后端可插拔：gurobi（gurobipy）、highs（highspy）、cbc（命令行程序，通过MPS文件交换）；
+==没有安装的后端不影响建模和导出
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import profiler
+
+INF = float('inf')
+CONTINUOUS, INTEGER, BINARY = 'C', 'I', 'B'
+MINIMIZE, MAXIMIZE = 1, -1
+LESS_EQUAL, GREATER_EQUAL, EQUAL = '<', '>', '='
+TERMS_PER_LINE = 8  # LP文件每行写的项数
+
+
+class MipResult(object):
+    '''
+    求解结果：
+    status:String,求解状态（optimal, feasible, infeasible, time_limit, error等）
+    objective:Number,目标函数值，没有可行解时为None
+    values:ndarray,按变量下标排列的变量取值，没有可行解时为None
+    bound:Number,目标函数的界
+    solve_time:Number,求解时间（秒）
+    '''
+
+    def __init__(self, status, objective=None, values=None, bound=None, solve_time=0.0, backend=None):
+        self.status = status
+        self.objective = objective
+        self.values = values
+        self.bound = bound
+        self.solve_time = solve_time
+        self.backend = backend
+
+    @property
+    def has_solution(self):
+        return self.values is not None
+
+
+class MipModel(object):
+    '''
+    线性整数规划模型：
+    name:String,模型名称
+    sense:Number,MINIMIZE或MAXIMIZE
+    变量和约束都按块保存，add_variables和add_constraints返回该块的下标数组
+    '''
+
+    def __init__(self, name='model', sense=MINIMIZE):
+        self.name = name
+        self.sense = sense
+        self.num_vars = 0
+        self.num_constrs = 0
+        self._var_blocks = []  # (名称, 下界, 上界, 类型, 目标系数, 键)
+        self._constr_blocks = []  # (名称, 行号, 列号, 系数, 方向, 右端项)
+        self._columns = None  # 合并后的变量数组的缓存
+        self.obj_constant = 0.0
+
+    # ===================变量===================
+    def add_variables(self, count, lb=0.0, ub=INF, vtype=CONTINUOUS, obj=0.0, name='x', keys=None):
+        """添加count个变量，lb、ub、obj可以是标量或长度为count的数组；keys为变量的键（用于生成变量名，如x_1_2_0），
+        默认为0..count-1。返回变量下标数组
+        """
+        lb = np.broadcast_to(np.asarray(lb, dtype=np.float64), (count,)).copy()
+        ub = np.broadcast_to(np.asarray(ub, dtype=np.float64), (count,)).copy()
+        obj = np.broadcast_to(np.asarray(obj, dtype=np.float64), (count,)).copy()
+        if vtype == BINARY:
+            lb = np.maximum(lb, 0.0)
+            ub = np.minimum(ub, 1.0)
+        self._var_blocks.append((name, lb, ub, vtype, obj, keys))
+        index = np.arange(self.num_vars, self.num_vars + count)
+        self.num_vars += count
+        self._columns = None
+        return index
+
+    def _assign(self, field, cols, values):
+        """把变量cols的第field项（1下界，2上界，4目标系数）设为values，直接修改变量块中的数组"""
+        cols = np.atleast_1d(np.asarray(cols, dtype=np.int64))
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), cols.shape)
+        offset = 0
+        for block in self._var_blocks:
+            size = block[1].shape[0]
+            mask = (cols >= offset) & (cols < offset + size)
+            block[field][cols[mask] - offset] = values[mask]
+            offset += size
+        self._columns = None
+
+    def set_objective(self, cols, coefs, constant=0.0):
+        """把目标函数中变量cols的系数设为coefs（覆盖add_variables时给出的系数）"""
+        self._assign(4, cols, coefs)
+        self.obj_constant = constant
+
+    def set_bounds(self, cols, lb=None, ub=None):
+        """修改变量的上下界"""
+        if lb is not None:
+            self._assign(1, cols, lb)
+        if ub is not None:
+            self._assign(2, cols, ub)
+
+    def columns(self):
+        """合并所有变量块，返回(下界, 上界, 类型, 目标系数)数组（结果会被缓存，不要直接修改）"""
+        if self._columns is None:
+            if self._var_blocks:
+                lb = np.concatenate([block[1] for block in self._var_blocks])
+                ub = np.concatenate([block[2] for block in self._var_blocks])
+                vtype = np.concatenate([np.full(block[1].shape[0], block[3]) for block in self._var_blocks])
+                obj = np.concatenate([block[4] for block in self._var_blocks])
+            else:
+                lb = ub = obj = np.zeros(0)
+                vtype = np.zeros(0, dtype='<U1')
+            self._columns = (lb, ub, vtype, obj)
+        return self._columns
+
+    def var_names(self):
+        """所有变量的名称，如x_1_2_0"""
+        names = []
+        for name, lb, ub, vtype, obj, keys in self._var_blocks:
+            if keys is None:
+                keys = range(lb.shape[0])
+            for key in keys:
+                key = key if isinstance(key, tuple) else (key,)
+                names.append('_'.join([name] + [str(k) for k in key]))
+        return names
+
+    # ===================约束===================
+    def add_constraints(self, rows, cols, coefs, sense, rhs, name='c'):
+        """批量添加约束：第r个约束为sum(coefs[t] * x[cols[t]] for rows[t] == r) sense rhs[r]，
+        rows为块内的行号（0..len(rhs)-1），sense为'<'、'>'、'='或其数组，rhs为标量或数组。返回约束下标数组
+        """
+        rhs = np.atleast_1d(np.asarray(rhs, dtype=np.float64))
+        count = rhs.shape[0]
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        coefs = np.broadcast_to(np.asarray(coefs, dtype=np.float64), rows.shape).copy()
+        if rows.shape != cols.shape:
+            raise ValueError('rows和cols的长度必须相同')
+        if rows.shape[0] and (rows.min() < 0 or rows.max() >= count):
+            raise ValueError('约束的行号超出范围')
+        if cols.shape[0] and (cols.min() < 0 or cols.max() >= self.num_vars):
+            raise ValueError('约束中的变量下标超出范围')
+        sense = np.broadcast_to(np.asarray(sense), (count,)).copy()
+        self._constr_blocks.append((name, rows + self.num_constrs, cols, coefs, sense, rhs))
+        index = np.arange(self.num_constrs, self.num_constrs + count)
+        self.num_constrs += count
+        return index
+
+    def add_rows(self, terms, sense, rhs, name='c'):
+        """按行添加约束：terms为[(变量下标数组, 系数数组), ...]的列表，每一项是一个约束。适合少量、长短不一的约束"""
+        rows = np.concatenate([np.full(len(cols), r) for r, (cols, _) in enumerate(terms)]) if terms else []
+        cols = np.concatenate([np.asarray(cols) for cols, _ in terms]) if terms else []
+        coefs = np.concatenate([np.broadcast_to(np.asarray(c, dtype=np.float64), (len(v),))
+                                for v, c in terms]) if terms else []
+        return self.add_constraints(rows, cols, coefs, sense, rhs, name)
+
+    def matrix(self):
+        """约束矩阵的COO形式和每个约束的方向、右端项：(行号, 列号, 系数, 方向, 右端项)。
+        同一约束中重复出现的变量（例如取货点到送货点的弧同时出现在配对约束的两边）合并系数，系数为0的项删除，
+        所以每个(行号, 列号)最多出现一次（HiGHS等求解器不接受重复的项），按行号、列号升序排列
+        """
+        if not self._constr_blocks:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0), np.zeros(0, dtype='<U1'), np.zeros(0)
+        rows = np.concatenate([block[1] for block in self._constr_blocks])
+        cols = np.concatenate([block[2] for block in self._constr_blocks])
+        coefs = np.concatenate([block[3] for block in self._constr_blocks])
+        sense = np.concatenate([block[4] for block in self._constr_blocks])
+        rhs = np.concatenate([block[5] for block in self._constr_blocks])
+        keys, inverse = np.unique(rows * self.num_vars + cols, return_inverse=True)
+        coefs = np.bincount(inverse.ravel(), weights=coefs, minlength=keys.shape[0])
+        nonzero = coefs != 0
+        keys, coefs = keys[nonzero], coefs[nonzero]
+        return keys // self.num_vars, keys % self.num_vars, coefs, sense, rhs
+
+    def constr_names(self):
+        names = []
+        for name, rows, cols, coefs, sense, rhs in self._constr_blocks:
+            names.extend('%s_%d' % (name, r) for r in range(rhs.shape[0]))
+        return names
+
+    def statistics(self):
+        """模型规模：变量数、整数变量数、约束数、非零元数"""
+        lb, ub, vtype, obj = self.columns()
+        return {'variables': self.num_vars, 'integer_variables': int(np.sum(vtype != CONTINUOUS)),
+                'constraints': self.num_constrs, 'nonzeros': int(self.matrix()[0].shape[0])}
+
+    # ===================导出===================
+    @profiler.timed('mip.write')
+    def write(self, path):
+        """按扩展名（.lp或.mps）导出模型文件"""
+        if path.endswith('.lp'):
+            self.write_lp(path)
+        elif path.endswith('.mps'):
+            self.write_mps(path)
+        else:
+            raise ValueError('只支持导出.lp和.mps文件：%s' % path)
+
+    def write_lp(self, path):
+        """导出CPLEX LP格式文件"""
+        lb, ub, vtype, obj = self.columns()
+        names = self.var_names()
+        rows, cols, coefs, sense, rhs = self.matrix()
+        order = np.lexsort((cols, rows))
+        rows, cols, coefs = rows[order], cols[order], coefs[order]
+        starts = np.searchsorted(rows, np.arange(self.num_constrs + 1))
+        with open(path, 'w') as f:
+            f.write('\\ %s\n%s\n obj:' % (self.name, 'Minimize' if self.sense == MINIMIZE else 'Maximize'))
+            nonzero = np.nonzero(obj)[0]
+            _write_terms(f, obj[nonzero], nonzero, names)
+            if self.obj_constant:
+                f.write(' %+.12g' % self.obj_constant)
+            f.write('\nSubject To\n')
+            symbol = {LESS_EQUAL: '<=', GREATER_EQUAL: '>=', EQUAL: '='}
+            for r, constr_name in enumerate(self.constr_names()):
+                f.write(' %s:' % constr_name)
+                lo, hi = starts[r], starts[r + 1]
+                if lo == hi:
+                    f.write(' 0 %s' % names[0])
+                _write_terms(f, coefs[lo:hi], cols[lo:hi], names)
+                f.write(' %s %.12g\n' % (symbol[sense[r]], rhs[r]))
+            f.write('Bounds\n')
+            for j in range(self.num_vars):
+                if vtype[j] == BINARY and lb[j] == 0 and ub[j] == 1:
+                    continue
+                if lb[j] == -INF and ub[j] == INF:
+                    f.write(' %s free\n' % names[j])
+                elif lb[j] == ub[j]:
+                    f.write(' %s = %.12g\n' % (names[j], lb[j]))
+                else:
+                    f.write(' %s <= %s <= %s\n' % (_lp_number(lb[j]), names[j], _lp_number(ub[j])))
+            for title, kind in (('General', INTEGER), ('Binary', BINARY)):
+                index = np.nonzero(vtype == kind)[0]
+                if index.shape[0]:
+                    f.write('%s\n' % title)
+                    for lo in range(0, index.shape[0], TERMS_PER_LINE):
+                        f.write(' %s\n' % ' '.join(names[j] for j in index[lo:lo + TERMS_PER_LINE]))
+            f.write('End\n')
+
+    def write_mps(self, path):
+        """导出free MPS格式文件（变量名和约束名中没有空格）"""
+        lb, ub, vtype, obj = self.columns()
+        names = self.var_names()
+        constr_names = self.constr_names()
+        rows, cols, coefs, sense, rhs = self.matrix()
+        order = np.lexsort((rows, cols))
+        rows, cols, coefs = rows[order], cols[order], coefs[order]
+        starts = np.searchsorted(cols, np.arange(self.num_vars + 1))
+        obj = obj * self.sense  # MPS文件默认最小化
+        with open(path, 'w') as f:
+            f.write('NAME %s\nROWS\n N obj\n' % self.name.replace(' ', '_'))
+            row_type = {LESS_EQUAL: 'L', GREATER_EQUAL: 'G', EQUAL: 'E'}
+            for r, constr_name in enumerate(constr_names):
+                f.write(' %s %s\n' % (row_type[sense[r]], constr_name))
+            f.write('COLUMNS\n')
+            in_integer = False
+            for j in range(self.num_vars):
+                integer = vtype[j] != CONTINUOUS
+                if integer != in_integer:
+                    f.write(" MARKER 'MARKER' '%s'\n" % ('INTORG' if integer else 'INTEND'))
+                    in_integer = integer
+                if obj[j] != 0:
+                    f.write(' %s obj %.12g\n' % (names[j], obj[j]))
+                for t in range(starts[j], starts[j + 1]):
+                    f.write(' %s %s %.12g\n' % (names[j], constr_names[rows[t]], coefs[t]))
+                if obj[j] == 0 and starts[j] == starts[j + 1]:
+                    f.write(' %s obj 0\n' % names[j])  # 没有出现在任何约束中的变量也要出现在COLUMNS中
+            if in_integer:
+                f.write(" MARKER 'MARKER' 'INTEND'\n")
+            f.write('RHS\n')
+            if self.obj_constant:
+                f.write(' rhs obj %.12g\n' % (-self.obj_constant * self.sense))
+            for r in np.nonzero(rhs)[0]:
+                f.write(' rhs %s %.12g\n' % (constr_names[r], rhs[r]))
+            f.write('BOUNDS\n')
+            for j in range(self.num_vars):
+                if lb[j] == -INF and ub[j] == INF:
+                    f.write(' FR bnd %s\n' % names[j])
+                    continue
+                if lb[j] == ub[j]:
+                    f.write(' FX bnd %s %.12g\n' % (names[j], lb[j]))
+                    continue
+                if lb[j] == -INF:
+                    f.write(' MI bnd %s\n' % names[j])
+                elif lb[j] != 0:
+                    f.write(' LO bnd %s %.12g\n' % (names[j], lb[j]))
+                if ub[j] != INF:
+                    f.write(' UP bnd %s %.12g\n' % (names[j], ub[j]))
+                elif vtype[j] != CONTINUOUS:
+                    f.write(' PL bnd %s\n' % names[j])  # 部分读取器默认整数变量的上界为1
+            f.write('ENDATA\n')
+
+    # ===================求解===================
+    def solve(self, backend=None, time_limit=None, mip_gap=None, start=None, verbose=False):
+        """用指定的后端求解，backend为None时使用第一个可用的后端；start为初始解（按变量下标的数组，nan表示不指定）"""
+        if backend is None:
+            backends = available_backends()
+            if not backends:
+                raise RuntimeError('没有可用的求解器后端（gurobipy、highspy或cbc命令行程序）')
+            backend = backends[0]
+        if backend not in BACKENDS:
+            raise ValueError('未知的求解器后端：%s，可选：%s' % (backend, ', '.join(BACKENDS)))
+        start_time = time.time()
+        with profiler.timer('mip.solve.%s' % backend):
+            result = BACKENDS[backend][1](self, time_limit, mip_gap, start, verbose)
+        result.solve_time = time.time() - start_time
+        result.backend = backend
+        return result
+
+
+def _lp_number(value):
+    if value == INF:
+        return '+inf'
+    if value == -INF:
+        return '-inf'
+    return '%.12g' % value
+
+
+def _write_terms(f, coefs, cols, names):
+    """写LP文件的一组项，每TERMS_PER_LINE项换一行"""
+    for t, (coef, col) in enumerate(zip(coefs.tolist(), cols.tolist())):
+        if t and t % TERMS_PER_LINE == 0:
+            f.write('\n  ')
+        f.write(' %s %.12g %s' % ('-' if coef < 0 else '+', abs(coef), names[col]))
+
+
+def _row_bounds(sense, rhs):
+    """把(方向, 右端项)转换成约束的上下界"""
+    lower = np.where(sense == LESS_EQUAL, -INF, rhs)
+    upper = np.where(sense == GREATER_EQUAL, INF, rhs)
+    return lower, upper
+
+
+# ===================求解器后端===================
+def _gurobi_available():
+    try:
+        import gurobipy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _solve_gurobi(model, time_limit, mip_gap, start, verbose):
+    import gurobipy as gp
+    from gurobipy import GRB
+
+    lb, ub, vtype, obj = model.columns()
+    rows, cols, coefs, sense, rhs = model.matrix()
+    order = np.argsort(rows, kind='stable')  # 按行排序，逐行建立约束
+    rows, cols, coefs = rows[order], cols[order], coefs[order]
+    row_start = np.searchsorted(rows, np.arange(model.num_constrs + 1)).tolist()
+    grb = gp.Model(model.name)
+    grb.Params.OutputFlag = 1 if verbose else 0
+    if time_limit is not None:
+        grb.Params.TimeLimit = time_limit
+    if mip_gap is not None:
+        grb.Params.MIPGap = mip_gap
+    x = list(grb.addVars(model.num_vars, lb=np.where(lb == -INF, -GRB.INFINITY, lb).tolist(),
+                         ub=np.where(ub == INF, GRB.INFINITY, ub).tolist(), obj=obj.tolist(),
+                         vtype=vtype.tolist()).values())
+    grb.ModelSense = GRB.MINIMIZE if model.sense == MINIMIZE else GRB.MAXIMIZE
+    grb.ObjCon = model.obj_constant
+    cols, coefs = cols.tolist(), coefs.tolist()
+    for r, (constr_sense, constr_rhs) in enumerate(zip(sense.tolist(), rhs.tolist())):
+        lo, hi = row_start[r], row_start[r + 1]
+        grb.addLConstr(gp.LinExpr(coefs[lo:hi], [x[c] for c in cols[lo:hi]]), constr_sense, constr_rhs)
+    if start is not None:
+        grb.setAttr('Start', x, np.where(np.isnan(start), GRB.UNDEFINED, start).tolist())
+    grb.optimize()
+
+    status = {GRB.OPTIMAL: 'optimal', GRB.INFEASIBLE: 'infeasible', GRB.TIME_LIMIT: 'time_limit',
+              GRB.INF_OR_UNBD: 'infeasible', GRB.UNBOUNDED: 'unbounded'}.get(grb.Status, 'status_%s' % grb.Status)
+    if grb.SolCount == 0:
+        return MipResult(status)
+    bound = grb.ObjBound if grb.IsMIP else grb.ObjVal
+    return MipResult(status, grb.ObjVal, np.array(grb.getAttr('X', x)), bound)
+
+
+def _highs_available():
+    try:
+        import highspy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _solve_highs(model, time_limit, mip_gap, start, verbose):
+    import highspy
+
+    lb, ub, vtype, obj = model.columns()
+    rows, cols, coefs, sense, rhs = model.matrix()
+    order = np.lexsort((rows, cols))  # HiGHS使用按列压缩（CSC）的矩阵
+    rows, cols, coefs = rows[order], cols[order], coefs[order]
+    lower, upper = _row_bounds(sense, rhs)
+
+    lp = highspy.HighsLp()
+    lp.num_col_ = model.num_vars
+    lp.num_row_ = model.num_constrs
+    lp.col_cost_ = obj * model.sense
+    lp.col_lower_ = np.where(lb == -INF, -highspy.kHighsInf, lb)
+    lp.col_upper_ = np.where(ub == INF, highspy.kHighsInf, ub)
+    lp.row_lower_ = np.where(lower == -INF, -highspy.kHighsInf, lower)
+    lp.row_upper_ = np.where(upper == INF, highspy.kHighsInf, upper)
+    lp.offset_ = model.obj_constant * model.sense
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = np.searchsorted(cols, np.arange(model.num_vars + 1)).astype(np.int32)
+    lp.a_matrix_.index_ = rows.astype(np.int32)
+    lp.a_matrix_.value_ = coefs
+    lp.integrality_ = [highspy.HighsVarType.kContinuous if t == CONTINUOUS else highspy.HighsVarType.kInteger
+                       for t in vtype]
+
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', bool(verbose))
+    if time_limit is not None:
+        h.setOptionValue('time_limit', float(time_limit))
+    if mip_gap is not None:
+        h.setOptionValue('mip_rel_gap', float(mip_gap))
+    if h.passModel(lp) == highspy.HighsStatus.kError:
+        raise RuntimeError('HiGHS不接受模型%s（见HiGHS的输出）' % model.name)
+    if start is not None and not np.isnan(start).any():
+        solution = highspy.HighsSolution()
+        solution.col_value = list(start)
+        solution.value_valid = True
+        h.setSolution(solution)
+    h.run()
+
+    model_status = h.getModelStatus()
+    status = {highspy.HighsModelStatus.kOptimal: 'optimal', highspy.HighsModelStatus.kInfeasible: 'infeasible',
+              highspy.HighsModelStatus.kTimeLimit: 'time_limit'}.get(model_status, h.modelStatusToString(model_status))
+    info = h.getInfo()
+    values = np.array(h.getSolution().col_value)
+    if values.shape[0] != model.num_vars or info.primal_solution_status == 0:
+        return MipResult(status)
+    objective = info.objective_function_value * model.sense
+    bound = getattr(info, 'mip_dual_bound', objective) * model.sense
+    return MipResult(status, objective, values, bound)
+
+
+def _cbc_available():
+    return shutil.which('cbc') is not None
+
+
+def _solve_cbc(model, time_limit, mip_gap, start, verbose):
+    """通过MPS文件调用cbc命令行程序求解（不支持初始解）"""
+    names = model.var_names()
+    with tempfile.TemporaryDirectory() as tmp:
+        mps_path = os.path.join(tmp, 'model.mps')
+        solution_path = os.path.join(tmp, 'solution.txt')
+        model.write_mps(mps_path)
+        command = ['cbc', mps_path]
+        if model.sense == MAXIMIZE:
+            command += ['-max']
+        if time_limit is not None:
+            command += ['-sec', str(time_limit)]
+        if mip_gap is not None:
+            command += ['-ratio', str(mip_gap)]
+        command += ['-solve', '-solu', solution_path]
+        subprocess.run(command, check=False, stdout=None if verbose else subprocess.DEVNULL,
+                       stderr=None if verbose else subprocess.DEVNULL)
+        if not os.path.exists(solution_path):
+            return MipResult('error')
+        with open(solution_path) as f:
+            header = f.readline()
+            lines = f.read().split('\n')
+    lowered = header.lower()
+    if 'infeasible' in lowered:
+        return MipResult('infeasible')
+    status = 'optimal' if lowered.startswith('optimal') else ('time_limit' if 'stopped' in lowered else 'feasible')
+    index_of = {name: j for j, name in enumerate(names)}
+    values = np.zeros(model.num_vars)
+    for line in lines:
+        fields = line.replace('**', ' ').split()
+        if len(fields) >= 3 and fields[1] in index_of:
+            values[index_of[fields[1]]] = float(fields[2])
+    lb, ub, vtype, obj = model.columns()
+    return MipResult(status, float(obj @ values) + model.obj_constant, values)
+
+
+BACKENDS = {
+    'gurobi': (_gurobi_available, _solve_gurobi),
+    'highs': (_highs_available, _solve_highs),
+    'cbc': (_cbc_available, _solve_cbc),
+}
+
+
+def available_backends():
+    """已安装的求解器后端，按优先顺序排列"""
+    return [name for name, (available, _) in BACKENDS.items() if available()]
@@ -6,6 +6,7 @@
 @time: 2020/10/19 17:24
 @description:
 """
+from route_cache import RouteCache
 
 
 class Node(object):
@@ -22,6 +23,8 @@ class Node(object):
     delivery_index:Number,点如果是送货任务，那么此值等于0；点如果是取货任务，那么此值对应其送货任务的点编号
     belong_veh:所属车辆编号
     '''
+    __slots__ = ('c_id', 'demand', 'ready_time', 'due_time', 'service_time', 'pickup_index', 'delivery_index',
+                 'block_id', 'container_id', 'belong_veh')
 
     def __init__(self, c_id, demand, ready_time, due_time, service_time, pickup_index, delivery_index, block_id,
                  container_id):
@@ -39,6 +42,9 @@ class Node(object):
 
 class PDNode(object):
     """一对取送货点类（PD-pair）"""
+    __slots__ = ('pd_id', 'p_id', 'd_id', 'p_time_window', 'd_time_window', 'p_service_time', 'd_service_time',
+                 'p_block_id', 'd_block_id', 'container_id', 'travel_distance', 'travel_time', 'time_window_period',
+                 'belong_veh')
 
     def __init__(self, pd_id, p_id, d_id, travel_distance, travel_time, p_tw, d_tw, p_service_time, d_service_time,
                  container_id, p_block_id, d_block_id):
@@ -70,4 +76,40 @@ class PDNode(object):
         description = "PD点对[%s,%s]无效，其时间窗分别为%s,%s,行驶距离为%s，行驶时间为%s" % \
                       (self.p_id, self.d_id, self.p_time_window, self.d_time_window, self.travel_distance,
                        self.travel_time)
-        return description
\ No newline at end of file
+        return description
+
+# 节点类型
+DEPOT = 0  # depot（开始depot和结束depot）
+PICKUP = 1  # 取货点P
+DELIVERY = 2  # 送货点D
+
+
+def node_type_of(node):
+    """根据pickup_index和delivery_index判断节点类型"""
+    if node.pickup_index == 0 and node.delivery_index != 0:
+        return PICKUP
+    if node.pickup_index != 0 and node.delivery_index == 0:
+        return DELIVERY
+    return DEPOT
+
+
+class NodeTable(list):
+    '''
+    Node对象列表（可以像原来的nodes列表一样按下标取Node），同时按节点编号保存列式数据，
+    供Vehicle在更新路径信息和评价插入时直接按下标读取，不必每次访问Node对象的属性。
+    同一算例的所有车辆应共用同一个NodeTable。
+    latest_arrival:List,取货点P不违背硬时间窗的最晚到达时间，其他点为inf
+    route_cache:RouteCache,同一算例所有车辆共享的路径评价缓存（见route_cache.py），修改列式数据后要调用route_cache.clear()
+    '''
+
+    def __init__(self, nodes):
+        super(NodeTable, self).__init__(nodes)
+        self.ready_time = [n.ready_time for n in nodes]
+        self.due_time = [n.due_time for n in nodes]
+        self.service_time = [n.service_time for n in nodes]
+        self.demand = [n.demand for n in nodes]
+        self.node_type = [node_type_of(n) for n in nodes]
+        self.partner = [n.delivery_index if n.delivery_index != 0 else n.pickup_index for n in nodes]
+        self.latest_arrival = [max(n.ready_time, n.due_time - n.service_time) if t == PICKUP else float('inf')
+                               for n, t in zip(nodes, self.node_type)]
+        self.route_cache = RouteCache()
@@ -4,5 +4,212 @@
 @contact: yuanxin9997@qq.com
 @file: output_results.py
 @time: 2020/10/19 16:56
-@description:输出PDPTW问题的求解结果
+@description:输出PDPTW问题的求解结果：基准测试的分阶段计时、峰值内存、与最好已知解的差距，结果存储和两次运行的比较
+==结果存储：JSON Lines文件，每个(算例, 算法)一行记录，只追加不修改（由main.py的批量运行器写入）；
+==同一个文件中同一算例有多条记录时以最后一条为准
+==每条记录的字段：instance、algorithm、status、phases（load读取数据、matrix构造距离和时间矩阵、
+==construction构造初始解或建立模型、solve求解，单位秒）、peak_rss_mb、objective、distance、vehicles、gap（%）、
+==route_cache（主进程中路径评价缓存的命中率等，见route_cache.py）等
+==命令行：python output_results.py summary results/tabu.jsonl
+==        python output_results.py compare results/old.jsonl results/new.jsonl（有退化时退出码为1）
 """
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不记录峰值内存
+    resource = None
+
+PHASES = ('load', 'matrix', 'construction', 'solve')
+
+
+class PhaseTimer(object):
+    '''
+    分阶段计时器：
+    times:Dict,键为阶段名称，值为累计用时（秒）
+    '''
+
+    def __init__(self):
+        self.times = {}
+
+    @contextmanager
+    def phase(self, name):
+        """with timer.phase('load'): ... 记录with块的用时，同一阶段多次进入时累加"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def total(self):
+        return sum(self.times.values())
+
+
+def peak_rss_mb():
+    """当前进程的峰值常驻内存（MB），不支持时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024.0 ** 2 if sys.platform == 'darwin' else peak / 1024.0  # macOS单位为字节，Linux为KB
+
+
+def run_metadata():
+    """一次运行的环境信息：git提交、主机名、Python版本、开始时间"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'host': platform.node(), 'python': platform.python_version(),
+            'started': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+# ===================最好已知解===================
+def load_best_known(path):
+    """读取最好已知解文件，每行为“算例名称 车辆数 总距离”（#开头的行为注释），返回{算例名称: (车辆数, 总距离)}"""
+    best_known = {}
+    if not path:
+        return best_known
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3 or fields[0].startswith('#'):
+                continue
+            best_known[fields[0]] = (int(fields[1]), float(fields[2]))
+    return best_known
+
+
+def gap_to_best_known(record, best_known):
+    """记录的总距离与最好已知解的相对差距（%），没有最好已知解或有未安排的请求时返回None"""
+    known = best_known.get(record.get('instance'))
+    if known is None or record.get('status') != 'ok' or record.get('unassigned'):
+        return None
+    return 100.0 * (record['distance'] - known[1]) / known[1]
+
+
+# ===================结果存储===================
+def read_results(path):
+    """读取结果文件，返回{(算例路径, 算法): 记录}，同一键有多条记录时取最后一条，忽略写了一半的行"""
+    results = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            results[record['path'], record['algorithm']] = record
+    return results
+
+
+def _solve_time(record):
+    phases = record.get('phases') or {}
+    return phases.get('solve', record.get('time'))
+
+
+def format_table(rows, columns):
+    """把字典列表格式化成文本表格，columns为[(标题, 键, 格式), ...]"""
+    cells = [[title for title, _, _ in columns]]
+    for row in rows:
+        cells.append(['' if row.get(key) is None else (fmt % row[key] if fmt else str(row[key]))
+                      for _, key, fmt in columns])
+    widths = [max(len(line[c]) for line in cells) for c in range(len(columns))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(line, widths)) for line in cells]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+SUMMARY_COLUMNS = [('instance', 'instance', None), ('algorithm', 'algorithm', None), ('status', 'status', None),
+                   ('load', 'load', '%.3f'), ('matrix', 'matrix', '%.3f'), ('construction', 'construction', '%.3f'),
+                   ('solve', 'solve', '%.2f'), ('rss_mb', 'peak_rss_mb', '%.0f'), ('objective', 'objective', '%.2f'),
+                   ('vehicles', 'vehicles', '%d'), ('gap%', 'gap', '%.2f'), ('cache_hit%', 'cache_hit', '%.1f')]
+
+
+def summarize(results):
+    """每条记录一行的汇总表"""
+    rows = []
+    for (path, algorithm), record in sorted(results.items()):
+        row = dict(record)
+        row.update(record.get('phases') or {})
+        if record.get('route_cache'):
+            row['cache_hit'] = 100.0 * record['route_cache']['hit_rate']
+        rows.append(row)
+    return format_table(rows, SUMMARY_COLUMNS)
+
+
+# ===================比较两次运行===================
+COMPARE_COLUMNS = [('instance', 'instance', None), ('algorithm', 'algorithm', None),
+                   ('old_solve', 'old_time', '%.2f'), ('new_solve', 'new_time', '%.2f'),
+                   ('time_ratio', 'time_ratio', '%.2f'), ('old_objective', 'old_objective', '%.2f'),
+                   ('new_objective', 'new_objective', '%.2f'), ('delta%', 'delta', '%+.3f'), ('flag', 'flag', None)]
+
+
+def compare_runs(old, new, time_tolerance=0.2, min_time=0.5, quality_tolerance=0.001):
+    """比较两次运行（read_results的结果）中都有的(算例, 算法)，返回(比较结果列表, 退化数)。
+    运行时间退化：新的solve用时超过旧的(1 + time_tolerance)倍，且两者之差超过min_time秒（避免很短的用时被噪声放大）；
+    质量退化：目标函数值增加超过quality_tolerance（相对值），或者原来成功的算例失败了
+    """
+    rows = []
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        a, b = old[key], new[key]
+        row = {'instance': b.get('instance') or os.path.basename(key[0]), 'algorithm': key[1],
+               'old_time': _solve_time(a), 'new_time': _solve_time(b),
+               'old_objective': a.get('objective'), 'new_objective': b.get('objective')}
+        flags = []
+        if a['status'] == 'ok' and b['status'] != 'ok':
+            flags.append('failed:%s' % b['status'])
+        if row['old_time'] and row['new_time'] is not None:
+            row['time_ratio'] = row['new_time'] / row['old_time']
+            if row['new_time'] > row['old_time'] * (1 + time_tolerance) and \
+                    row['new_time'] - row['old_time'] > min_time:
+                flags.append('slower')
+        if a['status'] == 'ok' and b['status'] == 'ok':
+            row['delta'] = 100.0 * (b['objective'] - a['objective']) / max(abs(a['objective']), 1e-9)
+            if row['delta'] > 100.0 * quality_tolerance:
+                flags.append('worse')
+        row['flag'] = ','.join(flags)
+        regressions += bool(flags)
+        rows.append(row)
+    return rows, regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='PDPTW基准测试结果的汇总与比较')
+    commands = parser.add_subparsers(dest='command', required=True)
+    summary = commands.add_parser('summary', help='输出结果文件的汇总表')
+    summary.add_argument('results')
+    summary.add_argument('--json', action='store_true', help='输出JSON而不是表格')
+    compare = commands.add_parser('compare', help='比较两次运行，标记运行时间和求解质量的退化')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--time-tolerance', type=float, default=0.2, help='允许的运行时间相对增加量')
+    compare.add_argument('--min-time', type=float, default=0.5, help='运行时间增加少于该值（秒）时不算退化')
+    compare.add_argument('--quality-tolerance', type=float, default=0.001, help='允许的目标函数值相对增加量')
+    compare.add_argument('--all', action='store_true', help='输出所有算例，而不只是有退化的算例')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == 'summary':
+        run_results = read_results(args.results)
+        if args.json:
+            print(json.dumps(list(run_results.values()), ensure_ascii=False, indent=1))
+        else:
+            print(summarize(run_results))
+    else:
+        compared, regression_num = compare_runs(read_results(args.old), read_results(args.new), args.time_tolerance,
+                                                args.min_time, args.quality_tolerance)
+        shown = compared if args.all else [row for row in compared if row['flag']]
+        if shown:
+            print(format_table(shown, COMPARE_COLUMNS))
+        print('共比较%s个算例，%s个退化' % (len(compared), regression_num))
+        sys.exit(1 if regression_num else 0)
@@ -4,7 +4,246 @@
 @contact: yuanxin9997@qq.com
 @file: particle_swarm_optimization_pdptw.py
 @time: 2020/10/19 17:03
-@description:
+@description:求解PDPTW问题的向量化粒子群算法（随机键编码）
+==编码：每个粒子是长度为3m的[0, 1)随机键向量（m为运输请求数），
+==前m维为每个请求的车辆键（车辆 = floor(键 * 车辆数)），中间m维为取货点的顺序键，后m维为送货点的相对顺序键，
+==送货点的顺序键为kp + (1 - kp) * kd >= kp，所以同一辆车中送货点总是排在取货点之后（先取后送）
+==整个种群的位置和速度是(粒子数, 3m)的numpy数组，速度和位置的更新都是一次数组运算
+==解码：整个种群一起解码，按(粒子, 车辆, 顺序键)排序得到所有路径，再沿路径位置逐步向量化地计算时间和载重，
+==与Vehicle.update_info的规则相同；会违背取货点硬时间窗或超过载量的请求被跳过（记为未安排），
+==所以解码得到的路径都是可行的
 """
+import itertools
+import time
 
+import numpy as np
 
+import profiler
+from insertion_heuristic import regret_insertion
+from node import DELIVERY, PICKUP
+from read_data import read_data
+from solution import SOFT_PENALTY, UNASSIGNED_PENALTY, Solution
+
+KEY_MAX = 1.0 - 1e-9  # 随机键的上界（不含1，车辆键乘以车辆数后向下取整不会越界）
+
+
+class SwarmDecoder(object):
+    '''
+    随机键的批量解码器：
+    instance:Instance,算例
+    route_num:Number,车辆数（路径数），默认为算例的车辆数K
+    '''
+
+    def __init__(self, instance, route_num=None, soft_penalty=SOFT_PENALTY, unassigned_penalty=UNASSIGNED_PENALTY):
+        self.instance = instance
+        self.route_num = route_num or instance.vehicle_num
+        self.soft_penalty = soft_penalty
+        self.unassigned_penalty = unassigned_penalty
+        nodes = instance.nodes
+        self.pickups = instance.requests[:, 0]
+        self.deliveries = instance.requests[:, 1]
+        self.request_num = instance.request_num
+        self.dimension = 3 * self.request_num
+        self.ready = instance.ready_time
+        self.due = instance.due_time
+        self.serv = instance.service_time
+        self.demand = instance.demand.astype(np.float64)
+        self.latest = np.asarray(nodes.latest_arrival)
+        self.is_pickup = np.asarray(nodes.node_type) == PICKUP
+        self.is_delivery = np.asarray(nodes.node_type) == DELIVERY
+        self.partner = np.asarray(nodes.partner)
+        self.distance = instance.matrix.distance
+        self.time = instance.matrix.time_matrix(instance.speed)
+
+    def routes_of(self, positions):
+        """把(粒子数, 3m)的随机键解码成路径：返回形状为(粒子数*车辆数, 最大路径长度)的点编号数组（不含depot，-1为空位），
+        第g行为粒子g // 车辆数的第g % 车辆数辆车
+        """
+        swarm_size = positions.shape[0]
+        m = self.request_num
+        vehicle = np.floor(positions[:, :m] * self.route_num).astype(np.int64)
+        key_p = positions[:, m:2 * m]
+        key_d = key_p + (1.0 - key_p) * positions[:, 2 * m:]
+        group = np.arange(swarm_size)[:, None] * self.route_num + vehicle
+        group = np.concatenate([group, group], axis=1).ravel()
+        key = np.concatenate([key_p, key_d], axis=1).ravel()
+        node = np.tile(np.concatenate([self.pickups, self.deliveries]), swarm_size)
+
+        order = np.lexsort((key, group))
+        group, node = group[order], node[order]
+        group_num = swarm_size * self.route_num
+        counts = np.bincount(group, minlength=group_num)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank = np.arange(group.shape[0]) - starts[group]
+        routes = np.full((group_num, max(1, counts.max())), -1, dtype=np.int64)
+        routes[group, rank] = node
+        return routes
+
+    def evaluate(self, positions):
+        """批量解码并评价整个种群，返回(适应度数组, 路径数组, 被跳过的请求的掩码)。
+        沿路径位置逐步计算，每一步是对所有粒子所有车辆的一次向量化运算
+        """
+        routes = self.routes_of(positions)
+        group_num, length = routes.shape
+        swarm_size = positions.shape[0]
+        owner = np.arange(group_num) // self.route_num  # 每条路径所属的粒子
+        start, end = self.instance.start_depot, self.instance.end_depot
+        cap = self.instance.capacity
+
+        cur = np.full(group_num, start, dtype=np.int64)
+        departure = np.full(group_num, self.ready[start] + self.serv[start])
+        load = np.zeros(group_num)
+        distance = np.zeros(group_num)
+        soft = np.zeros(group_num)
+        dropped = np.zeros((swarm_size, self.instance.node_num), dtype=bool)
+        for k in range(length):
+            node = routes[:, k]
+            active = np.nonzero(node >= 0)[0]
+            node = node[active]
+            keep = ~dropped[owner[active], node]
+            active, node = active[keep], node[keep]
+            arrival = departure[active] + self.time[cur[active], node]
+            # 违背取货点硬时间窗或超过载量的请求被跳过
+            skip = self.is_pickup[node] & ((arrival > self.latest[node]) | (load[active] + self.demand[node] > cap))
+            if skip.any():
+                dropped[owner[active[skip]], node[skip]] = True
+                dropped[owner[active[skip]], self.partner[node[skip]]] = True
+                routes[active[skip], k] = -1
+                active, node, arrival = active[~skip], node[~skip], arrival[~skip]
+            late = self.is_delivery[node] & (arrival > self.ready[node])
+            soft[active] += np.where(late, np.maximum(arrival + self.serv[node] - self.due[node], 0.0), 0.0)
+            departure[active] = np.maximum(arrival, self.ready[node]) + self.serv[node]
+            load[active] += self.demand[node]
+            distance[active] += self.distance[cur[active], node]
+            cur[active] = node
+        distance += self.distance[cur, end]
+        routes[dropped[owner[:, None], np.maximum(routes, 0)] & (routes >= 0)] = -1
+
+        unassigned = dropped[:, self.pickups]
+        fitness = (distance + self.soft_penalty * soft).reshape(swarm_size, self.route_num).sum(axis=1) + \
+            self.unassigned_penalty * unassigned.sum(axis=1)
+        return fitness, routes, unassigned
+
+    def to_routes(self, routes, index):
+        """取出第index个粒子的路径列表（每条路径为[开始depot, ..., 结束depot]，省略空路径）"""
+        start, end = self.instance.start_depot, self.instance.end_depot
+        rows = routes[index * self.route_num:(index + 1) * self.route_num]
+        result = []
+        for row in rows:
+            nodes = row[row >= 0].tolist()
+            if nodes:
+                result.append([start] + nodes + [end])
+        return result
+
+    def encode(self, solution, rng):
+        """把一个解编码成随机键（用于把构造启发式的解放入初始种群），未安排的请求使用随机键"""
+        m = self.request_num
+        position = rng.random(self.dimension) * KEY_MAX
+        index_of = {p: r for r, p in enumerate(self.pickups.tolist())}
+        used = [veh for veh in solution.vehicles if len(veh.route) > 2][:self.route_num]
+        for v, veh in enumerate(used):
+            route = veh.route
+            size = len(route)
+            for k in range(1, size - 1):
+                n = route[k]
+                if self.is_pickup[n]:
+                    r = index_of[n]
+                    position[r] = (v + 0.5) / self.route_num
+                    key_p = k / size
+                    key_d = route.index(self.partner[n]) / size
+                    position[m + r] = key_p
+                    position[2 * m + r] = (key_d - key_p) / (1.0 - key_p)
+        return position
+
+
+def particle_swarm_optimization(instance, swarm_size=30, iterations=500, time_limit=None, route_num=None,
+                                inertia=(0.9, 0.4), c1=2.0, c2=2.0, max_velocity=0.2, seed_with_heuristic=True,
+                                repair=True, initial_solution=None, migration=None, seed=0, verbose=True):
+    """向量化粒子群算法主程序，返回(最好的解, 统计信息)。
+    惯性权重按运行进度（已迭代次数/iterations，给出time_limit时取它和已用时间/time_limit的较大者）
+    从inertia[0]线性下降到inertia[1]；seed_with_heuristic为True时把后悔值插入的解编码后放入初始种群；
+    repair为True时对最好粒子解码得到的解中未安排的请求再做一次后悔值插入；
+    initial_solution不为None时代替后悔值插入的解放入初始种群，解码后的最好解比它差时返回它的副本；
+    iterations为None时只受time_limit限制；migration为迁移钩子（见metaheuristics.py），每次迭代调用，
+    迁入的解编码后替换个体最好位置最差的粒子，比全局最好解好时同时作为全局最好解
+    """
+    if iterations is None and time_limit is None:
+        raise ValueError('iterations和time_limit至少要给出一个')
+    rng = np.random.default_rng(seed)
+    start = time.time()
+    decoder = SwarmDecoder(instance, route_num)
+    dim = decoder.dimension
+
+    position = rng.random((swarm_size, dim)) * KEY_MAX
+    if initial_solution is not None:
+        position[0] = decoder.encode(initial_solution, rng)
+    elif seed_with_heuristic:
+        position[0] = decoder.encode(regret_insertion(Solution.empty(instance), k=2), rng)
+    velocity = rng.uniform(-max_velocity, max_velocity, (swarm_size, dim))
+    fitness, routes, _ = decoder.evaluate(position)
+    personal_best, personal_fitness = position.copy(), fitness.copy()
+    g = int(np.argmin(fitness))
+    global_best, global_fitness, global_routes = position[g].copy(), fitness[g], decoder.to_routes(routes, g)
+    stats = {'iterations': 0, 'evaluations': swarm_size, 'migrants': 0, 'best_history': [global_fitness]}
+
+    with profiler.timer('pso.main_loop'):
+        for it in itertools.count() if iterations is None else range(iterations):
+            progress = 0.0 if iterations is None else it / max(1, iterations - 1)
+            if time_limit is not None:
+                elapsed = time.time() - start
+                if elapsed >= time_limit:
+                    break
+                progress = max(progress, elapsed / time_limit)
+            w = inertia[0] - (inertia[0] - inertia[1]) * progress
+            immigrant = migration(global_fitness, lambda: global_routes) if migration is not None else None
+            if immigrant is not None:
+                immigrant = Solution.from_routes(instance, immigrant)
+                k = int(np.argmax(personal_fitness))
+                position[k] = personal_best[k] = decoder.encode(immigrant, rng)
+                personal_fitness[k] = immigrant.objective()
+                if personal_fitness[k] < global_fitness:
+                    global_best, global_fitness = position[k].copy(), personal_fitness[k]
+                    global_routes = [list(route) for route in immigrant.routes() if len(route) > 2]
+                stats['migrants'] += 1
+            r1, r2 = rng.random((swarm_size, dim)), rng.random((swarm_size, dim))
+            velocity = w * velocity + c1 * r1 * (personal_best - position) + c2 * r2 * (global_best - position)
+            np.clip(velocity, -max_velocity, max_velocity, out=velocity)
+            position += velocity
+            np.clip(position, 0.0, KEY_MAX, out=position)
+
+            fitness, routes, _ = decoder.evaluate(position)
+            improved = fitness < personal_fitness
+            personal_best[improved] = position[improved]
+            personal_fitness[improved] = fitness[improved]
+            g = int(np.argmin(fitness))
+            if fitness[g] < global_fitness:
+                global_best, global_fitness = position[g].copy(), fitness[g]
+                global_routes = decoder.to_routes(routes, g)
+            stats['iterations'] = it + 1
+            stats['evaluations'] += swarm_size
+            stats['best_history'].append(global_fitness)
+            if verbose and it % 50 == 0:
+                print('第%s代，最好的目标函数值：%.2f' % (it, global_fitness))
+
+    best = Solution.from_routes(instance, global_routes)
+    if repair and best.unassigned:
+        regret_insertion(best, k=2)
+    if initial_solution is not None and initial_solution.objective() < best.objective():
+        best = initial_solution.copy()
+    elapsed = time.time() - start
+    stats['time'] = elapsed
+    stats['evaluations_per_second'] = stats['evaluations'] / elapsed if elapsed > 0 else 0
+    profiler.count('pso.iterations', stats['iterations'])
+    return best, stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw400_revised/LR1_4_1.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, pso_stats = particle_swarm_optimization(pdptw_instance, time_limit=60)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车'.format(best_solution.used_vehicle_num))
+    print('每秒评价粒子数：', pso_stats['evaluations_per_second'])
+    print('程序总的运行时间：', pso_stats['time'], '秒')
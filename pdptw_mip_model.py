@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: pdptw_mip_model.py
+@time: 2020/10/27 14:05
+@description:用与求解器无关的建模层（mip_model）建立PDPTW问题的Parragh模型，可以用Gurobi、HiGHS或CBC求解，也可以只导出LP/MPS文件
+==模型：三下标模型（Parragh et al. 2008）和同质车队的两下标模型（Furtado et al. 2017），只在这里建立一次，
+==gurobi_pdptw_parragh.py也调用这里的模型
+==每一类约束都由弧数组上的numpy下标运算一次生成，不为每个约束写Python循环；弧集合和每条弧的大M来自arc_elimination
+==变量下标：三下标模型中x按(车辆, 弧)排列，b、q按(车辆, 点)排列；两下标模型中x按弧排列，b、q按点排列
+"""
+import os
+import time
+
+import numpy as np
+
+import profiler
+from arc_elimination import ArcSet, ELIMINATION_RULES, eliminate_instance_arcs
+from construction_heuristic import construction_heuristic, route_schedule
+from mip_model import BINARY, CONTINUOUS, EQUAL, GREATER_EQUAL, INTEGER, LESS_EQUAL, MipModel, available_backends
+from read_data import read_data
+from solution import Solution
+
+
+class PdptwMip(object):
+    '''
+    建好的PDPTW模型：
+    model:MipModel,模型
+    formulation:String,'three_index'或'two_index'
+    tails,heads:ndarray,每个x变量对应的弧(i, j)
+    vehicles:ndarray,每个x变量对应的车辆（两下标模型中都为0）
+    x:ndarray,x变量的下标
+    b,q:ndarray,b、q变量的下标，三下标模型中形状为(K, n)，两下标模型中形状为(n,)
+    v:ndarray,两下标模型中路径编号变量v的下标（按点编号，depot为-1），三下标模型中为None
+    build_time:Number,建模时间（秒）
+    '''
+
+    def __init__(self, instance, model, formulation, tails, heads, vehicles, x, b, q, v=None, build_time=0.0):
+        self.instance = instance
+        self.model = model
+        self.formulation = formulation
+        self.tails = tails
+        self.heads = heads
+        self.vehicles = vehicles
+        self.x = x
+        self.b = b
+        self.q = q
+        self.v = v
+        self.build_time = build_time
+
+    def routes(self, values):
+        """由变量取值得到路径列表（每条路径为[开始depot, ..., 结束depot]，省略空路径）"""
+        start, end = self.instance.start_depot, self.instance.end_depot
+        used = values[self.x] > 0.5
+        routes = []
+        for k in np.unique(self.vehicles[used]).tolist():
+            arcs = used & (self.vehicles == k)
+            successor = dict(zip(self.tails[arcs].tolist(), self.heads[arcs].tolist()))
+            # 两下标模型中从开始depot出发的每条弧对应一条路径
+            for first in self.heads[arcs & (self.tails == start)].tolist():
+                route = [start, first]
+                while route[-1] != end:
+                    route.append(successor[route[-1]])
+                if len(route) > 2:
+                    routes.append(route)
+        return routes
+
+    def arc_variables(self, tails, heads, vehicles):
+        """弧(tails, heads)在车辆vehicles上对应的x变量下标，被弧消除删除的弧为-1"""
+        n = self.instance.node_num
+        keys = (self.vehicles * n + self.tails) * n + self.heads  # x按(车辆, 起点, 终点)升序排列
+        query = (np.asarray(vehicles) * n + np.asarray(tails)) * n + np.asarray(heads)
+        position = np.minimum(np.searchsorted(keys, query), keys.shape[0] - 1)
+        return np.where(keys[position] == query, self.x[position], -1)
+
+    def start_values(self, routes):
+        """把路径列表（如construction_heuristic得到的路径）转换成MIP初始解，返回按变量下标排列的数组。
+        所有请求都被安排时给出全部变量的取值（路径之外的点b取左时间窗、q取下界）；
+        否则只给出路径经过的弧x=1，其余为nan，作为部分初始解由求解器补全
+        """
+        inst = self.instance
+        n, start, end = inst.node_num, inst.start_depot, inst.end_depot
+        ready = inst.ready_time
+        time_mat = inst.matrix.time_matrix(inst.speed)
+        three_index = self.formulation == 'three_index'
+        routes = [list(route) for route in routes if len(route) > 2]
+        if three_index and len(routes) > self.b.shape[0]:
+            raise ValueError('路径数%s超过了车辆数%s' % (len(routes), self.b.shape[0]))
+        values = np.full(self.model.num_vars, np.nan)
+
+        arcs = [(i, j, r if three_index else 0) for r, route in enumerate(routes)
+                for i, j in zip(route[:-1], route[1:])]
+        if three_index:
+            arcs += [(start, end, k) for k in range(len(routes), self.b.shape[0])]  # 空车直接从开始depot到结束depot
+        if arcs:
+            tails, heads, vehicles = np.array(arcs).T
+            used = self.arc_variables(tails, heads, vehicles)
+            if (used < 0).any():
+                t = int(np.argmin(used))
+                raise ValueError('路径使用了模型中不存在的弧(%s, %s)' % (tails[t], heads[t]))
+        else:
+            used = np.zeros(0, dtype=np.int64)
+        served = set(node for route in routes for node in route[1:-1])
+        if len(served) < n - 2:
+            values[used] = 1
+            return values
+
+        values[self.x] = 0
+        values[used] = 1
+        # 路径之外的点（三下标模型中其他车辆上的点）：b取左时间窗，送货点不早于取货点；q取下界
+        pickups, deliveries = inst.requests[:, 0], inst.requests[:, 1]
+        default_b = ready.astype(np.float64).copy()
+        default_b[deliveries] = np.maximum(ready[deliveries], ready[pickups])
+        lb = self.model.columns()[0]
+        b_rows = self.b if three_index else self.b[None, :]
+        q_rows = self.q if three_index else self.q[None, :]
+        values[b_rows] = default_b
+        values[q_rows] = lb[q_rows]
+        if not three_index:
+            values[self.b[end]] = ready[end]
+        for r, route in enumerate(routes):
+            b, q = route_schedule(route, ready, inst.service_time, inst.demand, time_mat)
+            k = r if three_index else 0
+            if not three_index:
+                values[self.v[route[1:-1]]] = route[1]  # 路径编号为路径上第一个客户点的编号
+                b[-1] = max(b[-1], values[self.b[end]])  # 两下标模型中所有路径共用结束depot的b
+            values[b_rows[k, route]] = b
+            values[q_rows[k, route]] = q
+        return values
+
+
+def _instance_arcs(instance, arc_elimination):
+    """模型的弧集合；不做弧消除时为完整弧集合，大M为2*(LatestTime+LongestDistance)和100*Q（与build_pdptw_model相同）"""
+    if arc_elimination:
+        return eliminate_instance_arcs(instance)
+    n = instance.node_num
+    allowed = np.ones((n, n), dtype=bool)
+    allowed[:, instance.start_depot] = False
+    allowed[instance.end_depot, :] = False
+    np.fill_diagonal(allowed, False)
+    tails, heads = np.nonzero(allowed)
+    time_big_m = np.full(tails.shape[0], 2.0 * (instance.latest_time + instance.matrix.longest_distance))
+    load_big_m = np.full(tails.shape[0], 100.0 * instance.capacity)
+    return ArcSet(tails, heads, time_big_m, load_big_m, tails.shape[0], dict.fromkeys(ELIMINATION_RULES, 0))
+
+
+def _index_of(nodes, n):
+    """长度为n的数组，nodes中的点为其在nodes中的位置，其余为-1"""
+    index = np.full(n, -1, dtype=np.int64)
+    index[nodes] = np.arange(len(nodes))
+    return index
+
+
+def _big_m_rows(model, heads_var, tails_var, x, big_m, rhs, name):
+    """批量添加var[head] - var[tail] - M*x >= rhs - M（即x=1时var[head] >= var[tail] + rhs）"""
+    count = x.shape[0]
+    rows = np.tile(np.arange(count), 3)
+    cols = np.concatenate([heads_var, tails_var, x])
+    coefs = np.concatenate([np.ones(count), -np.ones(count), -big_m])
+    model.add_constraints(rows, cols, coefs, GREATER_EQUAL, rhs - big_m, name)
+
+
+@profiler.timed('mip.build.three_index')
+def build_three_index_mip(instance, arc_elimination=True, vehicle_num=None):
+    """建立三下标Parragh模型，约束编号与build_pdptw_model相同，vehicle_num默认为算例的车辆数"""
+    build_start = time.time()
+    arc_set = _instance_arcs(instance, arc_elimination)
+    n, K, E = instance.node_num, vehicle_num or instance.vehicle_num, len(arc_set)
+    start, end = instance.start_depot, instance.end_depot
+    cap = instance.capacity
+    demand = instance.demand.astype(np.float64)
+    serv = instance.service_time
+    time_mat = instance.matrix.time_matrix(instance.speed)
+    pickups, deliveries = instance.requests[:, 0], instance.requests[:, 1]
+    m = pickups.shape[0]
+    customers = np.setdiff1d(np.arange(n), [start, end])
+    cust_index = _index_of(customers, n)
+    C = customers.shape[0]
+
+    model = MipModel('PDPTW Model')
+    tails, heads = np.tile(arc_set.tails, K), np.tile(arc_set.heads, K)
+    vehicles = np.repeat(np.arange(K), E)
+    x = model.add_variables(K * E, vtype=BINARY, obj=instance.matrix.distance[tails, heads], name='x',
+                            keys=list(zip(tails.tolist(), heads.tolist(), vehicles.tolist())))
+    # 约束（7）载量和约束（8）时间窗直接作为变量的上下界
+    q = model.add_variables(K * n, lb=np.tile(np.maximum(0.0, demand), K), ub=np.tile(np.minimum(cap, cap + demand), K),
+                            vtype=INTEGER, name='q', keys=[(i, k) for k in range(K) for i in range(n)]).reshape(K, n)
+    b = model.add_variables(K * n, lb=np.tile(instance.ready_time, K), ub=np.tile(instance.due_time, K),
+                            vtype=CONTINUOUS, name='b', keys=[(i, k) for k in range(K) for i in range(n)]).reshape(K, n)
+
+    # 约束（1）除了depot外，每个节点只被服务一次
+    out_cus = cust_index[tails] >= 0
+    model.add_constraints(cust_index[tails[out_cus]], x[out_cus], 1.0, EQUAL, np.ones(C), 'serve')
+
+    # 约束(2-3)每辆车必须从depot出发，最后回到depot
+    from_start, to_end = tails == start, heads == end
+    model.add_constraints(vehicles[from_start], x[from_start], 1.0, EQUAL, np.ones(K), 'leave_depot')
+    model.add_constraints(vehicles[to_end], x[to_end], 1.0, EQUAL, np.ones(K), 'return_depot')
+
+    # 约束(4)客户点的流平衡约束，第cust_index*K+k行
+    in_cus = cust_index[heads] >= 0
+    rows = np.concatenate([cust_index[tails[out_cus]] * K + vehicles[out_cus],
+                           cust_index[heads[in_cus]] * K + vehicles[in_cus]])
+    coefs = np.concatenate([np.ones(out_cus.sum()), -np.ones(in_cus.sum())])
+    model.add_constraints(rows, np.concatenate([x[out_cus], x[in_cus]]), coefs, EQUAL, np.zeros(C * K), 'flow')
+
+    # 约束(5)时间约束（消除子回路）和约束(6)载货量平衡约束，每条弧各自的大M
+    _big_m_rows(model, b[vehicles, heads], b[vehicles, tails], x, np.tile(arc_set.time_big_m, K),
+                serv[tails] + time_mat[tails, heads], 'time')
+    _big_m_rows(model, q[vehicles, heads], q[vehicles, tails], x, np.tile(arc_set.load_big_m, K),
+                demand[heads], 'load')
+
+    # 约束(9)取货和送货由同一辆车完成，第r*K+k行
+    pickup_of, delivery_of = _index_of(pickups, n), _index_of(deliveries, n)
+    out_p, in_d = pickup_of[tails] >= 0, delivery_of[heads] >= 0
+    rows = np.concatenate([pickup_of[tails[out_p]] * K + vehicles[out_p], delivery_of[heads[in_d]] * K + vehicles[in_d]])
+    coefs = np.concatenate([np.ones(out_p.sum()), -np.ones(in_d.sum())])
+    model.add_constraints(rows, np.concatenate([x[out_p], x[in_d]]), coefs, EQUAL, np.zeros(m * K), 'pairing')
+
+    # 约束(10)先取后送
+    rows = np.tile(np.arange(m * K), 2)
+    cols = np.concatenate([b[:, deliveries].ravel(), b[:, pickups].ravel()])
+    coefs = np.concatenate([np.ones(m * K), -np.ones(m * K)])
+    model.add_constraints(rows, cols, coefs, GREATER_EQUAL, np.zeros(m * K), 'precedence')
+
+    return PdptwMip(instance, model, 'three_index', tails, heads, vehicles, x, b, q,
+                    build_time=time.time() - build_start)
+
+
+@profiler.timed('mip.build.two_index')
+def build_two_index_mip(instance, arc_elimination=True, vehicle_num=None):
+    """建立同质车队的两下标模型，约束与build_pdptw_two_index_model相同"""
+    build_start = time.time()
+    arc_set = _instance_arcs(instance, arc_elimination)
+    n, K = instance.node_num, vehicle_num or instance.vehicle_num
+    start, end = instance.start_depot, instance.end_depot
+    cap = instance.capacity
+    demand = instance.demand.astype(np.float64)
+    serv = instance.service_time
+    time_mat = instance.matrix.time_matrix(instance.speed)
+    pickups, deliveries = instance.requests[:, 0], instance.requests[:, 1]
+    customers = np.setdiff1d(np.arange(n), [start, end])
+    cust_index = _index_of(customers, n)
+    C = customers.shape[0]
+
+    # 不使用的车辆不离开depot，所以不需要开始depot到结束depot的弧
+    keep = ~((arc_set.tails == start) & (arc_set.heads == end))
+    tails, heads = arc_set.tails[keep], arc_set.heads[keep]
+    time_big_m, load_big_m = arc_set.time_big_m[keep], arc_set.load_big_m[keep]
+    E = tails.shape[0]
+
+    model = MipModel('PDPTW Two-index Model')
+    x = model.add_variables(E, vtype=BINARY, obj=instance.matrix.distance[tails, heads], name='x',
+                            keys=list(zip(tails.tolist(), heads.tolist())))
+    q_ub = np.minimum(cap, cap + demand)
+    q_ub[start] = 0
+    q = model.add_variables(n, lb=np.maximum(0.0, demand), ub=q_ub, vtype=INTEGER, name='q')
+    b = model.add_variables(n, lb=instance.ready_time, ub=instance.due_time, vtype=CONTINUOUS, name='b')
+    v = model.add_variables(C, lb=0.0, ub=n, vtype=CONTINUOUS, name='v', keys=customers.tolist())
+    v_of = np.full(n, -1, dtype=np.int64)
+    v_of[customers] = v
+
+    # 每个客户点只被服务一次，流平衡
+    out_cus, in_cus = cust_index[tails] >= 0, cust_index[heads] >= 0
+    model.add_constraints(cust_index[tails[out_cus]], x[out_cus], 1.0, EQUAL, np.ones(C), 'leave')
+    model.add_constraints(cust_index[heads[in_cus]], x[in_cus], 1.0, EQUAL, np.ones(C), 'enter')
+
+    # 车队规模：从开始depot出发的车辆数不超过K
+    from_start = tails == start
+    model.add_constraints(np.zeros(from_start.sum()), x[from_start], 1.0, LESS_EQUAL, [K], 'fleet')
+
+    # 时间约束（同时消除子回路）和载货量平衡约束
+    _big_m_rows(model, b[heads], b[tails], x, time_big_m, serv[tails] + time_mat[tails, heads], 'time')
+    _big_m_rows(model, q[heads], q[tails], x, load_big_m, demand[heads], 'load')
+
+    # 路径编号：从depot出发后的第一个点j的v_j=j，即v_j >= j*x_0j且v_j - (j-n)*x_0j <= n
+    first = from_start & in_cus
+    count = int(first.sum())
+    v_first, j = v[cust_index[heads[first]]], heads[first].astype(np.float64)
+    rows = np.tile(np.arange(count), 2)
+    cols = np.concatenate([v_first, x[first]])
+    model.add_constraints(rows, cols, np.concatenate([np.ones(count), -j]), GREATER_EQUAL, np.zeros(count),
+                          'route_id_lower')
+    model.add_constraints(rows, cols, np.concatenate([np.ones(count), n - j]), LESS_EQUAL, np.full(count, n),
+                          'route_id_upper')
+
+    # 路径编号沿客户点之间的弧传递：|v_j - v_i| <= n*(1 - x_ij)
+    inner = out_cus & in_cus
+    count = int(inner.sum())
+    rows = np.tile(np.arange(count), 3)
+    cols = np.concatenate([v[cust_index[heads[inner]]], v[cust_index[tails[inner]]], x[inner]])
+    model.add_constraints(rows, cols, np.concatenate([np.ones(count), -np.ones(count), np.full(count, -n)]),
+                          GREATER_EQUAL, np.full(count, -n), 'route_id_lower_arc')
+    model.add_constraints(rows, cols, np.concatenate([np.ones(count), -np.ones(count), np.full(count, n)]),
+                          LESS_EQUAL, np.full(count, n), 'route_id_upper_arc')
+
+    # 取货点和送货点的路径编号相同，先取后送
+    m = pickups.shape[0]
+    rows = np.tile(np.arange(m), 2)
+    coefs = np.concatenate([np.ones(m), -np.ones(m)])
+    model.add_constraints(rows, np.concatenate([v[cust_index[pickups]], v[cust_index[deliveries]]]), coefs, EQUAL,
+                          np.zeros(m), 'same_route')
+    model.add_constraints(rows, np.concatenate([b[deliveries], b[pickups]]), coefs, GREATER_EQUAL,
+                          serv[pickups] + time_mat[pickups, deliveries], 'precedence')
+
+    return PdptwMip(instance, model, 'two_index', tails, heads, np.zeros(E, dtype=np.int64), x, b, q, v_of,
+                    time.time() - build_start)
+
+
+# 可选的模型，键为模型名称
+MIP_BUILDERS = {
+    'three_index': build_three_index_mip,
+    'two_index': build_two_index_mip,
+}
+
+
+def solve_pdptw_mip(instance, formulation='three_index', backend=None, time_limit=None, mip_gap=None,
+                    arc_elimination=True, warm_start=True, verbose=True):
+    """建立并求解PDPTW模型，返回(解Solution或None, MipResult, PdptwMip)；backend为None时使用第一个可用的求解器；
+    warm_start为True时用构造启发式（MIP的时间窗语义）的路径作为初始解
+    """
+    mip = MIP_BUILDERS[formulation](instance, arc_elimination)
+    start = None
+    if warm_start:
+        initial, _ = construction_heuristic(instance, time_windows='mip', verbose=verbose)
+        start = mip.start_values([veh.route for veh in initial.vehicles])
+    result = mip.model.solve(backend, time_limit=time_limit, mip_gap=mip_gap, start=start, verbose=verbose)
+    solution = Solution.from_routes(instance, mip.routes(result.values)) if result.has_solution else None
+    return solution, result, mip
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw100_revised/lr104.txt'
+    pdptw_instance = read_data(data_path)
+    formulation = 'three_index'
+    pdptw_mip = MIP_BUILDERS[formulation](pdptw_instance)
+    print('建模时间：', pdptw_mip.build_time, '秒')
+    print('模型规模：', pdptw_mip.model.statistics())
+    # 导出模型文件，建模时间和求解时间分开测试
+    os.makedirs('./mip_models', exist_ok=True)
+    for extension in ('lp', 'mps'):
+        export_start = time.time()
+        pdptw_mip.model.write('./mip_models/%s_%s.%s' % (pdptw_instance.name, formulation, extension))
+        print('导出%s文件的时间：' % extension, time.time() - export_start, '秒')
+    if available_backends():
+        # 用构造启发式的路径作为初始解
+        initial_solution, _ = construction_heuristic(pdptw_instance, time_windows='mip')
+        start_values = pdptw_mip.start_values([veh.route for veh in initial_solution.vehicles])
+        result = pdptw_mip.model.solve(time_limit=600, start=start_values, verbose=True)
+        print('求解器：', result.backend, '状态：', result.status, '求解时间：', result.solve_time, '秒')
+        if result.has_solution:
+            best_solution = Solution.from_routes(pdptw_instance, pdptw_mip.routes(result.values))
+            print('总行驶距离：', best_solution.total_distance)
+            print('共使用{}辆车'.format(best_solution.used_vehicle_num))
+    else:
+        print('没有可用的求解器后端，只导出了模型文件')
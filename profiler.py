@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: profiler.py
+@time: 2020/10/29 09:40
+@description:热点代码的计时、计数和采样分析，默认关闭，关闭时几乎没有额外开销
+==开启方式：环境变量PDPTW_PROFILE=1（计时和计数）或PDPTW_PROFILE=sample（另外开启采样分析），
+==  程序结束时输出报告（表格）；设置PDPTW_PROFILE_OUTPUT=路径时把报告写成JSON文件；
+==  也可以在程序中调用enable()/report()，或者python main.py --profile（报告保存在每个算例的结果记录中）
+==三种接入方式：
+==  timed(名称)：装饰数据读取、矩阵计算、建模等调用次数不多的函数，关闭时每次调用只多一次标志判断
+==  instrument(类或模块, 属性名, 名称)：登记Vehicle.update_info等高频调用的方法，只在开启期间替换为计时的包装函数，
+==    关闭时调用的就是原函数，没有任何开销
+==  timer(名称)：with块计时，用于各算法的主循环；count(名称, 次数)：计数器，如迭代次数
+==采样分析：用SIGPROF定时器（按CPU时间）每隔interval秒记录一次主线程的调用栈，统计每个函数的自身和累计样本数，
+==  只支持Unix的主线程；不需要安装额外的包
+"""
+import argparse
+import atexit
+import functools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import warnings
+
+from output_results import format_table, read_results
+
+ENV_VAR = 'PDPTW_PROFILE'
+OUTPUT_ENV_VAR = 'PDPTW_PROFILE_OUTPUT'
+SAMPLE_INTERVAL = 0.005
+
+_enabled = False
+_timers = {}  # 名称 -> [调用次数, 累计用时（秒）]
+_counters = {}  # 名称 -> 累计值
+_active = set()  # 正在计时的名称，递归调用（如flat）只计数、不重复计时
+_instrumented = []  # instrument登记的(类或模块, 属性名, 名称, 原函数)
+_sampler = None
+
+
+def enabled():
+    return _enabled
+
+
+def _call(name, func, args, kwargs):
+    """调用func并把调用次数和用时累计到名称name"""
+    entry = _timers.get(name)
+    if entry is None:
+        entry = _timers[name] = [0, 0.0]
+    entry[0] += 1
+    if name in _active:
+        return func(*args, **kwargs)
+    _active.add(name)
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        entry[1] += time.perf_counter() - start
+        _active.discard(name)
+
+
+def _patch(owner, attr, name, original):
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        return _call(name, original, args, kwargs)
+    setattr(owner, attr, wrapper)
+
+
+def timed(name):
+    """装饰器：开启时统计函数的调用次数和累计用时"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            return _call(name, func, args, kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument(owner, attr, name):
+    """登记高频调用的方法或模块级函数owner.attr，开启期间替换为计时的包装函数，关闭时恢复原函数。
+    注意：其他模块用from ... import得到的函数引用不会被替换，模块级函数只对通过模块属性的调用（包括递归调用）有效
+    """
+    original = owner.__dict__[attr] if isinstance(owner, type) else getattr(owner, attr)
+    _instrumented.append((owner, attr, name, original))
+    if _enabled:
+        _patch(owner, attr, name, original)
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        entry = _timers.get(self.name)
+        if entry is None:
+            entry = _timers[self.name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += time.perf_counter() - self.start
+        return False
+
+
+def timer(name):
+    """with profiler.timer('tabu.main_loop'): ... 开启时统计with块的用时，关闭时返回什么都不做的共享对象"""
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def count(name, n=1):
+    """计数器name增加n"""
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class StackSampler(object):
+    '''
+    基于SIGPROF的采样分析器：
+    interval:float,采样间隔（秒，按进程的CPU时间）
+    samples:int,样本数
+    self_counts:Dict,键为函数（文件:行号(函数名)），值为位于栈顶的样本数
+    total_counts:Dict,键为函数，值为在调用栈中出现的样本数
+    '''
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = {}
+        self.total_counts = {}
+        self._previous = None
+        self._running = False
+
+    @staticmethod
+    def _key(code):
+        return '%s:%s(%s)' % (os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+    def _sample(self, signum, frame):
+        self.samples += 1
+        key = self._key(frame.f_code)
+        self.self_counts[key] = self.self_counts.get(key, 0) + 1
+        seen = set()
+        while frame is not None:
+            key = self._key(frame.f_code)
+            if key not in seen:
+                seen.add(key)
+                self.total_counts[key] = self.total_counts.get(key, 0) + 1
+            frame = frame.f_back
+
+    def start(self):
+        """开始采样，不支持时给出警告并返回False"""
+        if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+            warnings.warn('采样分析只支持Unix的主线程，已跳过')
+            return False
+        self._previous = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._running = True
+        return True
+
+    def stop(self):
+        if self._running:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous)
+            self._running = False
+
+    def report(self, top=20):
+        """样本数最多的top个函数，返回[{function, self, total, self%, total%}, ...]"""
+        samples = max(self.samples, 1)
+        keys = sorted(self.total_counts, key=lambda k: (-self.self_counts.get(k, 0), -self.total_counts[k]))[:top]
+        return [{'function': key, 'self': self.self_counts.get(key, 0), 'total': self.total_counts[key],
+                 'self%': 100.0 * self.self_counts.get(key, 0) / samples,
+                 'total%': 100.0 * self.total_counts[key] / samples} for key in keys]
+
+
+def enable(sampling=False, interval=SAMPLE_INTERVAL):
+    """开启计时和计数，sampling为True时同时开始采样分析"""
+    global _enabled, _sampler
+    if not _enabled:
+        _enabled = True
+        for owner, attr, name, original in _instrumented:
+            _patch(owner, attr, name, original)
+    if sampling and _sampler is None:
+        _sampler = StackSampler(interval)
+        if not _sampler.start():
+            _sampler = None
+
+
+def disable():
+    """关闭计时、计数和采样分析，恢复instrument登记的原函数；已经收集的数据保留到reset()"""
+    global _enabled
+    if _sampler is not None:
+        _sampler.stop()
+    if _enabled:
+        _enabled = False
+        for owner, attr, name, original in _instrumented:
+            setattr(owner, attr, original)
+
+
+def reset():
+    """清空已经收集的数据，开启状态不变（采样分析重新开始）"""
+    global _sampler
+    _timers.clear()
+    _counters.clear()
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = StackSampler(_sampler.interval)
+        if not (_enabled and _sampler.start()):
+            _sampler = None
+
+
+def report(top=20):
+    """本次运行的报告：{'timers': {名称: {calls, total, mean}}, 'counters': {名称: 值}, 'samples': [...]}"""
+    timers = {name: {'calls': calls, 'total': total, 'mean': total / calls if calls else 0.0}
+              for name, (calls, total) in _timers.items()}
+    result = {'timers': timers, 'counters': dict(_counters)}
+    if _sampler is not None:
+        result['sample_num'] = _sampler.samples
+        result['samples'] = _sampler.report(top)
+    return result
+
+
+TIMER_COLUMNS = [('timer', 'name', None), ('calls', 'calls', '%d'), ('total_s', 'total', '%.4f'),
+                 ('mean_ms', 'mean_ms', '%.4f')]
+COUNTER_COLUMNS = [('counter', 'name', None), ('value', 'value', None)]
+SAMPLE_COLUMNS = [('function', 'function', None), ('self', 'self', '%d'), ('self%', 'self%', '%.1f'),
+                  ('total', 'total', '%d'), ('total%', 'total%', '%.1f')]
+
+
+def format_report(result):
+    """把report()的结果格式化成文本表格，计时按累计用时从大到小排列"""
+    parts = []
+    timers = sorted(result['timers'].items(), key=lambda item: -item[1]['total'])
+    if timers:
+        parts.append(format_table([dict(stat, name=name, mean_ms=1000.0 * stat['mean']) for name, stat in timers],
+                                  TIMER_COLUMNS))
+    if result['counters']:
+        parts.append(format_table([{'name': name, 'value': value} for name, value in sorted(result['counters'].items())],
+                                  COUNTER_COLUMNS))
+    if result.get('samples'):
+        parts.append('采样数：%s' % result['sample_num'])
+        parts.append(format_table(result['samples'], SAMPLE_COLUMNS))
+    return '\n\n'.join(parts)
+
+
+def write_report(path, result=None):
+    """把报告写成JSON文件"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report() if result is None else result, f, ensure_ascii=False, indent=1)
+
+
+def _report_at_exit():
+    result = report()
+    if not (result['timers'] or result['counters'] or result.get('samples')):
+        return
+    disable()
+    path = os.environ.get(OUTPUT_ENV_VAR)
+    if path:
+        write_report(path, result)
+    else:
+        print(format_report(result), file=sys.stderr)
+
+
+def mode_from_environment():
+    """环境变量PDPTW_PROFILE指定的模式：None（关闭）、'timers'或'sample'"""
+    mode = os.environ.get(ENV_VAR, '').strip().lower()
+    if mode in ('', '0', 'off', 'false', 'no'):
+        return None
+    return 'sample' if mode == 'sample' else 'timers'
+
+
+def _configure_from_environment():
+    mode = mode_from_environment()
+    if mode is not None:
+        enable(sampling=mode == 'sample')
+        atexit.register(_report_at_exit)
+
+
+_configure_from_environment()
+
+
+if __name__ == '__main__':
+    # 输出main.py --profile的结果文件中每个算例的报告
+    parser = argparse.ArgumentParser(description='输出批量运行结果中每个算例的profiler报告')
+    parser.add_argument('results', help='main.py --profile写出的结果文件')
+    parser.add_argument('--instances', nargs='*', help='只输出这些算例')
+    parser.add_argument('--json', action='store_true', help='输出JSON而不是表格')
+    args = parser.parse_args()
+    for (_, algorithm), record in sorted(read_results(args.results).items()):
+        if 'profile' not in record or (args.instances and record['instance'] not in args.instances):
+            continue
+        if args.json:
+            print(json.dumps({'instance': record['instance'], 'algorithm': algorithm, 'profile': record['profile']},
+                             ensure_ascii=False))
+        else:
+            print('===== %s %s =====' % (record['instance'], algorithm))
+            print(format_report(record['profile']))
+            print()
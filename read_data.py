@@ -5,8 +5,214 @@
 @file: read_data.py
 @time: 2020/10/19 16:50
 @description:读取数据文件
+==Li & Lim benchmark文件第一行为：车辆数K、车辆容量C、车辆速度S
+==其余每行为：TaskNo、X、Y、Demand、ET、LT、ST、PI、DI
+==读取结果以列式的Instance对象返回，并在数据文件旁边写一个.npz二进制缓存，再次读取时直接加载缓存
 """
+import os
 
+import numpy as np
 
-def read_data(path):
-    return
+import profiler
+from instance_matrix import InstanceMatrix
+from node import Node, NodeTable
+from spatial_index import NeighbourhoodProvider
+
+CACHE_VERSION = 1  # 缓存格式版本号，格式变化时加1，使旧缓存失效
+COLUMN_NAMES = ['TaskNo', 'X', 'Y', 'Demand', 'ET', 'LT', 'ST', 'PI', 'DI']
+
+
+class Instance(object):
+    '''
+    算例类（列式存储，每一列为一个numpy数组，下标即节点编号TaskNo）：
+    name:String,算例名称，如lr104
+    vehicle_num:Number,车辆数K
+    capacity:Number,车辆容量C
+    speed:Number,车辆速度S
+    x,y:ndarray,点的坐标
+    demand:ndarray,点的需求量
+    ready_time,due_time:ndarray,点的左右时间窗
+    service_time:ndarray,点的服务时间
+    pickup_index:ndarray,送货点对应的取货点编号，取货点和depot为0
+    delivery_index:ndarray,取货点对应的送货点编号，送货点和depot为0
+    requests:ndarray,形状为(m, 2)，每行为一个运输请求[取货点，送货点]
+    '''
+
+    def __init__(self, name, vehicle_num, capacity, speed, table):
+        self.name = name
+        self.vehicle_num = int(vehicle_num)
+        self.capacity = _as_number(capacity)
+        self.speed = _as_number(speed)
+
+        self.task_no = table[:, 0].astype(np.int64)
+        self.x = table[:, 1].astype(np.float64)
+        self.y = table[:, 2].astype(np.float64)
+        self.demand = table[:, 3].astype(np.int64)
+        self.ready_time = table[:, 4].astype(np.float64)
+        self.due_time = table[:, 5].astype(np.float64)
+        self.service_time = table[:, 6].astype(np.float64)
+        self.pickup_index = table[:, 7].astype(np.int64)
+        self.delivery_index = table[:, 8].astype(np.int64)
+
+        if not np.array_equal(self.task_no, np.arange(self.task_no.shape[0])):
+            raise ValueError('%s: TaskNo必须从0开始连续编号' % name)
+
+        # 运输请求：除去首尾depot，PICKUP索引为0的行为取货点，DELIVERY索引为对应送货点
+        inner = self.task_no[1:-1]
+        pickups = inner[self.pickup_index[1:-1] == 0]
+        self.requests = np.stack([pickups, self.delivery_index[pickups]], axis=1)
+
+        self._matrix = None
+        self._nodes = None
+        self._neighbourhood = None
+
+    @property
+    def node_num(self):
+        return self.task_no.shape[0]
+
+    @property
+    def request_num(self):
+        return self.requests.shape[0]
+
+    @property
+    def earliest_time(self):
+        return self.ready_time.min()
+
+    @property
+    def latest_time(self):
+        return self.due_time.max()
+
+    @property
+    def task_no_list(self):
+        return self.task_no.tolist()
+
+    @property
+    def matrix(self):
+        """算例共享的距离/时间矩阵层，第一次访问时才计算"""
+        if self._matrix is None:
+            self._matrix = InstanceMatrix.from_coordinates(self.x, self.y)
+        return self._matrix
+
+    @property
+    def nodes(self):
+        """按节点编号生成的Node对象列表（NodeTable），算例的所有车辆共用，第一次访问时才生成"""
+        if self._nodes is None:
+            columns = zip(self.task_no.tolist(), self.demand.tolist(), self.ready_time.tolist(),
+                          self.due_time.tolist(), self.service_time.tolist(), self.pickup_index.tolist(),
+                          self.delivery_index.tolist())
+            with profiler.timer('read_data.nodes'):
+                self._nodes = NodeTable([Node(*column, block_id=None, container_id=None) for column in columns])
+        return self._nodes
+
+    @property
+    def neighbourhood(self):
+        """算例共享的近邻提供者（按坐标的网格索引，见spatial_index.py），第一次访问时才建立"""
+        if self._neighbourhood is None:
+            self._neighbourhood = NeighbourhoodProvider.of_instance(self)
+        return self._neighbourhood
+
+    @property
+    def start_depot(self):
+        return int(self.task_no[0])
+
+    @property
+    def end_depot(self):
+        return int(self.task_no[-1])
+
+    def to_table(self):
+        """还原成与数据文件列顺序相同的二维数组"""
+        return np.stack([self.task_no, self.x, self.y, self.demand, self.ready_time, self.due_time,
+                         self.service_time, self.pickup_index, self.delivery_index], axis=1)
+
+
+def _as_number(value):
+    """整数值返回int，否则返回float"""
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def cache_path_of(path):
+    """数据文件对应的缓存文件路径，如lr104.txt对应lr104.npz"""
+    return os.path.splitext(path)[0] + '.npz'
+
+
+def _split_joined_row(fields):
+    """个别数据文件中两行被连在了一起（缺少换行符），如'...589 0807 200 ...'，将其拆成两行"""
+    if len(fields) != 2 * len(COLUMN_NAMES) - 1:
+        raise ValueError('无法解析的数据行：%s' % ' '.join(fields))
+    next_no = str(int(fields[0]) + 1)  # 被连接的下一行的TaskNo
+    joined = fields[len(COLUMN_NAMES) - 1]
+    if not joined.endswith(next_no) or len(joined) == len(next_no):
+        raise ValueError('无法解析的数据行：%s' % ' '.join(fields))
+    first = fields[:len(COLUMN_NAMES) - 1] + [joined[:-len(next_no)]]
+    second = [next_no] + fields[len(COLUMN_NAMES):]
+    return [first, second]
+
+
+def parse_benchmark_file(path):
+    """解析Li & Lim benchmark文本文件，返回车辆信息和任务表"""
+    with open(path) as f:
+        lines = f.read().split('\n')
+    vehicle_num, capacity, speed = lines[0].split()[:3]
+
+    text = '\n'.join(lines[1:])
+    values = np.array(text.split(), dtype=np.float64)
+    if values.shape[0] % len(COLUMN_NAMES) == 0:
+        table = values.reshape(-1, len(COLUMN_NAMES))
+    else:
+        table = None
+    if table is None or not np.array_equal(table[:, 0], np.arange(table.shape[0])):
+        # 快速路径失败，逐行解析并修复被连在一起的行
+        rows = []
+        for line in lines[1:]:
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) == len(COLUMN_NAMES):
+                rows.append(fields)
+            else:
+                rows.extend(_split_joined_row(fields))
+        table = np.array(rows, dtype=np.float64)
+    return int(vehicle_num), float(capacity), float(speed), table
+
+
+def _load_cache(path, cache_path):
+    """加载缓存，缓存不存在或者已经过期则返回None"""
+    try:
+        stat = os.stat(path)
+        with np.load(cache_path) as cache:
+            if int(cache['version']) != CACHE_VERSION or int(cache['source_mtime']) != stat.st_mtime_ns or \
+                    int(cache['source_size']) != stat.st_size:
+                return None
+            vehicle_info = cache['vehicle_info']
+            table = cache['table']
+    except (OSError, KeyError, ValueError):
+        return None
+    return int(vehicle_info[0]), float(vehicle_info[1]), float(vehicle_info[2]), table
+
+
+def _write_cache(path, cache_path, vehicle_num, capacity, speed, table):
+    """写缓存，数据目录不可写时静默跳过"""
+    stat = os.stat(path)
+    tmp_path = '%s.%d.tmp.npz' % (cache_path, os.getpid())
+    try:
+        np.savez(tmp_path, version=CACHE_VERSION, source_mtime=stat.st_mtime_ns, source_size=stat.st_size,
+                 vehicle_info=np.array([vehicle_num, capacity, speed], dtype=np.float64), table=table)
+        os.replace(tmp_path, cache_path)  # 先写临时文件再替换，避免并行读取时读到写了一半的缓存
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@profiler.timed('read_data')
+def read_data(path, use_cache=True):
+    """读取benchmark数据文件，返回Instance对象；use_cache为True时优先读取/写入.npz缓存"""
+    cache_path = cache_path_of(path)
+    loaded = _load_cache(path, cache_path) if use_cache else None
+    if loaded is None:
+        loaded = parse_benchmark_file(path)
+        if use_cache:
+            _write_cache(path, cache_path, *loaded)
+    vehicle_num, capacity, speed, table = loaded
+    name = os.path.splitext(os.path.basename(path))[0]
+    return Instance(name, vehicle_num, capacity, speed, table)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: request_compatibility.py
+@time: 2020/10/30 09:30
+@description:请求两两之间的兼容性和相关度（与求解器无关，只依赖numpy），一次向量化计算所有请求对
+==兼容性：请求a和b能否由同一辆车服务。两个请求的4个点在同一条路径上有6种先后顺序（见INTERLEAVINGS），
+==  对每种顺序按最早开始服务时间检查“开始depot→4个点→结束depot”的时间窗，车上同时有a、b的货物时还检查载量，
+==  orders[a, b]的第k位为1表示第k种顺序可行，任何一种顺序都不可行的请求对不可能出现在同一辆车上
+==  时间矩阵满足三角不等式时（Li & Lim算例为Euclid距离），任何包含a、b的路径的子序列的最早时间都不晚于路径本身，
+==  所以这里判为不兼容的请求对在任何可行路径中都不会同车，可以放心地用于剪枝
+==时间窗的语义见TIME_WINDOW_SEMANTICS：'mip'与MIP模型相同，'strict'为不违背任何时间窗（构造启发式strict=True），
+==  'vehicle'只检查Vehicle的硬约束（送货点的右时间窗为软时间窗，结束depot没有时间窗）
+==相关度：Shaw（1998）的相关度，越小越相关：
+==  distance_weight*(取货点之间的距离+送货点之间的距离)+time_weight*(取货点左时间窗之差+送货点左时间窗之差)
+==  +demand_weight*需求量之差
+==500个请求的算例（pdptw1000）用时不到1秒
+"""
+import time
+
+import numpy as np
+
+from read_data import read_data
+
+# 两个请求a、b的6种访问顺序，'P'/'D'为取货点/送货点，'a'/'b'为请求；后3种是前3种交换a、b
+INTERLEAVINGS = (('Pa', 'Da', 'Pb', 'Db'), ('Pa', 'Pb', 'Da', 'Db'), ('Pa', 'Pb', 'Db', 'Da'),
+                 ('Pb', 'Db', 'Pa', 'Da'), ('Pb', 'Pa', 'Db', 'Da'), ('Pb', 'Pa', 'Da', 'Db'))
+
+
+def _mip_latest(ready, due, serv, is_pickup, is_delivery):
+    return due.copy()
+
+
+def _strict_latest(ready, due, serv, is_pickup, is_delivery):
+    latest = due.copy()
+    customer = is_pickup | is_delivery
+    latest[customer] = np.maximum(ready[customer], due[customer] - serv[customer])
+    return latest
+
+
+def _vehicle_latest(ready, due, serv, is_pickup, is_delivery):
+    latest = np.full(ready.shape[0], np.inf)
+    latest[is_pickup] = np.maximum(ready[is_pickup], due[is_pickup] - serv[is_pickup])
+    return latest
+
+
+# 可选的时间窗语义，键为语义名称，值为计算每个点最晚到达时间的函数（到达时间不晚于它即不违背时间窗）
+TIME_WINDOW_SEMANTICS = {
+    'mip': _mip_latest,  # 开始服务时间不晚于右时间窗（与PdptwMip、Gurobi模型相同）
+    'strict': _strict_latest,  # 在右时间窗之前完成服务，与Vehicle的软硬时间窗违背量都为0相同
+    'vehicle': _vehicle_latest,  # 只有取货点的右时间窗是硬时间窗
+}
+
+
+class RequestCompatibility(object):
+    '''
+    请求兼容性和相关度（下标为请求的行号，即instance.requests的行号）：
+    pickups,deliveries:ndarray,每个请求的取货点和送货点编号
+    orders:ndarray,形状(m, m)的uint8，orders[a, b]的第k位表示INTERLEAVINGS[k]是否可行，对角线为0
+    compatible:ndarray,形状(m, m)的bool，请求a、b能否同车；对角线为请求单独一辆车时是否可行
+    relatedness:ndarray,形状(m, m)的相关度，越小越相关，对角线为inf
+    semantics:String,时间窗的语义
+    '''
+
+    def __init__(self, pickups, deliveries, orders, single, relatedness, semantics):
+        self.pickups = pickups
+        self.deliveries = deliveries
+        self.orders = orders
+        self.compatible = orders != 0
+        np.fill_diagonal(self.compatible, single)
+        self.relatedness = relatedness
+        self.semantics = semantics
+        self._row_of = {p: r for r, p in enumerate(pickups.tolist())}
+
+    def __len__(self):
+        return self.pickups.shape[0]
+
+    def row_of(self, p_id):
+        """取货点p_id对应的请求行号"""
+        return self._row_of[p_id]
+
+    def is_compatible(self, p_a, p_b):
+        """按取货点编号查询两个请求能否同车"""
+        return bool(self.compatible[self._row_of[p_a], self._row_of[p_b]])
+
+    def feasible_orders(self, a, b):
+        """请求a、b（行号）可行的访问顺序列表，元素为INTERLEAVINGS中的元组"""
+        bits = int(self.orders[a, b])
+        return [order for k, order in enumerate(INTERLEAVINGS) if bits >> k & 1]
+
+    def neighbours(self, neighbour_num=10, compatible_only=True):
+        """每个请求最相关的neighbour_num个请求的行号（按相关度从小到大），返回列表的列表；
+        compatible_only为True时不包含不能同车的请求（某些行可能少于neighbour_num个）
+        """
+        relatedness = self.relatedness
+        if compatible_only:
+            relatedness = np.where(self.compatible, relatedness, np.inf)
+            np.fill_diagonal(relatedness, np.inf)
+        m = relatedness.shape[0]
+        k = max(1, min(neighbour_num, m - 1))
+        nearest = np.argpartition(relatedness, k - 1, axis=1)[:, :k]
+        values = np.take_along_axis(relatedness, nearest, axis=1)
+        order = np.argsort(values, axis=1, kind='stable')
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        values = np.take_along_axis(values, order, axis=1)
+        return [row[np.isfinite(value)].tolist() for row, value in zip(nearest, values)]
+
+    def summary(self):
+        """兼容性的文字说明"""
+        m = len(self)
+        pairs = m * (m - 1) // 2
+        compatible = int(np.triu(self.compatible, 1).sum())
+        single = int(np.diag(self.compatible).sum())
+        return '请求数：%s，单独可行：%s，请求对：%s，可以同车：%s（%.1f%%）' % (
+            m, single, pairs, compatible, 100.0 * compatible / max(1, pairs))
+
+
+def relatedness_matrix(distance, ready, demand, pickups, deliveries, distance_weight=1.0, time_weight=1.0,
+                       demand_weight=0.0):
+    """请求两两之间的Shaw相关度，形状(m, m)，越小越相关，对角线为inf"""
+    ready = np.asarray(ready, dtype=np.float64)
+    load = np.asarray(demand, dtype=np.float64)[pickups]
+    relatedness = distance_weight * (distance[np.ix_(pickups, pickups)] + distance[np.ix_(deliveries, deliveries)])
+    relatedness = relatedness + time_weight * (np.abs(ready[pickups][:, None] - ready[pickups][None, :]) +
+                                               np.abs(ready[deliveries][:, None] - ready[deliveries][None, :]))
+    if demand_weight:
+        relatedness = relatedness + demand_weight * np.abs(load[:, None] - load[None, :])
+    np.fill_diagonal(relatedness, np.inf)
+    return relatedness
+
+
+def _sequence_feasible(path, ready, latest, serv, time_mat, start_depot, end_depot):
+    """从开始depot出发，按最早开始服务时间依次经过path中的点（每个元素为形状相同的点编号数组），最后到达结束depot，
+    是否每个点的到达时间都不晚于latest
+    """
+    arrival = ready[start_depot] + serv[start_depot] + time_mat[start_depot, path[0]]
+    feasible = arrival <= latest[path[0]]
+    for prev, node in zip(path[:-1], path[1:]):
+        arrival = np.maximum(ready[prev], arrival) + serv[prev] + time_mat[prev, node]
+        feasible &= arrival <= latest[node]
+    last = path[-1]
+    arrival = np.maximum(ready[last], arrival) + serv[last] + time_mat[last, end_depot]
+    return feasible & (arrival <= latest[end_depot])
+
+
+def compute_compatibility(ready, due, serv, demand, requests, time_mat, capacity, start_depot=0, end_depot=None,
+                          semantics='strict', distance=None, distance_weight=1.0, time_weight=1.0, demand_weight=0.0):
+    """计算请求兼容性：ready、due、serv、demand为按点编号排列的数组，requests为形状(m, 2)的[取货点，送货点]数组，
+    time_mat为车辆的时间矩阵，capacity为车辆载量，distance为计算相关度的距离矩阵（默认为time_mat）。
+    返回RequestCompatibility
+    """
+    ready = np.asarray(ready, dtype=np.float64)
+    due = np.asarray(due, dtype=np.float64)
+    serv = np.asarray(serv, dtype=np.float64)
+    demand = np.asarray(demand, dtype=np.float64)
+    requests = np.asarray(requests, dtype=np.int64).reshape(-1, 2)
+    time_mat = np.asarray(time_mat, dtype=np.float64)
+    n = ready.shape[0]
+    if end_depot is None:
+        end_depot = n - 1
+    pickups, deliveries = requests[:, 0], requests[:, 1]
+    is_pickup = np.zeros(n, dtype=bool)
+    is_pickup[pickups] = True
+    is_delivery = np.zeros(n, dtype=bool)
+    is_delivery[deliveries] = True
+    latest = TIME_WINDOW_SEMANTICS[semantics](ready, due, serv, is_pickup, is_delivery)
+    columns = (ready, latest, serv, time_mat, start_depot, end_depot)
+
+    load = demand[pickups]
+    single = _sequence_feasible([pickups, deliveries], *columns) & (load <= capacity)
+    overlap = load[:, None] + load[None, :] <= capacity
+    pa, pb = np.broadcast_arrays(pickups[:, None], pickups[None, :])
+    da, db = np.broadcast_arrays(deliveries[:, None], deliveries[None, :])
+    both = single[:, None] & single[None, :]  # 单独不可行的请求与任何请求都不能同车
+    points = {'Pa': pa, 'Da': da, 'Pb': pb, 'Db': db}
+    orders = np.zeros(pa.shape, dtype=np.uint8)
+    for k, order in enumerate(INTERLEAVINGS[:3]):
+        ok = both & _sequence_feasible([points[name] for name in order], *columns)
+        if order[1] != 'Da':  # a的货物还在车上时就取了b的货物
+            ok &= overlap
+        orders |= ok.astype(np.uint8) << k
+        orders |= ok.T.astype(np.uint8) << (k + 3)  # 交换a、b即为后3种顺序
+    np.fill_diagonal(orders, 0)
+
+    relatedness = relatedness_matrix(time_mat if distance is None else distance, ready, demand, pickups, deliveries,
+                                     distance_weight, time_weight, demand_weight)
+    return RequestCompatibility(pickups, deliveries, orders, single, relatedness, semantics)
+
+
+def single_request_feasible(instance, semantics='strict', speed=None, capacity=None):
+    """每个请求能否由一辆车单独服务（即RequestCompatibility.compatible的对角线），形状(m,)的bool；
+    只计算单个请求，用时和内存都是O(m)，不需要两两兼容性时用它代替request_compatibility
+    """
+    speed = instance.speed if speed is None else speed
+    capacity = instance.capacity if capacity is None else capacity
+    ready = np.asarray(instance.ready_time, dtype=np.float64)
+    due = np.asarray(instance.due_time, dtype=np.float64)
+    serv = np.asarray(instance.service_time, dtype=np.float64)
+    pickups, deliveries = instance.requests[:, 0], instance.requests[:, 1]
+    is_pickup = np.zeros(ready.shape[0], dtype=bool)
+    is_pickup[pickups] = True
+    is_delivery = np.zeros(ready.shape[0], dtype=bool)
+    is_delivery[deliveries] = True
+    latest = TIME_WINDOW_SEMANTICS[semantics](ready, due, serv, is_pickup, is_delivery)
+    feasible = _sequence_feasible([pickups, deliveries], ready, latest, serv, instance.matrix.time_matrix(speed),
+                                  instance.start_depot, instance.end_depot)
+    return feasible & (np.asarray(instance.demand, dtype=np.float64)[pickups] <= capacity)
+
+
+def request_compatibility(instance, semantics='strict', speed=None, capacity=None, distance_weight=1.0,
+                          time_weight=1.0, demand_weight=0.0):
+    """对read_data读取的Instance计算请求兼容性，speed和capacity默认为算例的车辆速度和载量"""
+    speed = instance.speed if speed is None else speed
+    capacity = instance.capacity if capacity is None else capacity
+    return compute_compatibility(instance.ready_time, instance.due_time, instance.service_time, instance.demand,
+                                 instance.requests, instance.matrix.time_matrix(speed), capacity, instance.start_depot,
+                                 instance.end_depot, semantics, instance.matrix.distance, distance_weight, time_weight,
+                                 demand_weight)
+
+
+if __name__ == '__main__':
+    data_path = './LiLimPDPTWbenchmark/pdptw1000_revised/LC1_10_1.txt'
+    pdptw_instance = read_data(data_path)
+    for name in TIME_WINDOW_SEMANTICS:
+        start = time.time()
+        compatibility = request_compatibility(pdptw_instance, name)
+        print('%s：%s，用时%.3f秒' % (name, compatibility.summary(), time.time() - start))
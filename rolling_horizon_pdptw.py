@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: rolling_horizon_pdptw.py
+@time: 2020/11/02 09:20
+@description:在线（滚动时域）调度：运输请求不断到达，每个事件只在固定的时延预算（如200ms）内重新优化各车辆路径还没有执行的部分
+==事件（OnlineScheduler.handle）：RequestArrival新到达的运输请求；VehicleUpdate车辆的实际位置和时间（在某点开始服务的实际时刻）
+==冻结：时刻推进到clock时，车辆已经开始服务、或者为了按计划开始服务已经必须出发前往的路径位置被冻结（Vehicle.frozen），
+==  车辆不能早于clock（或实际完成服务的时刻）离开最后一个冻结的位置（Vehicle.available_time），
+==  新请求只能插入到冻结的位置之后，ALNS的移除算子也只移除取货点没有冻结的请求，结束depot不冻结
+==重新优化：先用后悔值插入安排新请求（时延预算用完时停止插入，剩余的请求留给之后的ALNS迭代的插入算子），
+==  剩余的时延预算内运行ALNS的移除-插入迭代（只接受不变差的解），按最近迭代用时的衰减最大值估计，
+==  来不及完成下一次迭代时停止
+==热启动：当前的解、路径评价缓存、请求相关度和兼容性、近邻结构以及算子权重在事件之间保留，不会每个事件从头求解
+==  超过最晚到达时间、已经不可能服务的请求记为拒绝（仍计入未安排的请求）
+==回放（replay）：把benchmark算例中的请求按发布时间（取货点左时间窗提前lead_fraction*计划期）依次作为事件输入，
+==  离线测量每个事件的时延和最终解的质量；Li & Lim算例中所有点的位置已知，事件中的请求用算例中的点编号表示
+"""
+import random
+import time
+
+import numpy as np
+
+import profiler
+from adaptive_large_neighbourhood_search_pdptw import INSERTION_OPERATORS, REMOVAL_OPERATORS, SCORE_ACCEPTED, \
+    SCORE_BEST, AdaptiveWeights, SearchContext, solution_signature
+from insertion_heuristic import regret_insertion
+from read_data import read_data
+from solution import SOFT_PENALTY, UNASSIGNED_PENALTY, Solution
+
+LATENCY_BUDGET = 0.2  # 每个事件的默认时延预算（秒）
+ITERATION_TIME_MARGIN = 1.5  # 估计的迭代用时的倍数，剩余时间不足时停止迭代，留出迭代用时波动的余量
+ITERATION_TIME_DECAY = 0.95  # 每次迭代后迭代用时估计的衰减系数
+LEAD_FRACTION = 0.1  # 回放时请求的发布时间比取货点左时间窗提前的时间（占计划期的比例）
+
+
+class RequestArrival(object):
+    '''
+    新请求到达事件：
+    time:Number,事件发生的时刻（算例的时间单位）
+    pickups:List,新请求的取货点编号
+    '''
+    __slots__ = ('time', 'pickups')
+
+    def __init__(self, time, pickups):
+        self.time = time
+        self.pickups = list(pickups)
+
+
+class VehicleUpdate(object):
+    '''
+    车辆状态事件：
+    time:Number,事件发生的时刻
+    vehicle:int,车辆在解中的下标
+    node:int,车辆开始服务的点编号（必须在车辆当前路径中）
+    start_time:Number,实际开始服务的时刻
+    '''
+    __slots__ = ('time', 'vehicle', 'node', 'start_time')
+
+    def __init__(self, time, vehicle, node, start_time):
+        self.time = time
+        self.vehicle = vehicle
+        self.node = node
+        self.start_time = start_time
+
+
+class OnlineScheduler(object):
+    '''
+    在线调度器：
+    solution:Solution,当前的解，unassigned只包含已经发布的请求
+    clock:Number,当前时刻
+    released:Set,已经发布的请求（取货点编号）
+    rejected:Set,已经不可能服务的请求
+    events:List,每个事件的统计（时刻、类型、新请求数、时延、迭代次数、目标函数值）
+    '''
+
+    def __init__(self, instance, latency_budget=LATENCY_BUDGET, removal_range=(2, 20), segment_size=50,
+                 reaction=0.1, shaw_weights=(9.0, 3.0, 2.0), soft_penalty=SOFT_PENALTY,
+                 unassigned_penalty=UNASSIGNED_PENALTY, seed=0):
+        self.instance = instance
+        self.latency_budget = latency_budget
+        self.removal_range = removal_range
+        self.segment_size = segment_size
+        self.soft_penalty = soft_penalty
+        self.unassigned_penalty = unassigned_penalty
+        self.rng = random.Random(seed)
+        self.ctx = SearchContext(instance, soft_penalty, shaw_weights)
+        self.removals = AdaptiveWeights(REMOVAL_OPERATORS, reaction)
+        self.insertions = AdaptiveWeights(INSERTION_OPERATORS, reaction)
+        self.solution = Solution.empty(instance)
+        self.solution.unassigned = set()
+        self.cost = self._cost(self.solution)
+        self.clock = 0
+        self.released = set()
+        self.rejected = set()
+        self.insertable = set()  # 已经发布、可以服务、还没有被拒绝的请求
+        self.servable = set(self.ctx.servable)
+        self.latest_arrival = instance.nodes.latest_arrival
+        self.iterations = 0
+        self.events = []
+        self._iteration_time = 0.0  # 最近迭代用时的衰减最大值（迭代用时随算子和移除数量波动，平均值会低估）
+
+    def _cost(self, solution):
+        return solution.objective(soft_penalty=self.soft_penalty, unassigned_penalty=self.unassigned_penalty)
+
+    def advance(self, clock):
+        """时刻推进到clock：冻结已经执行或已经出发前往的路径位置，车辆不能早于clock离开最后一个冻结的位置"""
+        self.clock = max(self.clock, clock)
+        clock = self.clock
+        for veh in self.solution.vehicles:
+            route, tm = veh.route, veh.time_matrix
+            frozen = veh.frozen
+            # 为了按计划时刻开始服务，最晚要在start_time[k]-行驶时间离开上一个点
+            while frozen < len(route) - 1 and veh.start_time[frozen] - tm[route[frozen - 1], route[frozen]] <= clock:
+                frozen += 1
+            available = max(clock, veh.departure[frozen - 1])
+            if frozen != veh.frozen or available != veh.available_time:
+                veh.freeze(frozen, available)
+        latest = self.latest_arrival
+        expired = [p for p in self.insertable if p in self.solution.unassigned and latest[p] < clock]
+        self.rejected.update(expired)
+        self.insertable.difference_update(expired)
+        self.cost = self._cost(self.solution)
+
+    def add_requests(self, pickups, clock):
+        """处理新请求到达的事件，返回事件的统计"""
+        start = time.time()
+        self.advance(clock)
+        new = [p for p in pickups if p not in self.released]
+        self.released.update(new)
+        self.solution.unassigned.update(new)
+        unservable = [p for p in new if p not in self.servable or self.latest_arrival[p] < self.clock]
+        self.rejected.update(unservable)
+        insertable = [p for p in new if p not in self.rejected]
+        self.insertable.update(insertable)
+        with profiler.timer('online.insertion'):
+            regret_insertion(self.solution, insertable, k=2, soft_penalty=self.soft_penalty, rng=self.rng,
+                             deadline=start + self.latency_budget)
+        self.cost = self._cost(self.solution)
+        return self._finish_event('request', len(new), start)
+
+    def update_vehicle(self, v, node, start_time, clock):
+        """处理车辆状态事件：车辆v在start_time开始服务点node，之前的路径位置都已经执行"""
+        start = time.time()
+        self.advance(clock)
+        veh = self.solution.vehicles[v]
+        position = veh.route.index(node, veh.frozen - 1)
+        if position >= len(veh.route) - 1:
+            raise ValueError('车辆%s不能在结束depot处开始服务' % v)
+        departure = max(start_time, self.instance.ready_time[node]) + self.instance.service_time[node]
+        veh.freeze(position + 1, max(self.clock, departure))
+        self.advance(self.clock)  # 实际时刻推迟后，后续的位置可能已经必须出发前往
+        return self._finish_event('vehicle', 0, start)
+
+    def handle(self, event):
+        """处理一个事件（RequestArrival或VehicleUpdate）"""
+        if isinstance(event, RequestArrival):
+            return self.add_requests(event.pickups, event.time)
+        return self.update_vehicle(event.vehicle, event.node, event.start_time, event.time)
+
+    def _finish_event(self, kind, new_num, start):
+        iterations = self.improve(start + self.latency_budget)
+        record = {'time': self.clock, 'kind': kind, 'new': new_num, 'latency': time.time() - start,
+                  'iterations': iterations, 'objective': self.cost, 'unassigned': len(self.solution.unassigned)}
+        self.events.append(record)
+        return record
+
+    def improve(self, deadline):
+        """在deadline（time.time()的时刻）之前用ALNS的移除-插入迭代改进还没有执行的路径，返回迭代次数"""
+        rng, ctx = self.rng, self.ctx
+        removals, insertions = self.removals, self.insertions
+        lo, hi = self.removal_range
+        iterations = 0
+        with profiler.timer('online.improve'):
+            while time.time() + ITERATION_TIME_MARGIN * self._iteration_time < deadline:
+                removable = len(ctx.assigned(self.solution))
+                if removable == 0:
+                    break
+                begin = time.time()
+                r = removals.choose(rng)
+                s = insertions.choose(rng)
+                candidate = self.solution.copy()
+                removed = REMOVAL_OPERATORS[removals.names[r]](ctx, candidate, rng.randint(min(lo, removable),
+                                                                                          min(hi, removable)), rng)
+                candidate.remove_requests(removed)
+                INSERTION_OPERATORS[insertions.names[s]](candidate, sorted(candidate.unassigned & self.insertable),
+                                                         self.soft_penalty, rng)
+                candidate_cost = self._cost(candidate)
+                score = 0
+                if candidate_cost < self.cost - 1e-9:
+                    score = SCORE_BEST
+                elif candidate_cost <= self.cost and solution_signature(candidate) != solution_signature(
+                        self.solution):
+                    score = SCORE_ACCEPTED
+                if candidate_cost <= self.cost:
+                    self.solution, self.cost = candidate, candidate_cost
+                removals.reward(r, score)
+                insertions.reward(s, score)
+                iterations += 1
+                self.iterations += 1
+                if self.iterations % self.segment_size == 0:
+                    removals.update()
+                    insertions.update()
+                elapsed = time.time() - begin
+                self._iteration_time = max(elapsed, ITERATION_TIME_DECAY * self._iteration_time)
+        profiler.count('online.iterations', iterations)
+        return iterations
+
+    def summary(self):
+        """所有事件的时延统计和当前解的质量"""
+        latency = np.array([e['latency'] for e in self.events]) if self.events else np.zeros(1)
+        return {'events': len(self.events), 'iterations': self.iterations, 'latency_budget': self.latency_budget,
+                'latency_mean': float(latency.mean()), 'latency_p95': float(np.percentile(latency, 95)),
+                'latency_max': float(latency.max()),
+                'over_budget': int((latency > self.latency_budget).sum()) if self.events else 0,
+                'objective': self.cost, 'distance': self.solution.total_distance,
+                'vehicles': self.solution.used_vehicle_num, 'unassigned': len(self.solution.unassigned),
+                'rejected': len(self.rejected), 'released': len(self.released)}
+
+
+def release_times(instance, lead_fraction=LEAD_FRACTION):
+    """回放时每个请求的发布时间：取货点左时间窗提前lead_fraction*计划期，不早于计划期的开始，按instance.requests的行排列"""
+    earliest = float(instance.earliest_time)
+    lead = lead_fraction * (float(instance.latest_time) - earliest)
+    return np.maximum(instance.ready_time[instance.requests[:, 0]] - lead, earliest)
+
+
+def replay_events(instance, lead_fraction=LEAD_FRACTION):
+    """把算例的请求按发布时间排列成RequestArrival事件的列表，同一时刻发布的请求合并为一个事件"""
+    release = release_times(instance, lead_fraction)
+    pickups = instance.requests[:, 0]
+    events = []
+    for t in np.unique(release):
+        events.append(RequestArrival(float(t), pickups[release == t].tolist()))
+    return events
+
+
+def replay(instance, latency_budget=LATENCY_BUDGET, lead_fraction=LEAD_FRACTION, seed=0, verbose=True, **kwargs):
+    """按发布时间回放算例的请求，返回(最终的解, 统计信息)；统计信息包括每个事件的记录（'event_log'）"""
+    start = time.time()
+    scheduler = OnlineScheduler(instance, latency_budget=latency_budget, seed=seed, **kwargs)
+    events = replay_events(instance, lead_fraction)
+    with profiler.timer('online.replay'):
+        for k, event in enumerate(events):
+            record = scheduler.handle(event)
+            if verbose and (k + 1) % max(1, len(events) // 20) == 0:
+                print('时刻%.1f：已处理%s/%s个事件，目标函数值：%.2f，时延：%.1fms' % (
+                    record['time'], k + 1, len(events), record['objective'], 1000 * record['latency']))
+    stats = scheduler.summary()
+    stats['time'] = time.time() - start
+    stats['event_log'] = scheduler.events
+    return scheduler.solution, stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw1000_revised/LR1_10_1.txt'
+    pdptw_instance = read_data(data_path)
+    online_solution, online_stats = replay(pdptw_instance)
+    print('总成本：', online_solution.objective())
+    print('总行驶距离：', online_solution.total_distance)
+    print('共使用{}辆车，未安排的请求数：{}，其中拒绝{}个'.format(online_solution.used_vehicle_num,
+                                                   len(online_solution.unassigned), online_stats['rejected']))
+    print('事件数：{}，平均时延：{:.1f}ms，95%时延：{:.1f}ms，最大时延：{:.1f}ms，超过预算：{}'.format(
+        online_stats['events'], 1000 * online_stats['latency_mean'], 1000 * online_stats['latency_p95'],
+        1000 * online_stats['latency_max'], online_stats['over_budget']))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: route_cache.py
+@time: 2020/10/29 15:20
+@description:路径评价结果的缓存（LRU，按缓存的总点数限制内存），由同一算例的所有车辆共享（NodeTable.route_cache）
+==局部搜索、种群类算法会反复重建同一条路径，Vehicle.update_info先按路径的点序列查缓存，命中时直接取回上次的评价结果
+==键为(车辆速度, 冻结位置数, 可以离开的最早时间, 路径数组的字节串)：每个点4个字节，精确比较，不会因为哈希冲突取回错误的结果
+==值为update_info计算的全部结果（前缀数组、距离、载货量、软硬时间窗违背量等），
+==这些数组在车辆之间按引用共享、从不原地修改（与Vehicle.copy的约定相同），所以取回时不需要复制
+==节点数据（时间窗、需求等）改变后必须调用clear()
+"""
+from collections import OrderedDict
+
+ROUTE_CACHE_NODES = 200000  # 默认缓存的总点数上限，每个点约占13个float，约20MB
+
+
+class RouteCache(object):
+    '''
+    路径评价缓存：
+    max_nodes:int,缓存中所有路径的总点数上限，超过时淘汰最久未使用的路径；为0时不缓存
+    hits,misses,evictions:int,命中、未命中、淘汰次数
+    '''
+
+    def __init__(self, max_nodes=ROUTE_CACHE_NODES):
+        self.max_nodes = max_nodes
+        self._entries = OrderedDict()
+        self._nodes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __reduce__(self):
+        # 传给其他进程时只传递配置，不传递缓存的内容
+        return RouteCache, (self.max_nodes,)
+
+    def get(self, key):
+        """取得key的评价结果并标记为最近使用，没有时返回None"""
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def put(self, key, entry, size):
+        """保存评价结果，size为路径的点数"""
+        if size > self.max_nodes or key in self._entries:
+            return
+        self._entries[key] = (entry, size)
+        self._nodes += size
+        while self._nodes > self.max_nodes:
+            _, (_, old_size) = self._entries.popitem(last=False)
+            self._nodes -= old_size
+            self.evictions += 1
+
+    def clear(self):
+        """清空缓存（节点数据改变后调用），统计数据保留"""
+        self._entries.clear()
+        self._nodes = 0
+
+    def reset_stats(self):
+        self.hits = self.misses = self.evictions = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        """命中率等统计数据"""
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'hit_rate': self.hit_rate,
+                'routes': len(self._entries), 'nodes': self._nodes}
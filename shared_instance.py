@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: shared_instance.py
+@time: 2020/10/24 10:05
+@description:把算例数据（任务表和距离矩阵）放到共享内存中，供多进程并行的算法使用
+==主进程调用share_instance一次，把返回的句柄（很小，可以pickle）传给进程池的initializer，
+==工作进程调用attach_instance直接映射共享内存，不必为每个个体或每个任务重新pickle/unpickle距离矩阵
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from instance_matrix import InstanceMatrix
+from read_data import Instance
+
+
+class SharedInstanceHandle(object):
+    '''
+    共享内存中算例数据的句柄：
+    name:String,算例名称
+    vehicle_info:Tuple,(车辆数, 容量, 速度)
+    blocks:Dict,键为数组名称（table, distance），值为(共享内存名称, 形状, dtype)
+    '''
+
+    def __init__(self, name, vehicle_info, blocks):
+        self.name = name
+        self.vehicle_info = vehicle_info
+        self.blocks = blocks
+
+
+class SharedArray(object):
+    """主进程创建的共享内存数组：array为映射到共享内存的ndarray，主进程可以原地修改，
+    block为(共享内存名称, 形状, dtype)，传给工作进程后用attach_array映射
+    """
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self._memory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=self._memory.buf)
+        self.array[...] = array
+        self.block = (self._memory.name, array.shape, array.dtype.str)
+
+    def close(self):
+        """释放共享内存，调用前不能再持有对array的其他引用"""
+        if self._memory is not None:
+            self.array = None
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SharedInstance(object):
+    """主进程持有的共享内存，用with语句或close()释放"""
+
+    def __init__(self, instance):
+        self._arrays = [SharedArray(instance.to_table()), SharedArray(instance.matrix.distance)]
+        blocks = {'table': self._arrays[0].block, 'distance': self._arrays[1].block}
+        self.handle = SharedInstanceHandle(instance.name, (instance.vehicle_num, instance.capacity, instance.speed),
+                                           blocks)
+
+    def close(self):
+        for shared in self._arrays:
+            shared.close()
+        self._arrays = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def share_instance(instance):
+    """把算例数据复制到共享内存，返回SharedInstance对象，其handle属性传给工作进程"""
+    return SharedInstance(instance)
+
+
+_attached = {}  # 工作进程中已经映射的共享内存，键为共享内存名称，防止被垃圾回收
+
+
+def attach_array(block):
+    """在工作进程中根据(共享内存名称, 形状, dtype)映射共享内存数组，不复制"""
+    memory_name, shape, dtype = block
+    if memory_name not in _attached:
+        # 工作进程只读取共享内存，不负责释放；track=False避免resource_tracker在进程退出时误删
+        try:
+            _attached[memory_name] = shared_memory.SharedMemory(name=memory_name, track=False)
+        except TypeError:  # Python 3.13以前没有track参数
+            _attached[memory_name] = shared_memory.SharedMemory(name=memory_name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=_attached[memory_name].buf)
+
+
+def attach_instance(handle):
+    """在工作进程中根据句柄映射共享内存，返回Instance对象（距离矩阵直接引用共享内存，不复制）"""
+    arrays = {key: attach_array(block) for key, block in handle.blocks.items()}
+    vehicle_num, capacity, speed = handle.vehicle_info
+    instance = Instance(handle.name, vehicle_num, capacity, speed, arrays['table'])
+    instance._matrix = InstanceMatrix(arrays['distance'])
+    return instance
+
+
+class SerialExecutor(object):
+    """单进程时的执行器，接口与ProcessPoolExecutor相同（map和shutdown），在主进程中运行，便于调试"""
+
+    def __init__(self, initializer=None, initargs=()):
+        if initializer is not None:
+            initializer(*initargs)
+
+    def map(self, func, *iterables, **kwargs):
+        return map(func, *iterables)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def make_executor(workers, initializer, initargs):
+    """workers>1时返回进程池，否则返回在主进程中串行运行的SerialExecutor"""
+    if workers > 1:
+        return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    return SerialExecutor(initializer, initargs)
@@ -3,6 +3,296 @@
 @author: yuan_xin
 @contact: yuanxin9997@qq.com
 @file: simulated_annealing_pdptw.py
-@time: 2020/10/19 17:03
-@description:
+@time: 2020/10/20 11:01
+@description:求解PDPTW问题的模拟退火算法
+==邻域动作（都以PD点对为单位）：
+==1.relocate：把一个运输请求从车辆A移到车辆B的随机位置（车辆A中没有被安排的请求直接插入）
+==2.exchange：交换车辆A和车辆B中的各一个运输请求，各自插入到对方路径的随机位置
+==3.shift：把一个运输请求移到同一条路径中的其他位置
+==每个动作只对受影响的路径片段做增量评价（Vehicle.evaluate_splice和Vehicle.evaluate_insertion），
+==不通过update_info重建路径；被接受的动作才原地修改路径
+==温度按运行进度（已用时间/时间上限，或已迭代次数/迭代次数上限）从T0降到final_temperature，降温方式可以配置
+==  （指数、线性、Lundy & Mees或自定义函数），在时间上限处正好降到final_temperature；
+==  T0按较小的随机变差动作的接受概率（默认0.1%）校准；长时间没有改进时把当前温度乘以reheat_ratio，
+==  升温在之后reheat_span的进度内按指数衰减回降温曲线，不会在时间上限处仍然保持高温
 """
+import math
+import random
+import time
+
+import profiler
+from insertion_heuristic import regret_insertion
+from node import PICKUP
+from read_data import read_data
+from solution import SOFT_PENALTY, UNASSIGNED_PENALTY, Solution
+from vehicle import move_window
+
+RELOCATE, EXCHANGE, SHIFT = 0, 1, 2
+MOVE_NAMES = ('relocate', 'exchange', 'shift')
+CHECK_TIME_EVERY = 1000  # 每隔多少次迭代检查一次运行时间
+CALIBRATION_QUANTILE = 0.05  # 校准初始温度用的变差量分位数
+
+
+def exponential_cooling(t0, t_final, progress):
+    """指数降温：T = T0 * (T_final / T0) ** progress"""
+    return t0 * (t_final / t0) ** progress
+
+
+def linear_cooling(t0, t_final, progress):
+    """线性降温：T = T0 + (T_final - T0) * progress"""
+    return t0 + (t_final - t0) * progress
+
+
+def lundy_mees_cooling(t0, t_final, progress):
+    """Lundy & Mees降温：T = T0 / (1 + beta * T0 * progress)，beta使progress = 1时T = T_final"""
+    return t0 / (1.0 + (t0 / t_final - 1.0) * progress)
+
+
+# 可选的降温方式，键为名称，值为函数(T0, 最终温度, 运行进度)，返回当前温度
+COOLING_SCHEDULES = {
+    'exponential': exponential_cooling,
+    'linear': linear_cooling,
+    'lundy_mees': lundy_mees_cooling,
+}
+
+
+def _random_positions(end, rng):
+    """随机的插入位置1<=i<=j<=end"""
+    i = rng.randint(1, end)
+    return i, rng.randint(i, end)
+
+
+class _AnnealingState(object):
+    '''
+    模拟退火的当前解及其辅助信息：
+    solution:Solution,当前解（原地修改）
+    where:Dict,键为已安排的请求（取货点编号），值为所在车辆在solution.vehicles中的下标
+    requests:List,所有请求的取货点编号
+    '''
+
+    def __init__(self, solution, soft_penalty, unassigned_penalty):
+        self.solution = solution
+        self.soft_penalty = soft_penalty
+        self.unassigned_penalty = unassigned_penalty
+        self.partner = solution.vehicles[0].nodes.partner
+        self.where = {}
+        node_type = solution.vehicles[0].nodes.node_type
+        self.requests = []
+        for v, veh in enumerate(solution.vehicles):
+            for n in veh.route:
+                if node_type[n] == PICKUP:
+                    self.where[n] = v
+                    self.requests.append(n)
+        self.requests.extend(sorted(solution.unassigned))
+        self.cost = solution.objective(soft_penalty=soft_penalty, unassigned_penalty=unassigned_penalty)
+
+    def propose(self, move, rng):
+        """随机生成一个动作并增量评价，返回(成本变化, 应用动作的函数)，动作不可行时返回None"""
+        vehicles = self.solution.vehicles
+        p = rng.choice(self.requests)
+        d = self.partner[p]
+        a = self.where.get(p)
+        if a is None:  # 没有被安排的请求：插入到随机车辆的随机位置
+            b = rng.randrange(len(vehicles))
+            veh_b = vehicles[b]
+            i, j = _random_positions(veh_b.insert_positions(), rng)
+            delta_distance, delta_soft, feasible = veh_b.evaluate_insertion(p, d, i, j)
+            if not feasible:
+                return None
+
+            def apply():
+                veh_b.insert_pd_node_at(p, d, i, j)
+                self.solution.unassigned.discard(p)
+                self.where[p] = b
+            return delta_distance + self.soft_penalty * delta_soft - self.unassigned_penalty, apply
+
+        veh_a = vehicles[a]
+        route_a = veh_a.route
+        ip = route_a.index(p)
+        id_ = route_a.index(d, ip)
+        if move == SHIFT:
+            i, j = _random_positions(len(route_a) - 3, rng)
+            lo, hi, middle = move_window(route_a, ip, id_, p, d, i, j)
+            delta_distance, delta_soft, feasible = veh_a.evaluate_splice(lo, hi, middle)
+            if not feasible:
+                return None
+
+            def apply():
+                veh_a.splice(lo, hi, middle)
+            return delta_distance + self.soft_penalty * delta_soft, apply
+
+        b = rng.randrange(len(vehicles) - 1)
+        b = b + 1 if b >= a else b
+        veh_b = vehicles[b]
+        if move == RELOCATE:
+            i, j = _random_positions(veh_b.insert_positions(), rng)
+            delta_b = veh_b.evaluate_insertion(p, d, i, j)
+            if not delta_b[2]:
+                return None
+            lo, hi, middle = move_window(route_a, ip, id_)
+            delta_a = veh_a.evaluate_splice(lo, hi, middle)
+
+            def apply():
+                veh_a.splice(lo, hi, middle)
+                veh_b.insert_pd_node_at(p, d, i, j)
+                self.where[p] = b
+        else:  # EXCHANGE
+            route_b = veh_b.route
+            if len(route_b) <= 2:
+                return None
+            q = route_b[rng.randrange(1, len(route_b) - 1)]
+            if q not in self.where:  # 选中了送货点，换成对应的取货点
+                q = self.partner[q]
+            e = self.partner[q]
+            jq = route_b.index(q)
+            je = route_b.index(e, jq)
+            i, j = _random_positions(len(route_a) - 3, rng)
+            lo, hi, middle = move_window(route_a, ip, id_, q, e, i, j)
+            delta_a = veh_a.evaluate_splice(lo, hi, middle)
+            if not delta_a[2]:
+                return None
+            k, m = _random_positions(len(route_b) - 3, rng)
+            lo_b, hi_b, middle_b = move_window(route_b, jq, je, p, d, k, m)
+            delta_b = veh_b.evaluate_splice(lo_b, hi_b, middle_b)
+
+            def apply():
+                veh_a.splice(lo, hi, middle)
+                veh_b.splice(lo_b, hi_b, middle_b)
+                self.where[p] = b
+                self.where[q] = a
+        if not delta_a[2] or not delta_b[2]:
+            return None
+        return delta_a[0] + delta_b[0] + self.soft_penalty * (delta_a[1] + delta_b[1]), apply
+
+
+def _initial_temperature(state, rng, move_weights, acceptance=1e-3, samples=200):
+    """初始温度：使较小的变差动作（随机变差动作变差量的CALIBRATION_QUANTILE分位数）以概率acceptance被接受，
+    T0 = -分位数 / ln(acceptance)。随机位置的动作变差量的分布很偏，按平均变差量校准的T0过高，
+    当前解会漂移到很差的区域，在时间上限内降温后也回不到初始解附近
+    """
+    worse = []
+    moves = list(range(len(MOVE_NAMES)))
+    for _ in range(samples * 10):
+        proposal = state.propose(rng.choices(moves, move_weights)[0], rng)
+        if proposal is not None and proposal[0] > 0:
+            worse.append(proposal[0])
+            if len(worse) >= samples:
+                break
+    if not worse:
+        return 1.0
+    worse.sort()
+    return -worse[int(CALIBRATION_QUANTILE * (len(worse) - 1))] / math.log(acceptance)
+
+
+def simulated_annealing(instance, time_limit=60, max_iterations=None, initial_solution=None,
+                        initial_temperature=None, initial_acceptance=1e-3, final_temperature=1e-3,
+                        cooling='exponential', reheat_after=200000, reheat_ratio=3.0, reheat_span=0.05,
+                        move_weights=(1, 1, 1), soft_penalty=SOFT_PENALTY, unassigned_penalty=UNASSIGNED_PENALTY,
+                        migration=None, seed=0, verbose=True):
+    """模拟退火主程序，返回(最好的解, 统计信息)。
+    time_limit为运行时间上限（秒），max_iterations为迭代次数上限，两者至少给出一个；
+    initial_temperature为None时按较小的随机变差动作的接受概率initial_acceptance校准T0（见_initial_temperature）；
+    cooling为COOLING_SCHEDULES中的名称，或者形如f(T0, 最终温度, 运行进度)的函数，每CHECK_TIME_EVERY次迭代调用一次；
+    连续reheat_after次迭代没有改进最好解时，温度乘以reheat_ratio，并在之后reheat_span的进度内衰减回降温曲线；
+    move_weights为relocate、exchange、shift三种动作被选中的权重；migration为迁移钩子（见metaheuristics.py），
+    迁入更好的解时从它继续搜索，温度不变
+    """
+    if time_limit is None and max_iterations is None:
+        raise ValueError('time_limit和max_iterations至少要给出一个')
+    cool = COOLING_SCHEDULES[cooling] if isinstance(cooling, str) else cooling
+    rng = random.Random(seed)
+    start = time.time()
+
+    if initial_solution is None:
+        initial_solution = regret_insertion(Solution.empty(instance), k=2)
+    state = _AnnealingState(initial_solution.copy(), soft_penalty, unassigned_penalty)
+    best = state.solution.copy()
+    best_cost = state.cost
+    moves = list(range(len(MOVE_NAMES)))
+
+    t0 = initial_temperature if initial_temperature is not None else \
+        _initial_temperature(state, rng, move_weights, initial_acceptance)
+    t0 = max(t0, final_temperature)
+    temperature = t0
+    stats = {'iterations': 0, 'evaluations': 0, 'accepted': 0, 'improvements': 0, 'reheats': 0, 'migrants': 0,
+             'initial_temperature': t0, 'best_history': [(0, best_cost)]}
+    since_improvement = 0
+    progress = 0.0
+    boost, boost_until = 1.0, 0.0  # 重新升温的倍数，在进度boost_until之前按指数衰减到1
+    iteration = 0
+    with profiler.timer('sa.main_loop'):
+        while True:
+            if iteration % CHECK_TIME_EVERY == 0:
+                elapsed = time.time() - start
+                if time_limit is not None:
+                    if elapsed >= time_limit:
+                        break
+                    progress = elapsed / time_limit
+                if max_iterations is not None:
+                    progress = max(progress, iteration / max_iterations)
+                temperature = max(cool(t0, final_temperature, min(progress, 1.0)), final_temperature)
+                if progress < boost_until:
+                    temperature *= boost ** ((boost_until - progress) / reheat_span)
+                immigrant = migration(best_cost, best.routes) if migration is not None else None
+                if immigrant is not None:
+                    immigrant = _AnnealingState(Solution.from_routes(instance, immigrant), soft_penalty,
+                                                unassigned_penalty)
+                    if immigrant.cost < best_cost - 1e-9:
+                        state = immigrant
+                        best, best_cost = state.solution.copy(), state.cost
+                        since_improvement = 0
+                        stats['migrants'] += 1
+            if max_iterations is not None and iteration >= max_iterations:
+                break
+            iteration += 1
+
+            proposal = state.propose(rng.choices(moves, move_weights)[0], rng)
+            stats['evaluations'] += 1
+            if proposal is not None:
+                delta, apply = proposal
+                if delta <= 0 or (temperature > 0 and rng.random() < math.exp(-delta / temperature)):
+                    apply()
+                    state.cost += delta
+                    stats['accepted'] += 1
+                    if state.cost < best_cost - 1e-9:
+                        best_cost = state.cost
+                        best = state.solution.copy()
+                        since_improvement = 0
+                        stats['improvements'] += 1
+                        stats['best_history'].append((iteration, best_cost))
+
+            since_improvement += 1
+            if reheat_after and since_improvement >= reheat_after:
+                # 当前温度乘以reheat_ratio（叠加上一次还没有衰减完的升温），在reheat_span的进度内衰减回降温曲线
+                if progress < boost_until:
+                    boost = boost ** ((boost_until - progress) / reheat_span)
+                else:
+                    boost = 1.0
+                boost = min(boost * reheat_ratio, reheat_ratio ** 2)
+                boost_until = min(progress + reheat_span, 1.0)  # 时间上限处回到降温曲线
+                temperature *= reheat_ratio
+                since_improvement = 0
+                stats['reheats'] += 1
+                if verbose:
+                    print('第%s次迭代重新升温，温度：%.2f，最好的目标函数值：%.2f' % (iteration, temperature, best_cost))
+
+    elapsed = time.time() - start
+    stats['iterations'] = iteration
+    stats['time'] = elapsed
+    stats['evaluations_per_second'] = stats['evaluations'] / elapsed if elapsed > 0 else 0
+    stats['final_temperature'] = temperature
+    stats['final_cost'] = state.cost
+    profiler.count('sa.iterations', iteration)
+    return best, stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw200_revised/LR1_2_1.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, sa_stats = simulated_annealing(pdptw_instance, time_limit=60)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车'.format(best_solution.used_vehicle_num))
+    print('每秒评价动作数：', sa_stats['evaluations_per_second'])
+    print('程序总的运行时间：', sa_stats['time'], '秒')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: solution.py
+@time: 2020/10/22 15:40
+@description:PDPTW问题的解（一组车辆路径），供各启发式和元启发式算法共用
+==解中的车辆共享算例数据，复制一个解只需复制每辆车的路径整数数组
+"""
+from vehicle import Vehicle
+
+SOFT_PENALTY = 1.0  # 单位软时间窗违背时间的惩罚成本
+HARD_PENALTY = 1000.0  # 单位硬时间窗违背时间的惩罚成本
+UNASSIGNED_PENALTY = 10000.0  # 每个未安排运输请求的惩罚成本
+
+
+class Solution(object):
+    '''
+    解类：
+    vehicles:List,Vehicle类对象列表，每辆车的路径为[开始depot, ..., 结束depot]
+    unassigned:Set,还没有被安排到任何车辆上的运输请求（取货点编号）
+    '''
+    __slots__ = ('vehicles', 'unassigned')
+
+    def __init__(self, vehicles, unassigned=()):
+        self.vehicles = vehicles
+        self.unassigned = set(unassigned)
+
+    @classmethod
+    def empty(cls, instance):
+        """生成所有车辆都只有首尾depot的空解，所有运输请求都未安排"""
+        vehicles = []
+        for k in range(instance.vehicle_num):
+            veh = Vehicle(k, instance.capacity, instance.speed, instance.matrix, instance.nodes)
+            veh.set_route([instance.start_depot, instance.end_depot])
+            vehicles.append(veh)
+        return cls(vehicles, instance.requests[:, 0].tolist())
+
+    @classmethod
+    def from_routes(cls, instance, routes):
+        """由路径列表（每条路径为[开始depot, ..., 结束depot]）生成解，路径数少于车辆数时其余车辆为空车，
+        没有出现在任何路径中的运输请求记为未安排
+        """
+        sol = cls.empty(instance)
+        if len(routes) > len(sol.vehicles):
+            raise ValueError('路径数%s超过了车辆数%s' % (len(routes), len(sol.vehicles)))
+        served = set()
+        for veh, route in zip(sol.vehicles, routes):
+            veh.set_route(route)
+            served.update(route)
+        sol.unassigned = set(p for p in sol.unassigned if p not in served)
+        return sol
+
+    def copy(self):
+        """复制解，代价约为复制每辆车的路径数组"""
+        return Solution([veh.copy() for veh in self.vehicles], self.unassigned)
+
+    @property
+    def total_distance(self):
+        return sum(veh.distance for veh in self.vehicles)
+
+    @property
+    def total_soft_violate_time(self):
+        return sum(veh.total_soft_violate_time for veh in self.vehicles)
+
+    @property
+    def total_hard_violate_time(self):
+        return sum(veh.total_hard_violate_time for veh in self.vehicles)
+
+    @property
+    def used_vehicle_num(self):
+        return sum(1 for veh in self.vehicles if len(veh.route) > 2)
+
+    def objective(self, soft_penalty=SOFT_PENALTY, hard_penalty=HARD_PENALTY, unassigned_penalty=UNASSIGNED_PENALTY):
+        """目标函数：总行驶距离+软硬时间窗违背惩罚+未安排请求惩罚"""
+        return self.total_distance + soft_penalty * self.total_soft_violate_time + \
+            hard_penalty * self.total_hard_violate_time + unassigned_penalty * len(self.unassigned)
+
+    def is_feasible(self):
+        """所有请求都已安排，且所有车辆路径都可行"""
+        return not self.unassigned and all(veh.check_vehicle_route_feasible() for veh in self.vehicles)
+
+    def remove_requests(self, pickups):
+        """把一组运输请求（取货点编号）从所在车辆的路径中删除，并记为未安排；每辆车只更新一次"""
+        partner = self.vehicles[0].nodes.partner
+        removed = set(pickups)
+        removed.update(partner[p] for p in pickups)
+        for veh in self.vehicles:
+            if any(n in removed for n in veh.route):
+                veh.set_route([n for n in veh.route if n not in removed])
+        self.unassigned.update(pickups)
+
+    def routes(self):
+        """以列表形式返回所有车辆的路径"""
+        return [veh.route.tolist() for veh in self.vehicles]
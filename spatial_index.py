@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+@author: yuan_xin
+@contact: yuanxin9997@qq.com
+@file: spatial_index.py
+@time: 2020/10/30 15:10
+@description:按坐标的均匀网格索引和k近邻查询，一个算例只建立一次（Instance.neighbourhood），由各算法共享
+==网格：按点的坐标范围划分为边长相同的正方形格子，平均每个格子约POINTS_PER_CELL个点，点按格子编号排序后用CSR形式保存
+==k近邻查询：从查询点所在的格子开始一圈一圈向外扩展，已找到k个点并且第k近的距离小于查询点到未扩展格子的最短距离时停止，
+==  结果与按整行距离矩阵排序相同（距离相同时按点编号从小到大），每次查询只访问查询点附近的O(k)个点
+==近邻提供者NeighbourhoodProvider：点的k近邻（粒度邻域只在近邻点旁边插入），
+==  以及请求的k近邻（按请求取货点和送货点的中点），结果按k缓存，大小为O(n·k)，不需要n*n的数组
+"""
+import math
+
+import numpy as np
+
+POINTS_PER_CELL = 2
+
+
+class GridIndex(object):
+    '''
+    均匀网格索引：
+    x,y:ndarray,点的坐标
+    cell:float,格子的边长
+    cols,rows:int,格子的列数、行数
+    '''
+
+    def __init__(self, x, y, points_per_cell=POINTS_PER_CELL):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        n = self.x.shape[0]
+        self.x0 = float(self.x.min()) if n else 0.0
+        self.y0 = float(self.y.min()) if n else 0.0
+        width = float(self.x.max()) - self.x0 if n else 0.0
+        height = float(self.y.max()) - self.y0 if n else 0.0
+        self.cell = math.sqrt(max(width * height, 1.0) * points_per_cell / max(n, 1)) or 1.0
+        self.cols = int(width // self.cell) + 1
+        self.rows = int(height // self.cell) + 1
+        cx, cy = self._cell_of(self.x, self.y)
+        cell_ids = cy * self.cols + cx
+        self.order = np.argsort(cell_ids, kind='stable')  # 按格子排序的点编号
+        self.start = np.searchsorted(cell_ids[self.order], np.arange(self.cols * self.rows + 1))  # CSR偏移
+
+    def __len__(self):
+        return self.x.shape[0]
+
+    def _cell_of(self, x, y):
+        cx = np.clip(((np.asarray(x) - self.x0) // self.cell).astype(np.int64), 0, self.cols - 1)
+        cy = np.clip(((np.asarray(y) - self.y0) // self.cell).astype(np.int64), 0, self.rows - 1)
+        return cx, cy
+
+    def _ring(self, cx, cy, r):
+        """以格子(cx, cy)为中心、第r圈上的格子中的点编号"""
+        blocks = []
+        for gy in range(cy - r, cy + r + 1):
+            if gy < 0 or gy >= self.rows:
+                continue
+            if gy in (cy - r, cy + r):
+                lo, hi = max(cx - r, 0), min(cx + r, self.cols - 1)
+                if lo <= hi:
+                    base = gy * self.cols
+                    blocks.append(self.order[self.start[base + lo]:self.start[base + hi + 1]])
+            else:
+                for gx in (cx - r, cx + r):
+                    if 0 <= gx < self.cols:
+                        cell = gy * self.cols + gx
+                        blocks.append(self.order[self.start[cell]:self.start[cell + 1]])
+        return blocks
+
+    def _outside_distance(self, x, y, cx, cy, r):
+        """点(x, y)到第r圈以外的格子的最短距离（以外没有格子的方向不计），第r圈已覆盖整个网格时为inf"""
+        bound = math.inf
+        if cx - r > 0:
+            bound = min(bound, x - (self.x0 + (cx - r) * self.cell))
+        if cx + r < self.cols - 1:
+            bound = min(bound, self.x0 + (cx + r + 1) * self.cell - x)
+        if cy - r > 0:
+            bound = min(bound, y - (self.y0 + (cy - r) * self.cell))
+        if cy + r < self.rows - 1:
+            bound = min(bound, self.y0 + (cy + r + 1) * self.cell - y)
+        return bound
+
+    def query(self, x, y, k, exclude=-1):
+        """离点(x, y)最近的k个点的编号（按距离升序，距离相同时按编号），不包含编号为exclude的点"""
+        k = min(k, len(self) - (0 <= exclude < len(self)))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        cx, cy = (int(c) for c in self._cell_of(x, y))
+        found = []
+        r = 0
+        while True:
+            found.extend(self._ring(cx, cy, r))
+            ids = np.concatenate(found)
+            if exclude >= 0:
+                ids = ids[ids != exclude]
+            if ids.shape[0] >= k:
+                dist = np.hypot(self.x[ids] - x, self.y[ids] - y)
+                chosen = np.lexsort((ids, dist))[:k]
+                # 第r圈以外的点都比第k近的点远（严格），结果与全部排序相同
+                if dist[chosen[-1]] < self._outside_distance(x, y, cx, cy, r):
+                    return ids[chosen]
+            r += 1
+
+    def knn(self, k):
+        """所有点的k近邻（不含自己），形状(n, k)"""
+        return np.array([self.query(self.x[i], self.y[i], k, exclude=i) for i in range(len(self))],
+                        dtype=np.int64).reshape(len(self), -1)
+
+
+class NeighbourhoodProvider(object):
+    '''
+    算例共享的近邻提供者（通过Instance.neighbourhood取得）：
+    node_index:GridIndex,所有点的网格索引
+    request_index:GridIndex,请求的网格索引，请求的坐标为取货点和送货点的中点，编号为instance.requests的行号
+    '''
+
+    def __init__(self, x, y, requests):
+        self.node_index = GridIndex(x, y)
+        pickups, deliveries = requests[:, 0], requests[:, 1]
+        self.request_index = GridIndex((self.node_index.x[pickups] + self.node_index.x[deliveries]) / 2,
+                                       (self.node_index.y[pickups] + self.node_index.y[deliveries]) / 2)
+        self._cache = {}
+
+    @classmethod
+    def of_instance(cls, instance):
+        return cls(instance.x, instance.y, instance.requests)
+
+    def _cached(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    def nodes(self, k):
+        """每个点最近的k个点（不含自己），形状(n, k)"""
+        return self._cached(('nodes', k), lambda: self.node_index.knn(k))
+
+    def node_sets(self, k):
+        """每个点最近的k个点的集合的列表，用于O(1)判断某点是否为近邻"""
+        return self._cached(('node_sets', k), lambda: [frozenset(row) for row in self.nodes(k).tolist()])
+
+    def requests(self, k):
+        """每个请求最近的k个请求的行号（按取货点和送货点的中点），形状(m, k)"""
+        return self._cached(('requests', k), lambda: self.request_index.knn(k))
+
+    def nodes_near(self, x, y, k):
+        """离任意坐标(x, y)最近的k个点"""
+        return self.node_index.query(x, y, k)
@@ -4,5 +4,310 @@
 @contact: yuanxin9997@qq.com
 @file: tabu_search_pdptw.py
 @time: 2020/10/19 16:57
-@description:
+@description:求解PDPTW问题的粒度禁忌搜索（granular tabu search）
+==邻域：PD点对的relocate（把一个请求移到另一辆车）和exchange（两辆车的请求在原位置互换）
+==粒度邻域：每个请求只考虑在空间和时间上与它最接近的k个请求（近邻请求），relocate只移到服务近邻请求的车辆
+==（跳过与它不能同车的近邻请求，见request_compatibility），
+==并且取货点、送货点只插入到与其距离最近的点相邻的位置；exchange只与近邻请求交换，避免O(n^2·L)的全邻域扫描
+==禁忌表：字典{(请求, 车辆): 禁忌到期的迭代次数}，请求移出车辆A后，在到期之前不能再移回A，查询为O(1)
+==循环检测：按(请求, 车辆)的分配关系计算解的Zobrist哈希值，移动后O(1)增量更新，跳过会回到已访问解的动作
 """
+import random
+import time
+
+import numpy as np
+
+import profiler
+from insertion_heuristic import regret_insertion
+from node import PICKUP
+from read_data import read_data
+from request_compatibility import relatedness_matrix, request_compatibility
+from solution import SOFT_PENALTY, UNASSIGNED_PENALTY, Solution
+from vehicle import move_window
+
+RELOCATE, EXCHANGE = 0, 1
+PRUNE_TABU_EVERY = 500  # 每隔多少次迭代清理一次禁忌表中已经到期的项
+
+
+def request_neighbours(instance, neighbour_num=10, time_weight=1.0):
+    """每个请求的近邻请求：形状为(m, k)的数组，第r行为与第r个请求（instance.requests[r]）最接近的k个请求的行号。
+    接近程度为取货点之间的距离+送货点之间的距离+time_weight*(取货点左时间窗之差+送货点左时间窗之差)
+    """
+    relatedness = relatedness_matrix(instance.matrix.distance, instance.ready_time, instance.demand,
+                                     instance.requests[:, 0], instance.requests[:, 1], time_weight=time_weight)
+    k = max(1, min(neighbour_num, instance.request_num - 1))
+    nearest = np.argpartition(relatedness, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(relatedness, nearest, axis=1), axis=1)
+    return np.take_along_axis(nearest, order, axis=1)
+
+
+def nearest_nodes(instance, node_num=10):
+    """每个点距离最近的node_num个点（不含自己），返回集合的列表（由算例共享的网格索引查询，见spatial_index.py）"""
+    return instance.neighbourhood.node_sets(max(1, min(node_num, instance.node_num - 1)))
+
+
+class ZobristHash(object):
+    '''
+    按(请求, 车辆)分配关系计算的Zobrist哈希：每个(请求, 车辆)有一个随机的64位整数，解的哈希值为所有分配的异或，
+    车辆编号vehicle_num表示未安排
+    '''
+
+    def __init__(self, request_ids, vehicle_num, seed=0):
+        rng = np.random.default_rng(seed)
+        keys = rng.integers(0, 1 << 63, size=(len(request_ids), vehicle_num + 1), dtype=np.int64)
+        self.keys = {p: row for p, row in zip(request_ids, keys.tolist())}
+
+    def of(self, where):
+        """where为{请求: 车辆}"""
+        value = 0
+        for p, v in where.items():
+            value ^= self.keys[p][v]
+        return value
+
+    def moved(self, value, p, a, b):
+        """请求p从车辆a移到车辆b后的哈希值"""
+        row = self.keys[p]
+        return value ^ row[a] ^ row[b]
+
+
+class _TabuState(object):
+    '''
+    禁忌搜索的当前解及其辅助信息：
+    where:Dict,{请求（取货点编号）: 所在车辆的下标}，未安排的请求为len(vehicles)
+    '''
+
+    def __init__(self, solution, soft_penalty, unassigned_penalty):
+        self.solution = solution
+        self.soft_penalty = soft_penalty
+        self.unassigned_penalty = unassigned_penalty
+        self.nodes = solution.vehicles[0].nodes
+        self.unassigned_index = len(solution.vehicles)
+        self.where = {p: self.unassigned_index for p in solution.unassigned}
+        for v, veh in enumerate(solution.vehicles):
+            for n in veh.route:
+                if self.nodes.node_type[n] == PICKUP:
+                    self.where[n] = v
+        self.cost = solution.objective(soft_penalty=soft_penalty, unassigned_penalty=unassigned_penalty)
+
+    def removal(self, p):
+        """请求p从所在车辆删除的(受影响的片段, 成本变化)，未安排的请求返回(None, -未安排惩罚)"""
+        a = self.where[p]
+        if a == self.unassigned_index:
+            return None, -self.unassigned_penalty
+        veh = self.solution.vehicles[a]
+        ip = veh.route.index(p)
+        id_ = veh.route.index(self.nodes.partner[p], ip)
+        window = move_window(veh.route, ip, id_)
+        delta_distance, delta_soft, _ = veh.evaluate_splice(*window)
+        return window, delta_distance + self.soft_penalty * delta_soft
+
+    def best_insertion(self, veh, p, near):
+        """在粒度位置上把请求p插入车辆veh的最好结果(成本变化, i, j)，没有可行位置时返回None。
+        取货点只插入到与near中的点相邻的位置，送货点紧跟取货点，或者也插入到与其近邻点相邻的位置
+        """
+        d = self.nodes.partner[p]
+        route = veh.route
+        end = veh.insert_positions()
+        near_p, near_d = near[p], near[d]
+        positions_p = [i for i in range(1, end + 1) if route[i - 1] in near_p or route[i] in near_p]
+        positions_d = [j for j in range(1, end + 1) if route[j - 1] in near_d or route[j] in near_d]
+        if len(route) <= 2:  # 空车只有一个位置
+            positions_p = [1]
+        best = None
+        for i in positions_p:
+            for j in [i] + [j for j in positions_d if j > i]:
+                delta_distance, delta_soft, feasible = veh.evaluate_insertion(p, d, i, j)
+                if feasible:
+                    delta = delta_distance + self.soft_penalty * delta_soft
+                    if best is None or delta < best[0]:
+                        best = (delta, i, j)
+        return best
+
+    def exchange(self, p, q):
+        """请求p和q（在不同车辆上）在原位置互换的(成本变化, 两条路径受影响的片段)，不可行时返回None"""
+        partner = self.nodes.partner
+        vehicles = self.solution.vehicles
+        delta = 0
+        windows = []
+        for x, y in ((p, q), (q, p)):
+            veh = vehicles[self.where[x]]
+            ip = veh.route.index(x)
+            id_ = veh.route.index(partner[x], ip)
+            window = move_window(veh.route, ip, id_, y, partner[y], ip, id_ - 1)
+            delta_distance, delta_soft, feasible = veh.evaluate_splice(*window)
+            if not feasible:
+                return None
+            delta += delta_distance + self.soft_penalty * delta_soft
+            windows.append(window)
+        return delta, windows
+
+
+def tabu_search(instance, time_limit=60, max_iterations=None, max_no_improve=2000, initial_solution=None,
+                neighbour_num=10, near_node_num=10, sample_size=50, tenure=(10, 30), soft_penalty=SOFT_PENALTY,
+                unassigned_penalty=UNASSIGNED_PENALTY, migration=None, seed=0, verbose=True):
+    """粒度禁忌搜索主程序，返回(最好的解, 统计信息)。
+    每次迭代从随机的sample_size个请求（None为全部请求）的粒度邻域中选择最好的非禁忌动作，
+    禁忌的动作在得到比历史最好解更好的解时可以被接受（特赦准则）；会回到已访问过的解（Zobrist哈希相同）的动作被跳过。
+    禁忌期在tenure范围内随机选取；migration为迁移钩子（见metaheuristics.py），每次迭代调用，
+    迁入更好的解时从它继续搜索，禁忌表和已访问的解不变
+    """
+    if time_limit is None and max_iterations is None:
+        raise ValueError('time_limit和max_iterations至少要给出一个')
+    rng = random.Random(seed)
+    start = time.time()
+
+    if initial_solution is None:
+        initial_solution = regret_insertion(Solution.empty(instance), k=2)
+    state = _TabuState(initial_solution.copy(), soft_penalty, unassigned_penalty)
+    vehicles = state.solution.vehicles
+    unassigned_index = state.unassigned_index
+    request_ids = instance.requests[:, 0].tolist()
+    neighbours = [[request_ids[r] for r in row] for row in request_neighbours(instance, neighbour_num).tolist()]
+    neighbours = dict(zip(request_ids, neighbours))
+    # 与p不能同车的请求所在的车辆，插入p一定违背硬约束，relocate不必评价
+    compatibility = request_compatibility(instance, 'vehicle')
+    relocate_neighbours = {p: [q for q in neighbours[p] if compatibility.is_compatible(p, q)] for p in request_ids}
+    near = nearest_nodes(instance, near_node_num)
+    zobrist = ZobristHash(request_ids, len(vehicles), seed)
+    current_hash = zobrist.of(state.where)
+    visited = {current_hash}
+    tabu = {}
+
+    best = state.solution.copy()
+    best_cost = state.cost
+    stats = {'iterations': 0, 'evaluations': 0, 'cycles_avoided': 0, 'tabu_moves': 0, 'migrants': 0,
+             'best_history': [(0, best_cost)]}
+    iteration = 0
+    no_improve = 0
+    with profiler.timer('tabu.main_loop'):
+        while True:
+            if time_limit is not None and time.time() - start >= time_limit:
+                break
+            if max_iterations is not None and iteration >= max_iterations:
+                break
+            if max_no_improve is not None and no_improve >= max_no_improve:
+                break
+            iteration += 1
+            immigrant = migration(best_cost, best.routes) if migration is not None else None
+            if immigrant is not None:
+                immigrant = _TabuState(Solution.from_routes(instance, immigrant), soft_penalty, unassigned_penalty)
+                if immigrant.cost < best_cost - 1e-9:
+                    state = immigrant
+                    vehicles = state.solution.vehicles
+                    best, best_cost = state.solution.copy(), state.cost
+                    current_hash = zobrist.of(state.where)
+                    visited.add(current_hash)
+                    no_improve = 0
+                    stats['migrants'] += 1
+
+            requests = request_ids if sample_size is None or sample_size >= len(request_ids) else \
+                rng.sample(request_ids, sample_size)
+            candidate = None  # (成本变化, 动作类型, 请求p, 目标车辆或交换的请求, 插入位置或受影响的片段, 新的哈希值)
+            empty = next((v for v, veh in enumerate(vehicles) if len(veh.route) <= 2), None)
+            for p in requests:
+                a = state.where[p]
+                window, removal_delta = state.removal(p)
+                # relocate：移到服务近邻请求的车辆，以及一辆空车
+                targets = set(state.where[q] for q in relocate_neighbours[p])
+                if empty is not None:
+                    targets.add(empty)
+                targets.discard(a)
+                targets.discard(unassigned_index)
+                for b in targets:
+                    insertion = state.best_insertion(vehicles[b], p, near)
+                    stats['evaluations'] += 1
+                    if insertion is None:
+                        continue
+                    delta = removal_delta + insertion[0]
+                    if candidate is not None and delta >= candidate[0]:
+                        continue
+                    new_hash = zobrist.moved(current_hash, p, a, b)
+                    aspiration = state.cost + delta < best_cost - 1e-9
+                    if not aspiration:
+                        if tabu.get((p, b), 0) > iteration:
+                            stats['tabu_moves'] += 1
+                            continue
+                        if new_hash in visited:
+                            stats['cycles_avoided'] += 1
+                            continue
+                    candidate = (delta, RELOCATE, p, b, (window, insertion[1], insertion[2]), new_hash)
+                # exchange：与不在同一辆车上的近邻请求互换
+                if a == unassigned_index:
+                    continue
+                for q in neighbours[p]:
+                    b = state.where[q]
+                    if b == a or b == unassigned_index:
+                        continue
+                    result = state.exchange(p, q)
+                    stats['evaluations'] += 1
+                    if result is None or (candidate is not None and result[0] >= candidate[0]):
+                        continue
+                    new_hash = zobrist.moved(zobrist.moved(current_hash, p, a, b), q, b, a)
+                    aspiration = state.cost + result[0] < best_cost - 1e-9
+                    if not aspiration:
+                        if tabu.get((p, b), 0) > iteration or tabu.get((q, a), 0) > iteration:
+                            stats['tabu_moves'] += 1
+                            continue
+                        if new_hash in visited:
+                            stats['cycles_avoided'] += 1
+                            continue
+                    candidate = (result[0], EXCHANGE, p, q, result[1], new_hash)
+
+            if candidate is None:
+                no_improve += 1
+                continue
+            delta, move, p, target, detail, new_hash = candidate
+            a = state.where[p]
+            d = state.nodes.partner[p]
+            if move == RELOCATE:
+                window, i, j = detail
+                if window is None:
+                    state.solution.unassigned.discard(p)
+                else:
+                    vehicles[a].splice(*window)
+                vehicles[target].insert_pd_node_at(p, d, i, j)
+                state.where[p] = target
+                tabu[(p, a)] = iteration + rng.randint(*tenure)
+            else:
+                q = target
+                b = state.where[q]
+                vehicles[a].splice(*detail[0])
+                vehicles[b].splice(*detail[1])
+                state.where[p], state.where[q] = b, a
+                tabu[(p, a)] = iteration + rng.randint(*tenure)
+                tabu[(q, b)] = iteration + rng.randint(*tenure)
+            state.cost += delta
+            current_hash = new_hash
+            visited.add(current_hash)
+
+            if state.cost < best_cost - 1e-9:
+                best_cost = state.cost
+                best = state.solution.copy()
+                no_improve = 0
+                stats['best_history'].append((iteration, best_cost))
+                if verbose:
+                    print('第%s次迭代，最好的目标函数值：%.2f' % (iteration, best_cost))
+            else:
+                no_improve += 1
+            if iteration % PRUNE_TABU_EVERY == 0:
+                tabu = {key: expiry for key, expiry in tabu.items() if expiry > iteration}
+
+    elapsed = time.time() - start
+    stats['iterations'] = iteration
+    stats['time'] = elapsed
+    stats['tabu_size'] = len(tabu)
+    stats['visited_solutions'] = len(visited)
+    profiler.count('tabu.iterations', iteration)
+    return best, stats
+
+
+if __name__ == '__main__':
+    # 数据文件路径
+    data_path = './LiLimPDPTWbenchmark/pdptw600_revised/LR1_6_1.txt'
+    pdptw_instance = read_data(data_path)
+    best_solution, ts_stats = tabu_search(pdptw_instance, time_limit=60)
+    print('总成本：', best_solution.objective())
+    print('总行驶距离：', best_solution.total_distance)
+    print('共使用{}辆车'.format(best_solution.used_vehicle_num))
+    print('迭代次数：', ts_stats['iterations'])
+    print('程序总的运行时间：', ts_stats['time'], '秒')
@@ -6,10 +6,71 @@
 @time: 2020/10/19 17:24
 @description:
 """
-from collections import Iterable
+import sys
+from array import array
+from collections.abc import Iterable
+
+import profiler
+from node import DEPOT, PICKUP, NodeTable
 
 flat = lambda t: [x for sub in t for x in flat(sub)] if isinstance(t, Iterable) else [t]
 
+INF = float('inf')
+
+
+def _soft_violation(arrival_time, ready_time, due_time, service_time):
+    """到达时间为arrival_time时，节点的时间窗违背量：早到等待不违背，否则为超出右时间窗的服务完成时间"""
+    if arrival_time <= ready_time:
+        return 0
+    violation = arrival_time + service_time - due_time
+    return violation if violation > 0 else 0
+
+
+def _build_sparse_table(values, func):
+    """构造区间最值查询（RMQ）的稀疏表，table[p][k]为values[k:k+2**p]的最值"""
+    table = [list(values)]
+    width = 1
+    while 2 * width <= len(values):
+        prev = table[-1]
+        table.append([func(prev[k], prev[k + width]) for k in range(len(prev) - width)])
+        width *= 2
+    return table
+
+
+def _range_query(table, lo, hi, func):
+    """查询values[lo:hi+1]的最值，O(1)"""
+    p = (hi - lo + 1).bit_length() - 1
+    row = table[p]
+    return func(row[lo], row[hi - (1 << p) + 1])
+
+
+def move_window(route, ip, id_, p=None, d=None, i=0, j=0):
+    """删除路径位置ip和id_（ip<id_）上的PD点对，再把PD点对(p, d)插入到删除后路径的位置i、j之前（p为None时不插入），
+    返回受影响的片段(lo, hi, middle)：新路径为route[:lo] + middle + route[hi:]
+    """
+    lo, hi = ip, id_ + 1
+    if p is not None:
+        # 删除后路径的位置k对应原路径的位置
+        oi = i if i < ip else (i + 1 if i < id_ - 1 else i + 2)
+        oj = j if j < ip else (j + 1 if j < id_ - 1 else j + 2)
+        lo = min(lo, oi)
+        hi = max(hi, oj)
+    middle = []
+    for k in range(lo, hi):
+        if p is not None:
+            if k == oi:
+                middle.append(p)
+            if k == oj:
+                middle.append(d)
+        if k != ip and k != id_:
+            middle.append(route[k])
+    if p is not None:
+        if oi == hi:
+            middle.append(p)
+        if oj == hi:
+            middle.append(d)
+    return lo, hi, middle
+
 
 class Vehicle(object):
     '''
@@ -18,14 +79,32 @@ class Vehicle(object):
     cap:Number,车的最大载重量
     speed:Number，车辆的行驶速度
 
-    load:Number,车的载重量
+    load:Number,车在路径上的最大载重量
     distance:Number,车的行驶距离
     violate_time:Number,车违反其经过的各点时间窗时长总和
-    route:List,车经过的点index的列表
-    start_time:List,车在每个点的开始服务时间
+    route:array('i'),车经过的点index的整数数组
+    start_time:array('d'),车在路径上每个位置的开始服务时间（start_time[k]对应route[k]）
+    wait_time:array('d'),车在路径上每个位置的等待时间
+
+    以下为按路径位置k（route[k]）保存的前缀信息，每次路径变化时由update_info在O(L)内整体替换（不会原地修改），
+    用于在O(1)时间内评价一对PD点插入后的成本和可行性（evaluate_insertion）：
+    arrival:到达时间（最早到达时间），departure:离开时间，
+    cum_load:离开该点时的载重量，cum_distance:从开始depot行驶到该点的距离，
+    slack:到达时间最多还能推迟多少而不违背后续取货点的硬时间窗（forward time slack），
+    latest_arrival:不违背硬时间窗的最晚到达时间（arrival+slack）
+
+    在线调度（rolling_horizon_pdptw.py）用到的执行状态：
+    frozen:int,路径前frozen个位置已经执行（或车辆已经出发前往），不能再改变，新的点只能插入到位置frozen及之后，默认为1（开始depot）
+    available_time:Number,车辆离开位置frozen-1的最早时间（当前时刻或实际完成服务的时间），默认为0
+
+    nodes、距离矩阵和时间矩阵是算例数据，所有车辆按引用共享；copy()只复制路径数组，前缀信息按引用共享
     '''
+    __slots__ = ('v_id', 'cap', 'speed', 'load', 'distance', 'route', 'nodes', 'total_hard_violate_time',
+                 'total_soft_violate_time', 'start_time', 'wait_time', 'inst_matrix', 'distance_matrix', 'time_matrix',
+                 'arrival', 'departure', 'wait_prefix', 'cum_load', 'cum_distance', 'slack', 'latest_arrival',
+                 'hard_key', 'soft_key', 'soft_suffix', '_rmq', 'frozen', 'available_time')
 
-    def __init__(self, v_id, cap, speed, distance_matrix, nodes):
+    def __init__(self, v_id, cap, speed, inst_matrix, nodes):
         self.v_id = v_id
         self.cap = cap
         self.speed = speed
@@ -33,152 +112,440 @@ class Vehicle(object):
         self.load = 0
         self.distance = 0
 
-        self.route = [0]  # 车辆第一个服务的点默认为开始depot
-        self.pd_route = [0]  # 以列表的形式插入PD点对
+        self.route = array('i', [0])  # 车辆第一个服务的点默认为开始depot
+        self.frozen = 1  # 已经执行、不能再改变的路径位置数
+        self.available_time = 0  # 离开位置frozen-1的最早时间
 
-        self.nodes = nodes  # 不是以pd点对，而是以单个客户生成的Node类对象
+        # 不是以pd点对，而是以单个客户生成的Node类对象；所有车辆应共用同一个NodeTable，以免每辆车重复生成列式数据
+        self.nodes = nodes if isinstance(nodes, NodeTable) else NodeTable(nodes)
 
         self.total_hard_violate_time = 0  # 总的违背的硬时间窗，取货点P左右时间窗均为硬时间窗，送货点D的左时间窗为硬时间窗
         self.total_soft_violate_time = 0  # 总的违背的软时间窗，送货点D的有时间窗为软时间窗
-        self.start_time = {0: 0}  # 开始服务每个节点的时间
-        self.wait_time = {0: 0}  # 在每个节点上的等待时间
+        self.start_time = array('d', [0])  # 开始服务每个节点的时间
+        self.wait_time = array('d', [0])  # 在每个节点上的等待时间
         # self.violate_time = [0] # 在每个节点上的时间窗违背
 
-        self.distance_matrix = distance_matrix  # 为了简便，将距离矩阵传进来，并且在方法内部计算时间矩阵
-        self.time_matrix = {}  # 通过类方法进行计算
-
-    # 根据距离矩阵和车辆的速度计算车辆自己的时间矩阵
+        self.inst_matrix = inst_matrix  # 算例共享的矩阵层InstanceMatrix，所有车辆引用同一个对象
+        self.distance_matrix = inst_matrix.distance  # 距离矩阵，按distance_matrix[i, j]索引
+        self.time_matrix = None  # 通过类方法进行计算
+        self.cal_time_matrix()
+
+        # 按路径位置保存的前缀信息
+        self.arrival = array('d', [0])
+        self.departure = array('d', [0])
+        self.wait_prefix = array('d', [0, 0])  # wait_prefix[k]为wait_time[0:k]之和
+        self.cum_load = array('d', [0])
+        self.cum_distance = array('d', [0])
+        self.slack = array('d', [INF])
+        self.latest_arrival = array('d', [INF])
+        self.hard_key = array('d', [INF])  # 取货点的剩余硬时间窗+wait_prefix，用于区间最小值查询
+        self.soft_key = array('d', [INF])  # 送货点的剩余软时间窗+wait_prefix，用于区间最小值查询
+        self.soft_suffix = array('d', [INF, INF])  # soft_key的后缀最小值
+        self._rmq = None  # 稀疏表，第一次查询时才构造
+
+    # 根据车辆的速度从共享的矩阵层取得时间矩阵，同一速度的车辆共用同一个数组
     def cal_time_matrix(self):
-        for (i, j) in self.distance_matrix.keys():
-            self.time_matrix[i, j] = self.distance_matrix[i, j] / self.speed
+        self.time_matrix = self.inst_matrix.time_matrix(self.speed)
+
+    # 复制车辆：只复制路径数组，算例数据和前缀信息按引用共享，用于种群类算法大量复制解
+    def copy(self):
+        veh = Vehicle.__new__(Vehicle)
+        veh.v_id, veh.cap, veh.speed, veh.load, veh.distance = self.v_id, self.cap, self.speed, self.load, self.distance
+        veh.route = self.route[:]
+        veh.frozen, veh.available_time = self.frozen, self.available_time
+        veh.nodes, veh.inst_matrix = self.nodes, self.inst_matrix
+        veh.distance_matrix, veh.time_matrix = self.distance_matrix, self.time_matrix
+        veh.total_hard_violate_time = self.total_hard_violate_time
+        veh.total_soft_violate_time = self.total_soft_violate_time
+        veh.start_time, veh.wait_time = self.start_time, self.wait_time
+        veh.arrival, veh.departure, veh.wait_prefix = self.arrival, self.departure, self.wait_prefix
+        veh.cum_load, veh.cum_distance = self.cum_load, self.cum_distance
+        veh.slack, veh.latest_arrival = self.slack, self.latest_arrival
+        veh.hard_key, veh.soft_key, veh.soft_suffix, veh._rmq = \
+            self.hard_key, self.soft_key, self.soft_suffix, self._rmq
+        return veh
+
+    # 设置车辆的整条路径（如[0, p1, d1, ..., 结束depot]）并更新信息
+    def set_route(self, route):
+        self.route = array('i', route)
+        self.update_info(self.nodes)
+
+    # 冻结路径的前frozen个位置，并且车辆不能早于available_time离开位置frozen-1（在线调度中车辆执行路径、时间推进时调用）
+    def freeze(self, frozen, available_time):
+        if not 1 <= frozen < len(self.route) + (not self._has_end_depot()):
+            raise ValueError('车辆%s的冻结位置数%s超出了路径范围（结束depot不能冻结）' % (self.v_id, frozen))
+        self.frozen = frozen
+        self.available_time = available_time
+        self.update_info(self.nodes)
+
+    @property
+    def pd_route(self):
+        """以PD点对的形式表示路径，相邻的一对PD点合并为列表[p, d]，如[0, [1, 2], [3, 4], 5]"""
+        route = self.route
+        partner = self.nodes.partner
+        node_type = self.nodes.node_type
+        pd_route = []
+        k = 0
+        while k < len(route):
+            n = route[k]
+            if node_type[n] == PICKUP and k + 1 < len(route) and route[k + 1] == partner[n]:
+                pd_route.append([n, route[k + 1]])
+                k += 2
+            else:
+                pd_route.append(n)
+                k += 1
+        return pd_route
+
+    def _pd_position(self, index):
+        """pd_route中第index个元素在route中的位置"""
+        position = 0
+        for item in self.pd_route[:index]:
+            position += len(item) if isinstance(item, list) else 1
+        return position
+
+    def _has_end_depot(self):
+        return len(self.route) > 1 and self.nodes.node_type[self.route[-1]] == DEPOT
+
+    def insert_positions(self):
+        """可以插入新节点的位置范围[1, 返回值]，插入位置不能在结束depot之后"""
+        return len(self.route) - 1 if self._has_end_depot() else len(self.route)
 
     # 将PD点对插入到车辆的路径当中，每一PD对以列表的形式插入
     def insert_pd_node(self, p_id, d_id, index=0):
         if index == 0:
-            # self.route.append(p_id)  # 如果index=0，那么将pd点对依次插入到车经过的点的后面
-            # self.route.append(d_id)
-            self.pd_route.append([p_id, d_id])  # 将pd点对以列表的形式插入到pd_route中
-            self.route = flat(self.pd_route)  # 再将pd_route中的嵌套列表展平
-        else:  # 如果索引index不等于0
-            # self.route.insert(index,d_id)
-            # self.route.insert(index,p_id)
-            self.pd_route.insert(index, [p_id, d_id])
-            self.route = flat(self.pd_route)  # 再将pd_route中的嵌套列表展平
+            self.route.extend([p_id, d_id])  # 如果index=0，那么将pd点对依次插入到车经过的点的后面
+        else:  # 如果索引index不等于0，插入到pd_route中第index个元素之前
+            position = self._pd_position(index)
+            self.route[position:position] = array('i', [p_id, d_id])
         # node.belong_veh = self.v_id
         self.update_info(self.nodes)  # 类方法，参见下方，用来更新类对象veh的载量、距离、开始服务时间、时间窗违反
 
+    # 将取货点p插入到路径位置i之前、送货点d插入到路径位置j之前（i<=j，均为插入前的位置）
+    def insert_pd_node_at(self, p_id, d_id, i, j):
+        self.route.insert(j, d_id)
+        self.route.insert(i, p_id)
+        self.update_info(self.nodes)
+
     # 将结束depot插入到车辆的路径当中
     def insert_end_depot(self, end_depot_id):
-        self.pd_route.append(end_depot_id)
-        self.route = flat(self.pd_route)  # 再将pd_route中的嵌套列表展平
+        self.route.append(end_depot_id)
         self.update_info(self.nodes)
 
-    # 根据车辆路径中的索引删除节点
+    # 根据车辆路径中的索引删除节点（索引为pd_route中的索引）
     def del_node_by_index(self, index):
-        self.pd_route.pop(index)
-        self.route = flat(self.pd_route)  # 再将pd_route中的嵌套列表展平
+        position = self._pd_position(index)
+        item = self.pd_route[index]
+        del self.route[position:position + (len(item) if isinstance(item, list) else 1)]
         self.update_info(self.nodes)
 
     # 将PDNode类对象pd_node，从车辆路径当中删除
     def del_node_by_node(self, pd_node):
-        self.pd_route.remove([pd_node.p_id, pd_node.d_id])
-        self.route = flat(self.pd_route)  # 再将pd_route中的嵌套列表展平
+        self.route.remove(pd_node.p_id)
+        self.route.remove(pd_node.d_id)
         self.update_info(self.nodes)
 
     # 检查当前车辆的路径是否可行
     def check_vehicle_route_feasible(self):
-        # 如果违背硬时间窗，那么不可行
-        if self.total_hard_violate_time == 0:
+        # 如果违背硬时间窗或超过车辆载量，那么不可行
+        if self.total_hard_violate_time == 0 and self.load <= self.cap:
             fesible_status = 1
         else:
             fesible_status = 0
         return fesible_status
 
     # 更新载重、距离、开始服务时间、时间窗违反
-    def update_info(self, nodes):
-
-        # 更新载重，不用考虑载量，只要按depot，PD，PD，...的顺序访问所有的点，就不用考虑载量
-        '''
-        cur_load = 0
-        for n in self.route:
-            cur_load += nodes[n].demand
-        self.load = cur_load
-        '''
-
-        # 更新距离
-        cur_distance = 0
-        for i in range(len(self.route) - 1):  # 比如route=[0,1,2,3,4,5]
-            cur_distance += self.distance_matrix[self.route[i], self.route[i + 1]]
-        self.distance = cur_distance
-
-        # 更新开始服务时间、等待时间、违背时间
+    def update_info(self, nodes=None):
         # 取货点P的左右时间窗是硬时间窗，送货点D的左时间窗是硬时间窗，右时间窗是软时间窗，可以违背但有惩罚成本
-        # 早到等待
-        self.start_time = {0: 0}  # 开始depot的开始服务时间，默认从0开始
-        self.wait_time = {0: 0}  # 开始depot的等待时间，默认为0
-        arrival_time = 0
+        # 早到等待；晚于P点的右时间窗到达时，相当于不服务该节点（离开时间等于到达时间）
+        # 一次遍历路径，同时更新按路径位置保存的前缀信息；同一条路径上次的评价结果在缓存中时直接取回
+        table = self.nodes
+        route = self.route
+        cache = table.route_cache
+        key = (self.speed, self.frozen, self.available_time, route.tobytes())
+        info = cache.get(key)
+        if info is None:
+            info = self._evaluate_route(table, route)
+            cache.put(key, info, len(route))
+        (self.arrival, self.departure, self.wait_prefix, self.cum_load, self.cum_distance, self.slack,
+         self.latest_arrival, self.hard_key, self.soft_key, self.soft_suffix, self.start_time, self.wait_time,
+         self.load, self.total_hard_violate_time, self.total_soft_violate_time) = info
+        self.distance = self.cum_distance[-1]
+        self._rmq = None
+
+    def _evaluate_route(self, table, route):
+        """遍历路径route，返回update_info保存的全部信息（元组，顺序见update_info）"""
+        ready = table.ready_time
+        due = table.due_time
+        serv = table.service_time
+        demand = table.demand
+        node_type = table.node_type
+        latest = table.latest_arrival
+        dm = self.distance_matrix
+        tm = self.time_matrix
+
+        hold = self.frozen - 1  # 车辆不能早于available_time离开这个位置
+        available = self.available_time
+        first = route[0]
+        arrival = array('d', [0])
+        departure = array('d', [serv[first]])  # 开始depot的开始服务时间，默认从0开始
+        if hold == 0 and departure[0] < available:
+            departure[0] = available
+        wait = array('d', [0])
+        wait_prefix = array('d', [0, 0])
+        cum_load = array('d', [demand[first]])
+        cum_distance = array('d', [0])
+        hard_key = array('d', [INF])
+        soft_key = array('d', [INF])
+        start_time = array('d', [0])
         cur_total_hard_violate_time = 0
         cur_total_soft_violate_time = 0
-
-        for i in range(1, len(self.route) - 1):  # route=[0,p,d,p,d,...,p,d,2*len(container)+1]
-
-            # 传入的notes为按每个任务创建的Node类对象，其顺序依次为[0,p1,d1,p2,d2,...,pn,dn,2*len(container)+1]
-
-            # 到达节点i的时间 = 上一个节点i-1的开始服务时间 + 上一个节点i-1的服务时间 + 节点i-1到节点i的车辆行驶时间
-            arrival_time += self.start_time[self.route[i - 1]] + nodes[self.route[i - 1]].service_time + \
-                            self.time_matrix[self.route[i - 1], self.route[i]]
-
-            # 以下的i为取货点P，时间窗为硬时间窗，早到等待，不可晚到，如果晚到，则返回 infeasible
-            if nodes[self.route[i]].pickup_index == 0 and nodes[self.route[i]].delivery_index != 0:
-
-                if arrival_time <= nodes[self.route[i]].ready_time:  # 早于P点的左时间窗
-                    self.start_time[self.route[i]] = nodes[self.route[i]].ready_time
-                    self.wait_time[self.route[i]] = nodes[self.route[i]].ready_time - arrival_time
-
-                elif arrival_time >= nodes[self.route[i]].due_time:  # 晚于P点的右时间窗
-                    self.start_time[self.route[i]] = arrival_time - nodes[self.route[i]].service_time  # 相当于不服务该节点
-                    self.wait_time[self.route[i]] = 0
-                    cur_total_hard_violate_time += arrival_time + nodes[self.route[i]].service_time - nodes[
-                        self.route[i]].due_time
-
-                elif nodes[self.route[i]].ready_time < arrival_time and arrival_time < nodes[
-                    self.route[i]].due_time:  # 在P的左右时间窗内到达
-
-                    if arrival_time + nodes[self.route[i]].service_time > nodes[self.route[i]].due_time:  # 如果来不及全部服务完
-                        self.start_time[self.route[i]] = arrival_time
-                        self.wait_time[self.route[i]] = 0
-                        cur_total_hard_violate_time += arrival_time + nodes[self.route[i]].service_time - nodes[
-                            self.route[i]].due_time
-
+        max_load = cum_load[0]
+
+        prev = first
+        for k in range(1, len(route)):
+            n = route[k]
+            # 到达节点k的时间 = 上一个节点k-1的离开时间（开始服务时间+服务时间） + 节点k-1到节点k的车辆行驶时间
+            arrival_time = departure[-1] + tm[prev, n]
+            t = node_type[n]
+            if t == DEPOT:  # 结束depot没有时间窗惩罚
+                start = arrival_time
+                dep = start + serv[n]
+            elif arrival_time <= ready[n]:  # 早于左时间窗，等待
+                start = ready[n]
+                dep = start + serv[n]
+            else:
+                violation = arrival_time + serv[n] - due[n]
+                if t == PICKUP:
+                    if arrival_time >= due[n]:  # 晚于P点的右时间窗
+                        start = arrival_time - serv[n]  # 相当于不服务该节点
                     else:
-                        self.start_time[self.route[i]] = arrival_time
-                        self.wait_time[self.route[i]] = 0
-
-            # 以下i为送货点D，左时间窗为硬时间窗，早到等待，右时间窗为软时间窗
-            if nodes[self.route[i]].pickup_index != 0 and nodes[self.route[i]].delivery_index == 0:
-
-                if arrival_time <= nodes[self.route[i]].ready_time:  # 早于D点的左时间窗
-                    self.start_time[self.route[i]] = nodes[self.route[i]].ready_time
-                    self.wait_time[self.route[i]] = nodes[self.route[i]].ready_time - arrival_time
-
-                elif arrival_time + nodes[self.route[i]].service_time <= nodes[self.route[i]].due_time:  # 来得及服务
-                    self.start_time[self.route[i]] = arrival_time
-                    self.wait_time[self.route[i]] = 0
-
-                elif arrival_time + nodes[self.route[i]].service_time >= nodes[self.route[i]].due_time:  # 来不及服务
-                    self.start_time[self.route[i]] = arrival_time
-                    self.wait_time[self.route[i]] = 0
-                    cur_total_soft_violate_time += arrival_time + nodes[self.route[i]].service_time - nodes[
-                        self.route[i]].due_time
-
-        # 计算结束depot的开始服务时间和等待时间（结束depot没有惩罚成本）
-        self.start_time[self.route[-1]] = self.start_time[self.route[-2]] + nodes[self.route[-2]].service_time + \
-                                          self.time_matrix[self.route[-2], self.route[-1]]
-        self.wait_time[self.route[-1]] = 0  # 在结束depot上，等待时间为0
+                        start = arrival_time
+                    if violation > 0:
+                        cur_total_hard_violate_time += violation
+                else:
+                    start = arrival_time
+                    if violation > 0:  # 来不及服务，违背D点的软时间窗
+                        cur_total_soft_violate_time += violation
+                dep = start + serv[n]
+            if k == hold and dep < available:
+                dep = available
+            w = start - arrival_time if start > arrival_time else 0
+
+            arrival.append(arrival_time)
+            departure.append(dep)
+            wait.append(w)
+            wait_prefix.append(wait_prefix[-1] + w)
+            cum_load.append(cum_load[-1] + demand[n])
+            if cum_load[-1] > max_load:
+                max_load = cum_load[-1]
+            cum_distance.append(cum_distance[-1] + dm[prev, n])
+            start_time.append(start)
+
+            # 剩余时间窗：到达时间最多还能推迟多少（加上wait_prefix[k]，以便用区间最小值计算任意区间的松弛量）
+            if t == PICKUP:
+                hard_key.append(latest[n] - arrival_time + wait_prefix[k])
+                soft_key.append(INF)
+            elif t == DEPOT:
+                hard_key.append(INF)
+                soft_key.append(INF)
+            else:
+                hard_key.append(INF)
+                if arrival_time > ready[n] and arrival_time + serv[n] > due[n]:  # 已经违背软时间窗，任何推迟都会增加违背量
+                    soft_key.append(wait_prefix[k])
+                else:
+                    soft_key.append(max(ready[n], due[n] - serv[n]) - arrival_time + wait_prefix[k])
+            prev = n
+
+        # forward time slack及后缀最小值
+        size = len(route)
+        slack = array('d', [INF]) * size
+        soft_suffix = array('d', [INF]) * (size + 1)
+        hard_min = INF
+        for k in range(size - 1, -1, -1):
+            if hard_key[k] < hard_min:
+                hard_min = hard_key[k]
+            slack[k] = hard_min - wait_prefix[k]
+            soft_suffix[k] = soft_key[k] if soft_key[k] < soft_suffix[k + 1] else soft_suffix[k + 1]
+
+        latest_arrival = array('d', [a + s for a, s in zip(arrival, slack)])
+        return (arrival, departure, wait_prefix, cum_load, cum_distance, slack, latest_arrival, hard_key, soft_key,
+                soft_suffix, start_time, wait, max_load, cur_total_hard_violate_time, cur_total_soft_violate_time)
+
+    def _range_tables(self):
+        """区间最值查询用的稀疏表，路径变化后第一次查询时构造，O(L log L)"""
+        if self._rmq is None:
+            self._rmq = (_build_sparse_table(self.hard_key, min), _build_sparse_table(self.soft_key, min),
+                         _build_sparse_table(self.cum_load, max))
+        return self._rmq
+
+    def soft_delay_delta(self, lo, hi, push, soft_min):
+        """到达位置lo的时间推迟push后，位置[lo, hi)上送货点软时间窗违背量的增加值。
+        push不超过这一段送货点的剩余软时间窗（soft_min）时为0，O(1)；否则沿路径传播，推迟量被等待时间吸收后即停止
+        """
+        if push <= 0 or push <= soft_min - self.wait_prefix[lo]:
+            return 0
+        table = self.nodes
+        route = self.route
+        arrival = self.arrival
+        wait_prefix = self.wait_prefix
+        delta = 0
+        for k in range(lo, hi):
+            delay = push - (wait_prefix[k] - wait_prefix[lo])
+            if delay <= 0:
+                break
+            n = route[k]
+            if table.node_type[n] != PICKUP and table.node_type[n] != DEPOT:
+                r, d, s = table.ready_time[n], table.due_time[n], table.service_time[n]
+                delta += _soft_violation(arrival[k] + delay, r, d, s) - _soft_violation(arrival[k], r, d, s)
+        return delta
+
+    def soft_advance_delta(self, lo, pull):
+        """到达位置lo的时间提前-pull（pull<0）后，后续送货点软时间窗违背量的变化值（<=0）。
+        提前量遇到等待（到达时间早于左时间窗）即被吸收，只沿路径传播到被吸收为止
+        """
+        table = self.nodes
+        route = self.route
+        arrival = self.arrival
+        delta = 0
+        for k in range(lo, len(route)):
+            if pull >= 0:
+                break
+            n = route[k]
+            r = table.ready_time[n]
+            old_arrival = arrival[k]
+            new_arrival = old_arrival + pull
+            if table.node_type[n] != PICKUP and table.node_type[n] != DEPOT:
+                d, s = table.due_time[n], table.service_time[n]
+                delta += _soft_violation(new_arrival, r, d, s) - _soft_violation(old_arrival, r, d, s)
+            pull = (new_arrival if new_arrival > r else r) - (old_arrival if old_arrival > r else r)
+        return delta
+
+    # 评价将路径位置[lo, hi)上的点替换为middle中的点后的成本和可行性，不改变路径
+    def evaluate_splice(self, lo, hi, middle):
+        """用于PD点对的移动（删除、重新插入、交换）的增量评价，返回(增加的行驶距离, 增加的软时间窗违背量, 是否可行)。
+        要求1<=lo<=hi<len(route)，且middle与被替换的点相比只增减了完整的PD点对（位置hi之后的载重不变）。
+        只模拟middle上的点，O(len(middle))；位置hi之后的推迟量用slack和soft_delay_delta评价，
+        提前量用soft_advance_delta沿路径传播到被等待时间吸收为止
+        """
+        if self.total_hard_violate_time > 0 or self.load > self.cap:
+            return INF, INF, False
+        table = self.nodes
+        ready = table.ready_time
+        due = table.due_time
+        serv = table.service_time
+        demand = table.demand
+        node_type = table.node_type
+        latest = table.latest_arrival
+        dm = self.distance_matrix
+        tm = self.time_matrix
+        route = self.route
+        arrival = self.arrival
+
+        prev = route[lo - 1]
+        dep = self.departure[lo - 1]
+        load = self.cum_load[lo - 1]
+        delta_distance = 0
+        delta_soft = 0
+        for n in middle:
+            arr = dep + tm[prev, n]
+            if node_type[n] == PICKUP:
+                if arr > latest[n]:
+                    return INF, INF, False
+            else:
+                delta_soft += _soft_violation(arr, ready[n], due[n], serv[n])
+            load += demand[n]
+            if load > self.cap:
+                return INF, INF, False
+            dep = (arr if arr > ready[n] else ready[n]) + serv[n]
+            delta_distance += dm[prev, n]
+            prev = n
+        c = route[hi]
+        delta_distance += dm[prev, c] - (self.cum_distance[hi] - self.cum_distance[lo - 1])
+        for k in range(lo, hi):  # 被替换的送货点原来的软时间窗违背量
+            n = route[k]
+            if node_type[n] != PICKUP:
+                delta_soft -= _soft_violation(arrival[k], ready[n], due[n], serv[n])
+
+        push = dep + tm[prev, c] - arrival[hi]
+        if push > 0:
+            if push > self.slack[hi]:
+                return INF, INF, False
+            delta_soft += self.soft_delay_delta(hi, len(route), push, self.soft_suffix[hi])
+        elif push < 0:
+            delta_soft += self.soft_advance_delta(hi, push)
+        return delta_distance, delta_soft, True
+
+    # 将路径位置[lo, hi)上的点替换为middle中的点，并更新信息
+    def splice(self, lo, hi, middle):
+        self.route[lo:hi] = array('i', middle)
+        self.update_info(self.nodes)
 
-        # 更新总的违背的软硬时间窗
-        self.total_hard_violate_time = cur_total_hard_violate_time
-        self.total_soft_violate_time = cur_total_soft_violate_time
+    # 评价将取货点p插入到路径位置i之前、送货点d插入到路径位置j之前（i<=j，均为插入前的位置）的成本和可行性，不改变路径
+    def evaluate_insertion(self, p_id, d_id, i, j):
+        """返回(增加的行驶距离, 增加的软时间窗违背量, 是否可行)，不可行时后两项分别为inf和False。
+        可行是指插入后不违背取货点的硬时间窗，也不超过车辆载量；当前路径本身不可行时也返回不可行。
+        除软时间窗违背量需要向后传播的情况外，查询时间为O(1)。
+        """
+        if self.total_hard_violate_time > 0 or self.load > self.cap:
+            return INF, INF, False
+        table = self.nodes
+        ready = table.ready_time
+        serv = table.service_time
+        dm = self.distance_matrix
+        tm = self.time_matrix
+        route = self.route
+        arrival = self.arrival
+        departure = self.departure
+        wait_prefix = self.wait_prefix
+        hard_table, soft_table, load_table = self._range_tables()
+
+        # 载重：位置i-1到j-1离开时的载重都增加p点的需求量
+        if _range_query(load_table, i - 1, j - 1, max) + table.demand[p_id] > self.cap:
+            return INF, INF, False
+
+        # 取货点p
+        a = route[i - 1]
+        arr_p = departure[i - 1] + tm[a, p_id]
+        if arr_p > table.latest_arrival[p_id]:
+            return INF, INF, False
+        dep_p = (arr_p if arr_p > ready[p_id] else ready[p_id]) + serv[p_id]
+
+        delta_soft = 0
+        if i == j:  # p和d相邻插入
+            delta_distance = dm[a, p_id] + dm[p_id, d_id]
+            prev_d = p_id
+            dep_prev_d = dep_p
+        else:
+            b = route[i]
+            delta_distance = dm[a, p_id] + dm[p_id, b] - dm[a, b]
+            push = dep_p + tm[p_id, b] - arrival[i]
+            if push > 0:
+                # 位置[i, j)上的取货点不能违背硬时间窗
+                if _range_query(hard_table, i, j - 1, min) - wait_prefix[i] < push:
+                    return INF, INF, False
+                delta_soft += self.soft_delay_delta(i, j, push,
+                                                     _range_query(soft_table, i, j - 1, min))
+                delay = push - (wait_prefix[j] - wait_prefix[i])  # 推迟量经过等待时间吸收后，位置j-1离开时间的推迟量
+            else:
+                delay = 0
+            prev_d = route[j - 1]
+            dep_prev_d = departure[j - 1] + (delay if delay > 0 else 0)
+            delta_distance += dm[prev_d, d_id]
+
+        # 送货点d
+        arr_d = dep_prev_d + tm[prev_d, d_id]
+        delta_soft += _soft_violation(arr_d, ready[d_id], table.due_time[d_id], serv[d_id])
+        dep_d = (arr_d if arr_d > ready[d_id] else ready[d_id]) + serv[d_id]
+
+        # 后续路径
+        if j < len(route):
+            c = route[j]
+            delta_distance += dm[d_id, c] - dm[route[j - 1], c]
+            push = dep_d + tm[d_id, c] - arrival[j]
+            if push > self.slack[j]:
+                return INF, INF, False
+            delta_soft += self.soft_delay_delta(j, len(route), push, self.soft_suffix[j])
+        return delta_distance, delta_soft, True
 
     def __str__(self):  # 重载print()
         description = "车辆%s的信息:\n" \
@@ -188,5 +555,15 @@ class Vehicle(object):
                       "路径：%s \n" \
                       "开始服务时间：%s \n" \
                       "等待时间：%s" % (self.v_id, self.distance, self.total_soft_violate_time, self.total_hard_violate_time,
-                                   self.pd_route, self.start_time, self.wait_time)
-        return description
\ No newline at end of file
+                                   self.pd_route, self.start_time.tolist(), self.wait_time.tolist())
+        return description
+
+
+# 高频调用的方法只在profiler开启期间替换为计时的包装函数，关闭时没有额外开销（见profiler.instrument）
+profiler.instrument(Vehicle, 'update_info', 'vehicle.update_info')
+profiler.instrument(Vehicle, '_evaluate_route', 'vehicle.evaluate_route')
+profiler.instrument(Vehicle, 'splice', 'vehicle.splice')
+profiler.instrument(Vehicle, 'copy', 'vehicle.copy')
+profiler.instrument(Vehicle, 'evaluate_insertion', 'vehicle.evaluate_insertion')
+profiler.instrument(Vehicle, 'evaluate_splice', 'vehicle.evaluate_splice')
+profiler.instrument(sys.modules[__name__], 'flat', 'vehicle.flat')